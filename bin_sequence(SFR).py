@@ -17,8 +17,10 @@ from featmaker_subscript import weight_generator
 from symchestra_subscript import returnSeeds
 from symchestra_subscript import filterSeeds
 
+from branch_coverage import Coverage
 from klee import KLEE
 from klee import KLEESymTuner
+from launcher import copy_tree
 from logger import get_logger
 from symtuner import TimeBudgetHandler
 
@@ -36,6 +38,8 @@ if __name__=="__main__":
     argparser.add_argument('output_dir')
     argparser.add_argument('--total_budget', default=86400)
     argparser.add_argument('--n_scores', default=20, type=int)
+    argparser.add_argument('--binary-weights', action='store_true',
+                        help='Write the weights of an iteration into one binary file (needs a KLEE supporting --weight-index)')
     argparser.add_argument('--main_option', default='featmaker')
 
     # Symtuner Parser
@@ -61,6 +65,12 @@ if __name__=="__main__":
                         help='Log the debug messages')
     argparser.add_argument('--gcov-depth', default=1, type=int,
                         help='Depth to search for gcda and gcov files from gcov_obj to calculate code coverage (default=1)')
+    argparser.add_argument('--replay-workers', default=1, type=int, metavar='INT',
+                        help='The number of workers replaying testcases concurrently (default=1)')
+    argparser.add_argument('--replay-timeout', default=0.1, type=float, metavar='FLOAT',
+                        help='Timeout of replaying each testcase in seconds (default=0.1)')
+    argparser.add_argument('--stream-ktests', action='store_true',
+                        help='Replay each testcase as soon as KLEE writes it, while KLEE is still running')
 
     arguments = argparser.parse_args()
 
@@ -111,21 +121,26 @@ if __name__=="__main__":
             get_logger().info('Example space configuration json is generated: example-space.json')
         sys.exit(0)
 
-    symtuner = KLEESymTuner('/root/symchestra/klee_featmaker/build/bin/klee-replay', 'gcov', 10, arguments.search_space, arguments.exploit_portion)
+    symtuner = KLEESymTuner('/root/symchestra/klee_featmaker/build/bin/klee-replay', 'gcov', 10, arguments.search_space, arguments.exploit_portion,
+                            replay_workers=arguments.replay_workers,
+                            replay_timeout=arguments.replay_timeout)
     evaluation_argument = {'folder_depth': arguments.gcov_depth}
 
     pconfig = load_pgm_config(f"configs/{pgm}.json")
     pconfig["gcov_path"] = os.getcwd() + "/" + pconfig["gcov_path"] + pconfig["exec_dir"]
     llvm_dir = os.getcwd() + "/" + pconfig["pgm_dir"]
-    os.system(f"cp -r {llvm_dir} {top_dir}/")
+    copy_tree(llvm_dir, top_dir)
 
     fg = feature_generator.feature_generator(data, top_dir, arguments)
 
     if arguments.main_option == "featmaker":
-        wg = weight_generator.learning_weight_generator(data, top_dir, arguments.n_scores)
+        wg = weight_generator.learning_weight_generator(data, top_dir, arguments.n_scores,
+                                                        weight_format="binary" if arguments.binary_weights else "text")
     else:
         wg = weight_generator.random_weight_generator(data, top_dir, arguments.n_scores)
     ke = klee_executor.klee_executor(pconfig, top_dir, arguments, symtuner, wg)
+    if arguments.stream_ktests:
+        ke.on_testcase = lambda ktest: symtuner.prefetch(pconfig, ktest)
 
     data = {}
     start_time = time.time()
@@ -146,8 +161,8 @@ if __name__=="__main__":
     feat_iter = 0
     weight_idx = 0
 
-    allCoverage = set()
-    curCoverage = set()
+    allCoverage = Coverage()
+    curCoverage = 0
     execCount = 0
     
     os.mkdir(f"{top_dir}/result/symtuner")
@@ -210,9 +225,9 @@ if __name__=="__main__":
         
         with coverage_csv.open('a') as stream:
             stream.write(f'{elapsed}, {len(allCoverage)}\n')
-        with found_bugs_txt.open('w') as stream:
+        with found_bugs_txt.open('a') as stream:
             stream.writelines((f'Testcase: {Path(symtuner.get_testcase_causing_bug(bug)).absolute()} '
-                               f'Bug: {bug}\n' for bug in bugs))
+                               f'Bug: {bug}\n' for bug in symtuner.pop_unreported_bugs()))
         execution_num += 1
 
     mode = "symtuner"
@@ -236,7 +251,8 @@ if __name__=="__main__":
         
         elapsed = time_budget_handler_2.elapsed
         coverage, bugs = symtuner.get_coverage_and_bugs()
-        allCoverage = coverage | symtuner.tempfeatmakerCoverage
+        # FeatMaker coverage is already accumulated in `coverage`
+        allCoverage = coverage
         execCount += 1
         
         get_logger().info(f'Execution Number: {i + 1} '
@@ -246,13 +262,13 @@ if __name__=="__main__":
                           f'All Coverage: {len(allCoverage)} '
                           f'execCount : {execCount}')
 
-        curCoverage = allCoverage.copy()
+        curCoverage = len(allCoverage)
 
         with coverage_csv.open('a') as stream:
             stream.write(f'{elapsed}, {len(allCoverage)}\n')
-        with found_bugs_txt.open('w') as stream:
+        with found_bugs_txt.open('a') as stream:
             stream.writelines((f'Testcase: {Path(symtuner.get_testcase_causing_bug(bug)).absolute()} '
-                               f'Bug: {bug}\n' for bug in bugs))
+                               f'Bug: {bug}\n' for bug in symtuner.pop_unreported_bugs()))
 
         execution_num += 1
 
@@ -274,7 +290,8 @@ if __name__=="__main__":
         
         elapsed = time_budget_handler_3.elapsed
         coverage, bugs = symtuner.get_coverage_and_bugs()
-        allCoverage = coverage | symtuner.tempfeatmakerCoverage
+        # FeatMaker coverage is already accumulated in `coverage`
+        allCoverage = coverage
         execCount += 1
         
         get_logger().info(f'Execution Number: {i + 1} '
@@ -284,13 +301,13 @@ if __name__=="__main__":
                           f'All Coverage: {len(allCoverage)} '
                           f'execCount : {execCount}')
 
-        curCoverage = allCoverage.copy()
+        curCoverage = len(allCoverage)
 
         with coverage_csv.open('a') as stream:
             stream.write(f'{elapsed}, {len(allCoverage)}\n')
-        with found_bugs_txt.open('w') as stream:
+        with found_bugs_txt.open('a') as stream:
             stream.writelines((f'Testcase: {Path(symtuner.get_testcase_causing_bug(bug)).absolute()} '
-                               f'Bug: {bug}\n' for bug in bugs))
+                               f'Bug: {bug}\n' for bug in symtuner.pop_unreported_bugs()))
 
         execution_num += 1
 
@@ -17,8 +17,10 @@ from featmaker_subscript import weight_generator
 from symchestra_subscript import returnSeeds
 from symchestra_subscript import filterSeeds
 
+from branch_coverage import Coverage
 from klee import KLEE
 from klee import KLEESymTuner
+from launcher import copy_tree
 from logger import get_logger
 from symtuner import TimeBudgetHandler
 
@@ -36,11 +38,25 @@ if __name__=="__main__":
     argparser.add_argument('output_dir')
     argparser.add_argument('--total_budget', default=86400)
     argparser.add_argument('--n_scores', default=20, type=int)
+    argparser.add_argument('--binary-weights', action='store_true',
+                        help='Write the weights of an iteration into one binary file (needs a KLEE supporting --weight-index)')
     argparser.add_argument('--main_option', default='featmaker')
 
     # Others
     argparser.add_argument('--debug', action='store_true',
                         help='Log the debug messages')
+    argparser.add_argument('--replay-workers', default=1, type=int, metavar='INT',
+                        help='The number of workers replaying testcases concurrently (default=1)')
+    argparser.add_argument('--replay-timeout', default=0.1, type=float, metavar='FLOAT',
+                        help='Timeout of replaying each testcase in seconds (default=0.1)')
+    argparser.add_argument('--stream-ktests', action='store_true',
+                        help='Replay each testcase as soon as KLEE writes it, while KLEE is still running')
+    argparser.add_argument('--klee-jobs', default=1, type=int, metavar='INT',
+                        help='The number of KLEE instances running concurrently, one weight index each (default=1)')
+    argparser.add_argument('--parallel-sweep', action='store_true',
+                        help='Run the KLEE instances of all weight indices of an iteration concurrently (same as --klee-jobs=n_scores)')
+    argparser.add_argument('--klee-max-memory', default=None, type=int, metavar='MB',
+                        help='Total memory in MB shared by the running KLEE instances (default=no limit)')
 
     arguments = argparser.parse_args()
 
@@ -91,21 +107,27 @@ if __name__=="__main__":
             get_logger().info('Example space configuration json is generated: example-space.json')
         sys.exit(0)
 
-    symtuner = KLEESymTuner('/root/symchestra/klee_featmaker/build/bin/klee-replay', 'gcov', 10, arguments.search_space, arguments.exploit_portion)
+    symtuner = KLEESymTuner('/root/symchestra/klee_featmaker/build/bin/klee-replay', 'gcov', 10, arguments.search_space, arguments.exploit_portion,
+                            replay_workers=arguments.replay_workers,
+                            replay_timeout=arguments.replay_timeout)
     evaluation_argument = {'folder_depth': arguments.gcov_depth}
 
     pconfig = load_pgm_config(f"configs/{pgm}.json")
     pconfig["gcov_path"] = os.getcwd() + "/" + pconfig["gcov_path"] + pconfig["exec_dir"]
     llvm_dir = os.getcwd() + "/" + pconfig["pgm_dir"]
-    os.system(f"cp -r {llvm_dir} {top_dir}/")
+    copy_tree(llvm_dir, top_dir)
 
     fg = feature_generator.feature_generator(data, top_dir, arguments)
 
     if arguments.main_option == "featmaker":
-        wg = weight_generator.learning_weight_generator(data, top_dir, arguments.n_scores)
+        wg = weight_generator.learning_weight_generator(data, top_dir, arguments.n_scores,
+                                                        weight_format="binary" if arguments.binary_weights else "text")
     else:
         wg = weight_generator.random_weight_generator(data, top_dir, arguments.n_scores)
     ke = klee_executor.klee_executor(pconfig, top_dir, arguments, symtuner, wg)
+    if arguments.stream_ktests:
+        ke.on_testcase = lambda ktest: symtuner.prefetch(pconfig, ktest)
+        ke.on_discard = symtuner.discard_prefetched
 
     data = {}
     start_time = time.time()
@@ -123,7 +145,7 @@ if __name__=="__main__":
     feat_iter = 0
     weight_idx = 0
 
-    allCoverage = set()
+    allCoverage = Coverage()
     execCount = 0
     
     os.mkdir(f"{top_dir}/result/iteration-{feat_iter}")
@@ -138,55 +160,67 @@ if __name__=="__main__":
         for _ in range(arguments.n_scores):
             symtuner.featmakerdata.append(dict())
 
+    n_klee_jobs = arguments.n_scores if arguments.parallel_sweep else arguments.klee_jobs
+    scheduler = klee_executor.klee_scheduler(ke, get_logger, n_jobs=n_klee_jobs,
+                                             max_memory=arguments.klee_max_memory)
+
     ### FeatMaker (Sequence)
-    for i, _ in enumerate(time_budget_handler):
-        weight_idx = i % arguments.n_scores
-        parameters['-output-dir'] = f"{top_dir}/result/iteration-{feat_iter}/{feat_step}"
-        testcases_featmaker = ke.execute_klee(iteration=feat_iter, parameters=parameters, weight_idx=weight_idx, get_logger=get_logger, 
-                                              flag="featmaker", flag2="parallel")
-        symtuner.add(pconfig, testcases_featmaker, parameters=parameters, evaluation_kwargs=evaluation_argument, rm_cmd=rm_cmd, flag="basefeatmaker")
-
-        for key, value in symtuner.tempfeatmakerdata.items():
-            symtuner.featmakerdata[weight_idx][key] = value
+    try:
+        for i, _ in enumerate(time_budget_handler):
+            # Submit the runs of all weight indices of the iteration at once
+            if len(scheduler) == 0:
+                for j in range(arguments.n_scores):
+                    run_parameters = dict(parameters)
+                    run_parameters['-output-dir'] = f"{top_dir}/result/iteration-{feat_iter}/{feat_step + j}"
+                    scheduler.submit((j, run_parameters), iteration=feat_iter, parameters=run_parameters,
+                                     weight_idx=j, flag="featmaker", flag2="parallel")
+            (weight_idx, run_parameters), testcases_featmaker = scheduler.next_completed()
+            symtuner.add(pconfig, testcases_featmaker, parameters=run_parameters, evaluation_kwargs=evaluation_argument, rm_cmd=rm_cmd, flag="basefeatmaker")
+
+            for key, value in symtuner.tempfeatmakerdata.items():
+                symtuner.featmakerdata[weight_idx][key] = value
             
-        feat_step += 1  
+            feat_step += 1  
 
-        elapsed = time_budget_handler.elapsed
-        coverage, bugs = symtuner.get_coverage_and_bugs()
-        allCoverage |= symtuner.allCoverage
-        execCount += 1
+            elapsed = time_budget_handler.elapsed
+            coverage, bugs = symtuner.get_coverage_and_bugs()
+            allCoverage |= symtuner.allCoverage
+            execCount += 1
 
-        get_logger().info(f'Execution Number: {execution_num + 1} '
-                          f'Time budget: 120 '
-                          f'Time elapsed: {elapsed} '
-                          f'All Coverage: {len(allCoverage)} '
-                          f'Steps: {feat_iter} {feat_step} '
-                          f'execCount : {execCount}')
+            get_logger().info(f'Execution Number: {execution_num + 1} '
+                              f'Time budget: 120 '
+                              f'Time elapsed: {elapsed} '
+                              f'All Coverage: {len(allCoverage)} '
+                              f'Steps: {feat_iter} {feat_step} '
+                              f'execCount : {execCount}')
 
-        if execCount % arguments.n_scores == 0 and execCount != 0:
-            execCount = 0
+            if execCount % arguments.n_scores == 0 and execCount != 0:
+                execCount = 0
 
-            feat_iter += 1
+                feat_iter += 1
 
-            os.mkdir(f"{top_dir}/result/iteration-{feat_iter}")
-            os.mkdir(f"{top_dir}/weight/iteration-{feat_iter}")
+                os.mkdir(f"{top_dir}/result/iteration-{feat_iter}")
+                os.mkdir(f"{top_dir}/weight/iteration-{feat_iter}")
 
-            print(f"Generate features in iteration: {feat_iter - 1}")
-            fg.n_scores = len(symtuner.featmakerdata)
-            fg.collect(feat_iter, symtuner.featmakerdata)
-            fg.extract_feature()
+                print(f"Generate features in iteration: {feat_iter - 1}")
+                fg.n_scores = len(symtuner.featmakerdata)
+                fg.collect(feat_iter, symtuner.featmakerdata)
+                fg.extract_feature()
 
-            print(f"Generate weights in iteration: {feat_iter - 1}")
-            wg.n_weights = len(symtuner.featmakerdata)
-            wg.generate_weight(feat_iter)
-            ke.feat_len = len(wg.data["features"])
+                print(f"Generate weights in iteration: {feat_iter - 1}")
+                wg.n_weights = len(symtuner.featmakerdata)
+                wg.generate_weight(feat_iter)
+                ke.feat_len = len(wg.data["features"])
         
-        with coverage_csv.open('a') as stream:
-            stream.write(f'{elapsed}, {len(allCoverage)}\n')
-        with found_bugs_txt.open('w') as stream:
-            stream.writelines((f'Testcase: {Path(symtuner.get_testcase_causing_bug(bug)).absolute()} '
-                               f'Bug: {bug}\n' for bug in bugs))
-        execution_num += 1
+            with coverage_csv.open('a') as stream:
+                stream.write(f'{elapsed}, {len(allCoverage)}\n')
+            with found_bugs_txt.open('a') as stream:
+                stream.writelines((f'Testcase: {Path(symtuner.get_testcase_causing_bug(bug)).absolute()} '
+                                   f'Bug: {bug}\n' for bug in symtuner.pop_unreported_bugs()))
+            execution_num += 1
+    finally:
+        # Do not leave KLEE runs behind on errors or interrupts
+        scheduler.close()
     os.chdir(root_dir)
             
     coverage, bugs = symtuner.get_coverage_and_bugs()
@@ -17,9 +17,12 @@ from featmaker_subscript import weight_generator
 from symchestra_subscript import returnSeeds
 from symchestra_subscript import filterSeeds
 
+from branch_coverage import Coverage
 from klee import KLEE
 from klee import KLEESymTuner
+from launcher import copy_tree
 from logger import get_logger
+from symtuner import ReplayPipeline
 from symtuner import TimeBudgetHandler
 
 def load_pgm_config(config_file):
@@ -36,6 +39,14 @@ if __name__=="__main__":
     argparser.add_argument('output_dir')
     argparser.add_argument('--total_budget', default=86400)
     argparser.add_argument('--debug', action='store_true', help='Log the debug messages')
+    argparser.add_argument('--replay-workers', default=1, type=int, metavar='INT',
+                        help='The number of workers replaying testcases concurrently (default=1)')
+    argparser.add_argument('--replay-timeout', default=0.1, type=float, metavar='FLOAT',
+                        help='Timeout of replaying each testcase in seconds (default=0.1)')
+    argparser.add_argument('--stream-ktests', action='store_true',
+                        help='Replay each testcase as soon as KLEE writes it, while KLEE is still running')
+    argparser.add_argument('--pipeline-replay', action='store_true',
+                        help='Replay the testcases of a KLEE run in the background while the next run executes')
     arguments = argparser.parse_args()
 
     if arguments.pgm is None:
@@ -77,15 +88,19 @@ if __name__=="__main__":
     if arguments.debug:
         get_logger().setLevel('DEBUG')
 
-    symtuner = KLEESymTuner('/root/symchestra/klee_featmaker/build/bin/klee-replay', 'gcov', 10, arguments.search_space, arguments.exploit_portion)
+    symtuner = KLEESymTuner('/root/symchestra/klee_featmaker/build/bin/klee-replay', 'gcov', 10, arguments.search_space, arguments.exploit_portion,
+                            replay_workers=arguments.replay_workers,
+                            replay_timeout=arguments.replay_timeout)
     evaluation_argument = {'folder_depth': arguments.gcov_depth}
 
     pconfig = load_pgm_config(f"configs/{pgm}.json")
     pconfig["gcov_path"] = os.getcwd() + "/" + pconfig["gcov_path"] + pconfig["exec_dir"]
     llvm_dir = os.getcwd() + "/" + pconfig["pgm_dir"]
-    os.system(f"cp -r {llvm_dir} {top_dir}/")
+    copy_tree(llvm_dir, top_dir)
 
     ke = klee_executor.klee_executor(pconfig, top_dir, arguments, symtuner)
+    if arguments.stream_ktests:
+        ke.on_testcase = lambda ktest: symtuner.prefetch(pconfig, ktest)
 
     data = {}
     start_time = time.time()
@@ -98,7 +113,8 @@ if __name__=="__main__":
     rm_cmd = ' '.join(['rm', '-rf', pconfig['gcov_file'], pconfig['gcda_file']])
     
     ram_step = 0
-    allCoverage = set()
+    allCoverage = Coverage()
+    pipeline = ReplayPipeline(symtuner, pconfig, evaluation_argument, rm_cmd, background=arguments.pipeline_replay)
     
     os.mkdir(f"{top_dir}/result/ram")
 
@@ -111,12 +127,14 @@ if __name__=="__main__":
         
         testcases_symtuner = ke.execute_klee(iteration=-1, parameters=parameters, weight_idx=None, get_logger=get_logger, 
                                             flag="symtuner", flag2="parallel", ram=True)
-        symtuner.add(pconfig, testcases_symtuner, parameters=parameters, evaluation_kwargs=evaluation_argument, rm_cmd=rm_cmd, flag="baseram")
-        symtuner.combination_version_add()
+        pipeline.submit(ram_step, testcases_symtuner, parameters=dict(parameters), flag="baseram")
+        for _ in pipeline.commit():
+            symtuner.combination_version_add()
         
         elapsed = time_budget_handler.elapsed
         coverage, bugs = symtuner.get_coverage_and_bugs()
-        allCoverage = coverage | symtuner.tempfeatmakerCoverage
+        # FeatMaker coverage is already accumulated in `coverage`
+        allCoverage = coverage
         
         get_logger().info(f'Execution Number: {i + 1} '
                           f'Time budget: 3600 '
@@ -125,10 +143,13 @@ if __name__=="__main__":
 
         with coverage_csv.open('a') as stream:
             stream.write(f'{elapsed}, {len(allCoverage)}\n')
-        with found_bugs_txt.open('w') as stream:
+        with found_bugs_txt.open('a') as stream:
             stream.writelines((f'Testcase: {Path(symtuner.get_testcase_causing_bug(bug)).absolute()} '
-                               f'Bug: {bug}\n' for bug in bugs))
+                               f'Bug: {bug}\n' for bug in symtuner.pop_unreported_bugs()))
 
+    for _ in pipeline.commit(wait=True):
+        pass
+    pipeline.close()
     os.chdir(root_dir)
             
     coverage, bugs = symtuner.get_coverage_and_bugs()
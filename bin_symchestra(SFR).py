@@ -1,5 +1,4 @@
 from subprocess import Popen, PIPE
-from collections import defaultdict
 from pathlib import Path
 import json
 import time
@@ -10,6 +9,8 @@ import pickle
 import shutil
 import sys
 
+import numpy as np
+
 from featmaker_subscript import klee_executor
 from featmaker_subscript import feature_generator
 from featmaker_subscript import weight_generator
@@ -17,9 +18,13 @@ from featmaker_subscript import weight_generator
 from symchestra_subscript import returnSeeds
 from symchestra_subscript import filterSeeds
 
+from branch_coverage import Coverage
 from klee import KLEE
 from klee import KLEESymTuner
+from kquery import QueryFingerprintStore
+from launcher import copy_tree
 from logger import get_logger
+from symtuner import ReplayPipeline
 from symtuner import TimeBudgetHandler
 
 def load_pgm_config(config_file):
@@ -35,6 +40,8 @@ if __name__=="__main__":
     argparser.add_argument('output_dir')
     argparser.add_argument('--total_budget', default=86400)
     argparser.add_argument('--n_scores', default=20, type=int)
+    argparser.add_argument('--binary-weights', action='store_true',
+                        help='Write the weights of an iteration into one binary file (needs a KLEE supporting --weight-index)')
     argparser.add_argument('--main_option', default='featmaker')
     argparser.add_argument('--eta_num', default=10)
 
@@ -62,6 +69,20 @@ if __name__=="__main__":
                         help='Log the debug messages')
     argparser.add_argument('--gcov-depth', default=1, type=int,
                         help='Depth to search for gcda and gcov files from gcov_obj to calculate code coverage (default=1)')
+    argparser.add_argument('--replay-workers', default=1, type=int, metavar='INT',
+                        help='The number of workers replaying testcases concurrently (default=1)')
+    argparser.add_argument('--replay-timeout', default=0.1, type=float, metavar='FLOAT',
+                        help='Timeout of replaying each testcase in seconds (default=0.1)')
+    argparser.add_argument('--stream-ktests', action='store_true',
+                        help='Replay each testcase as soon as KLEE writes it, while KLEE is still running')
+    argparser.add_argument('--pipeline-replay', action='store_true',
+                        help='Replay the testcases of a KLEE run in the background while the next run executes')
+    argparser.add_argument('--parallel-sweep', action='store_true',
+                        help='Run the KLEE instances of all weight indices of a FeatMaker iteration concurrently')
+    argparser.add_argument('--klee-max-memory', default=None, type=int, metavar='MB',
+                        help='Total memory in MB shared by the running KLEE instances (default=no limit)')
+    argparser.add_argument('--query-fingerprints', default=None, type=str, metavar='PATH',
+                        help='A file keeping the fingerprints of the queries of seeds, so that seeds are deduplicated across restarts (default=in memory only)')
 
     arguments = argparser.parse_args()
 
@@ -112,21 +133,27 @@ if __name__=="__main__":
             get_logger().info('Example space configuration json is generated: example-space.json')
         sys.exit(0)
 
-    symtuner = KLEESymTuner('/root/symchestra/klee_featmaker/build/bin/klee-replay', 'gcov', 10, arguments.search_space, arguments.exploit_portion)
+    symtuner = KLEESymTuner('/root/symchestra/klee_featmaker/build/bin/klee-replay', 'gcov', 10, arguments.search_space, arguments.exploit_portion,
+                            replay_workers=arguments.replay_workers,
+                            replay_timeout=arguments.replay_timeout)
     evaluation_argument = {'folder_depth': arguments.gcov_depth}
 
     pconfig = load_pgm_config(f"configs/{pgm}.json")
     pconfig["gcov_path"] = os.getcwd() + "/" + pconfig["gcov_path"] + pconfig["exec_dir"]
     llvm_dir = os.getcwd() + "/" + pconfig["pgm_dir"]
-    os.system(f"cp -r {llvm_dir} {top_dir}/")
+    copy_tree(llvm_dir, top_dir)
 
     fg = feature_generator.feature_generator(data, top_dir, arguments)
 
     if arguments.main_option == "featmaker":
-        wg = weight_generator.learning_weight_generator(data, top_dir, arguments.n_scores)
+        wg = weight_generator.learning_weight_generator(data, top_dir, arguments.n_scores,
+                                                        weight_format="binary" if arguments.binary_weights else "text")
     else:
         wg = weight_generator.random_weight_generator(data, top_dir, arguments.n_scores)
     ke = klee_executor.klee_executor(pconfig, top_dir, arguments, symtuner, wg)
+    if arguments.stream_ktests:
+        ke.on_testcase = lambda ktest: symtuner.prefetch(pconfig, ktest)
+        ke.on_discard = symtuner.discard_prefetched
 
     data = {}
     start_time = time.time()
@@ -147,16 +174,15 @@ if __name__=="__main__":
     feat_iter = 0
     weight_idx = 0
 
-    allCoverage = set()
-    curCoverage = set()
+    allCoverage = Coverage()
+    curCoverage = 0
     
     count = 0
     execCount = 0
     
-    branchFrequency = defaultdict(int)
     datastructure = {"symtuner" : dict(), "featmaker" : dict(), "ram" : dict()}
-    querystructure = set()
-    usedBuffer = list()
+    querystructure = QueryFingerprintStore(arguments.query_fingerprints)
+    usedBuffer = set()
 
     os.mkdir(f"{top_dir}/result/symtuner")
     os.mkdir(f"{top_dir}/result/iteration-{feat_iter}")
@@ -176,302 +202,334 @@ if __name__=="__main__":
     max_time = 120
     parameters['-max-time'] = max_time
     symtuner.mode = "featmaker"
-    
-    ### FIRST TRAIN
-    while firstTrain:
-        parameters['-output-dir'] = f"{top_dir}/result/iteration-{feat_iter}/{feat_step}"
-        testcases_featmaker = ke.execute_klee(iteration=feat_iter, parameters=parameters, weight_idx=weight_idx, get_logger=get_logger, 
-                                              flag="featmaker", flag2="parallel")
-        symtuner.add(pconfig, testcases_featmaker, parameters=parameters, evaluation_kwargs=evaluation_argument, rm_cmd=rm_cmd, flag="basefeatmaker")
-
-        symtuner.featmakerdata.append(dict())
-        for key, value in symtuner.tempfeatmakerdata.items():
-            symtuner.featmakerdata[weight_idx][key] = value
-            
-        feat_step += 1  
-        weight_idx += 1      
-
-        elapsed = time_budget_handler.elapsed
-        allCoverage |= symtuner.allCoverage
-        execCount += 1
-
-        get_logger().info(f'Execution Number: {execution_num + 1} '
-                          f'Time budget: 120 '
-                          f'Mode : {mode} '
-                          f'Time elapsed: {elapsed} '
-                          f'All Coverage: {len(allCoverage)} '
-                          f'Steps: {sym_step} {feat_step} '
-                          f'Count: {count} '
-                          f'execCount : {execCount}')
-
-        if execCount % arguments.n_scores == 0 and execCount != 0:
-            firstTrain = False
-            count = 0
-            execCount = 0
-
-            feat_iter += 1
-
-            os.mkdir(f"{top_dir}/result/iteration-{feat_iter}")
-            os.mkdir(f"{top_dir}/weight/iteration-{feat_iter}")
-
-            print(f"Generate features in iteration: {feat_iter - 1}")
-            fg.n_scores = len(symtuner.featmakerdata)
-            fg.collect(feat_iter, symtuner.featmakerdata)
-            fg.extract_feature()
-
-            print(f"Generate weights in iteration: {feat_iter - 1}")
-            wg.n_weights = len(symtuner.featmakerdata)
-            wg.generate_weight(feat_iter)
-            ke.feat_len = len(wg.data["features"])
-              
-        
-        with coverage_csv.open('a') as stream:
-            stream.write(f'{elapsed}, {len(allCoverage)}\n')
 
-        execution_num += 1
+    # Runs the weight indices of a FeatMaker iteration concurrently with --parallel-sweep
+    n_sweep_jobs = arguments.n_scores if arguments.parallel_sweep else 1
+    scheduler = klee_executor.klee_scheduler(ke, get_logger, n_jobs=n_sweep_jobs,
+                                             max_memory=arguments.klee_max_memory)
+    # Weight index of each entry of symtuner.parallelfeatmaker
+    featmaker_widx = []
+    
+    try:
+        ### FIRST TRAIN
+        while firstTrain:
+            if arguments.parallel_sweep:
+                if len(scheduler) == 0:
+                    # Entries of the weight indices still running stay None
+                    symtuner.featmakerdata = [None] * arguments.n_scores
+                    for j in range(arguments.n_scores):
+                        run_parameters = dict(parameters)
+                        run_parameters['-output-dir'] = f"{top_dir}/result/iteration-{feat_iter}/{feat_step + j}"
+                        scheduler.submit((j, run_parameters), iteration=feat_iter, parameters=run_parameters, weight_idx=j,
+                                         flag="featmaker", flag2="parallel")
+                (weight_idx, run_parameters), testcases_featmaker = scheduler.next_completed()
+                symtuner.featmakerdata[weight_idx] = dict()
+            else:
+                run_parameters = parameters
+                run_parameters['-output-dir'] = f"{top_dir}/result/iteration-{feat_iter}/{feat_step}"
+                testcases_featmaker = ke.execute_klee(iteration=feat_iter, parameters=run_parameters, weight_idx=weight_idx, get_logger=get_logger, 
+                                                      flag="featmaker", flag2="parallel")
+                symtuner.featmakerdata.append(dict())
+            symtuner.add(pconfig, testcases_featmaker, parameters=run_parameters, evaluation_kwargs=evaluation_argument, rm_cmd=rm_cmd, flag="basefeatmaker")
+            featmaker_widx.append(weight_idx)
 
+            for key, value in symtuner.tempfeatmakerdata.items():
+                symtuner.featmakerdata[weight_idx][key] = value
+            
+            feat_step += 1  
+            weight_idx += 1      
+
+            elapsed = time_budget_handler.elapsed
+            allCoverage |= symtuner.allCoverage
+            execCount += 1
+
+            get_logger().info(f'Execution Number: {execution_num + 1} '
+                              f'Time budget: 120 '
+                              f'Mode : {mode} '
+                              f'Time elapsed: {elapsed} '
+                              f'All Coverage: {len(allCoverage)} '
+                              f'Steps: {sym_step} {feat_step} '
+                              f'Count: {count} '
+                              f'execCount : {execCount}')
+
+            if execCount % arguments.n_scores == 0 and execCount != 0:
+                firstTrain = False
+                count = 0
+                execCount = 0
 
-    weight_idx = 0
-    feat_step = 0
-    symtuner.mode = mode
+                feat_iter += 1
 
-    for i, _ in enumerate(time_budget_handler):
-        if mode == "symtuner":
-            if modeFirst:
-                if len(symtuner.parallelram) != 0:
-                    modeFirst = False
-                else:                
-                    weight_idx = None
+                os.mkdir(f"{top_dir}/result/iteration-{feat_iter}")
+                os.mkdir(f"{top_dir}/weight/iteration-{feat_iter}")
 
-            policy = 'explore' if sym_step < arguments.exploration_steps else None
-            parameters = symtuner.sample(policy=policy)
+                print(f"Generate features in iteration: {feat_iter - 1}")
+                fg.n_scores = len(symtuner.featmakerdata)
+                fg.collect(feat_iter, symtuner.featmakerdata)
+                fg.extract_feature()
 
-            parameters['-output-dir'] = f"{top_dir}/result/symtuner/{sym_step}"
-            parameters['-max-time'] = max_time
-            
-            testcases_symtuner = ke.execute_klee(iteration=feat_iter - 1, parameters=parameters, weight_idx=weight_idx, get_logger=get_logger, 
-                                                flag="symtuner", flag2="parallel", ram=goodorbad, 
-                                                seed=nextSeed, badQueries=badQueries)
-            symtuner.add(pconfig, testcases_symtuner, parameters=parameters, evaluation_kwargs=evaluation_argument, rm_cmd=rm_cmd, flag="basesymtuner")
+                print(f"Generate weights in iteration: {feat_iter - 1}")
+                wg.n_weights = len(symtuner.featmakerdata)
+                wg.generate_weight(feat_iter)
+                ke.feat_len = len(wg.data["features"])
+              
+        
+            with coverage_csv.open('a') as stream:
+                stream.write(f'{elapsed}, {len(allCoverage)}\n')
 
-            for each in symtuner.tempsymdata:
-                symtuner.data.append(each)
+            execution_num += 1
 
-                if filterSeeds.checkAndUpdateQueries(each[2], querystructure):
-                    datastructure[mode][each[2]] = each[0]
-    
-            symtuner.combination_version_add()
-            sym_step += 1
 
-        elif mode == "featmaker":
-            if len(symtuner.parallelsymtuner) != 0 and modeFirst:
-                modeFirst = False
-                symtuner.parallelfeatmaker = []
+        weight_idx = 0
+        feat_step = 0
+        symtuner.mode = mode
 
-                bestP = -1e10
-                parameters = None
-                bestBranch = None
+        pipeline = ReplayPipeline(symtuner, pconfig, evaluation_argument, rm_cmd, background=arguments.pipeline_replay)
 
-                for index in range(len(symtuner.parallelsymtuner)):
-                    curSymTuner = symtuner.parallelsymtuner[index]
+        def commit_runs(wait=False):
+            # Runs are keyed by the mode and the weight index they were launched with
+            for run_mode, run_widx in pipeline.commit(wait=wait):
+                if run_mode == "symtuner":
+                    for each in symtuner.tempsymdata:
+                        symtuner.data.append(each)
 
-                    curSymTunerParam, curSymTunerBranch, curSymTunerErrorNum = curSymTuner
+                        if filterSeeds.checkAndUpdateQueries(each[2], querystructure):
+                            datastructure[run_mode][each[2]] = each[0]
 
-                    score = 0.0
+                    symtuner.combination_version_add()
 
-                    for branch in curSymTunerBranch:
-                        score += 1 / symtuner.branchFrequency[branch]
+                elif run_mode == "featmaker":
+                    featmaker_widx.append(run_widx)
 
-                    score += curSymTunerErrorNum
+                    for key, value in symtuner.tempfeatmakerdata.items():
+                        symtuner.featmakerdata[run_widx][key] = value
 
-                    if bestP < score:
-                        bestP = score
-                        parameters = curSymTunerParam
-                        bestBranch = curSymTunerBranch
+                        if filterSeeds.checkAndUpdateQueries(key, querystructure):
+                            datastructure[run_mode][key] = value
 
-                # Update Frequency
-                for branch in bestBranch:
-                    symtuner.branchPerScore["symtuner"][branch] = symtuner.branchPerScore["symtuner"].get(branch) * 1.1
+                elif run_mode == "ram":
+                    for each in symtuner.tempramdata:
+                        if filterSeeds.checkAndUpdateQueries(each[1], querystructure):
+                            datastructure[run_mode][each[1]] = each[0]
 
-            parameters['-output-dir'] = f"{top_dir}/result/iteration-{feat_iter}/{feat_step}"
-            parameters['-max-time'] = max_time
-            
-            testcases_featmaker = ke.execute_klee(iteration=feat_iter, parameters=parameters, weight_idx=weight_idx, get_logger=get_logger, 
-                                                  flag="symtuner", flag2="parallel", ram=goodorbad, 
-                                                  seed=nextSeed, badQueries=badQueries)
-            symtuner.add(pconfig, testcases_featmaker, parameters=parameters, evaluation_kwargs=evaluation_argument, rm_cmd=rm_cmd, flag="basefeatmaker")
+        for i, _ in enumerate(time_budget_handler):
+            if mode == "symtuner":
+                if modeFirst:
+                    if len(symtuner.parallelram) != 0:
+                        modeFirst = False
+                    else:                
+                        weight_idx = None
 
-            symtuner.featmakerdata.append(dict())
-            for key, value in symtuner.tempfeatmakerdata.items():
-                symtuner.featmakerdata[weight_idx][key] = value
+                policy = 'explore' if sym_step < arguments.exploration_steps else None
+                parameters = symtuner.sample(policy=policy)
 
-                if filterSeeds.checkAndUpdateQueries(key, querystructure):
-                    datastructure[mode][key] = value
+                parameters['-output-dir'] = f"{top_dir}/result/symtuner/{sym_step}"
+                parameters['-max-time'] = max_time
             
-            feat_step += 1  
-            weight_idx += 1 
+                testcases_symtuner = ke.execute_klee(iteration=feat_iter - 1, parameters=parameters, weight_idx=weight_idx, get_logger=get_logger, 
+                                                    flag="symtuner", flag2="parallel", ram=goodorbad, 
+                                                    seed=nextSeed, badQueries=badQueries)
+                pipeline.submit((mode, weight_idx), testcases_symtuner, parameters=parameters, flag="basesymtuner")
+                sym_step += 1
 
-        elif mode == "ram":
-            if modeFirst:
-                if len(symtuner.parallelfeatmaker) != 0:
+            elif mode == "featmaker":
+                if len(symtuner.parallelsymtuner) != 0 and modeFirst:
                     modeFirst = False
-                    symtuner.parallelsymtuner = []
-
-                    bestFW = -1e10
-                    weight_idx = None
-                    bestBranch = None
-                    for index in range(len(symtuner.parallelfeatmaker)):
-                        curFeatMaker = symtuner.parallelfeatmaker[index]
+                    symtuner.parallelfeatmaker = []
+                    featmaker_widx = []
 
-                        curFeatMakerBranch, curFeatMakerErrorNum = curFeatMaker
+                    scores = symtuner.rarity.scores([branches for _, branches, _ in symtuner.parallelsymtuner])
+                    scores += [errorNum for _, _, errorNum in symtuner.parallelsymtuner]
+                    parameters, bestBranch, _ = symtuner.parallelsymtuner[int(np.argmax(scores))]
 
-                        score = 0.0
+                    # Update Frequency
+                    symtuner.rarity.scale("symtuner", bestBranch, 1.1)
+
+                parameters['-max-time'] = max_time
+                if arguments.parallel_sweep:
+                    if len(scheduler) == 0:
+                        # Entries of the weight indices still running stay None
+                        symtuner.featmakerdata = [None] * arguments.n_scores
+                        for j in range(arguments.n_scores):
+                            run_parameters = dict(parameters)
+                            run_parameters['-output-dir'] = f"{top_dir}/result/iteration-{feat_iter}/{feat_step + j}"
+                            scheduler.submit((j, run_parameters), iteration=feat_iter, parameters=run_parameters, weight_idx=j,
+                                             flag="symtuner", flag2="parallel", ram=goodorbad,
+                                             seed=nextSeed, badQueries=badQueries)
+                    (weight_idx, run_parameters), testcases_featmaker = scheduler.next_completed()
+                    symtuner.featmakerdata[weight_idx] = dict()
+                else:
+                    run_parameters = parameters
+                    run_parameters['-output-dir'] = f"{top_dir}/result/iteration-{feat_iter}/{feat_step}"
+                    testcases_featmaker = ke.execute_klee(iteration=feat_iter, parameters=run_parameters, weight_idx=weight_idx, get_logger=get_logger, 
+                                                          flag="symtuner", flag2="parallel", ram=goodorbad, 
+                                                          seed=nextSeed, badQueries=badQueries)
+                    symtuner.featmakerdata.append(dict())
+                pipeline.submit((mode, weight_idx), testcases_featmaker, parameters=run_parameters, flag="basefeatmaker")
+            
+                feat_step += 1  
+                weight_idx += 1 
 
-                        for branch in curFeatMakerBranch:
-                            score += 1 / symtuner.branchFrequency[branch]
-                        
-                        score += curFeatMakerErrorNum
+            elif mode == "ram":
+                if modeFirst:
+                    if len(symtuner.parallelfeatmaker) != 0:
+                        modeFirst = False
+                        symtuner.parallelsymtuner = []
 
-                        if bestFW < score:
-                            bestFW = score
-                            weight_idx = index
-                            bestBranch = curFeatMakerBranch
+                        scores = symtuner.rarity.scores([branches for branches, _ in symtuner.parallelfeatmaker])
+                        scores += [errorNum for _, errorNum in symtuner.parallelfeatmaker]
+                        best = int(np.argmax(scores))
+                        weight_idx = featmaker_widx[best]
+                        bestBranch = symtuner.parallelfeatmaker[best][0]
 
-                    # Update Frequency
-                    for branch in bestBranch:
-                        symtuner.branchPerScore["featmaker"][branch] = symtuner.branchPerScore["featmaker"].get(branch) * 1.1    
+                        # Update Frequency
+                        symtuner.rarity.scale("featmaker", bestBranch, 1.1)
 
-                else:                
-                    weight_idx = None
+                    else:                
+                        weight_idx = None
 
-            parameters['-output-dir'] = f"{top_dir}/result/ram/{ram_step}"
-            parameters['-max-time'] = max_time
+                parameters['-output-dir'] = f"{top_dir}/result/ram/{ram_step}"
+                parameters['-max-time'] = max_time
             
-            testcases_symtuner = ke.execute_klee(iteration=feat_iter - 1, parameters=parameters, weight_idx=weight_idx, get_logger=get_logger, 
-                                                flag="symtuner", flag2="parallel", ram=goodorbad, 
-                                                seed=nextSeed, badQueries=badQueries)
-            symtuner.add(pconfig, testcases_symtuner, parameters=parameters, evaluation_kwargs=evaluation_argument, rm_cmd=rm_cmd, flag="baseram")
-
-            for each in symtuner.tempramdata:
-                if filterSeeds.checkAndUpdateQueries(each[1], querystructure):
-                    datastructure[mode][each[1]] = each[0]
-    
-                branches = each[0]
+                testcases_symtuner = ke.execute_klee(iteration=feat_iter - 1, parameters=parameters, weight_idx=weight_idx, get_logger=get_logger, 
+                                                    flag="symtuner", flag2="parallel", ram=goodorbad, 
+                                                    seed=nextSeed, badQueries=badQueries)
+                pipeline.submit((mode, weight_idx), testcases_symtuner, parameters=dict(parameters), flag="baseram")
             
-            ram_step += 1
+                ram_step += 1
+
+            # The run just launched is replayed while the next one executes
+            commit_runs()
 
-        elapsed = time_budget_handler.elapsed
-        coverage, bugs = symtuner.get_coverage_and_bugs()
-        allCoverage = coverage | symtuner.tempfeatmakerCoverage
-        execCount += 1
+            elapsed = time_budget_handler.elapsed
+            coverage, bugs = symtuner.get_coverage_and_bugs()
+            # FeatMaker coverage is already accumulated in `coverage`
+            allCoverage = coverage
+            execCount += 1
         
-        if len(curCoverage) == len(allCoverage):
-            count += 1
-        else:
-            count = 0
-
-        get_logger().info(f'Execution Number: {i + 1} '
-                          f'Time budget: 120 '
-                          f'Mode : {mode} '
-                          f'Time elapsed: {elapsed} '
-                          f'Coverage: {len(curCoverage)} '
-                          f'All Coverage: {len(allCoverage)} '
-                          f'Steps: {sym_step} {feat_step} {ram_step} '
-                          f'Count: {count} '
-                          f'execCount : {execCount}')
-
-        curCoverage = allCoverage.copy()
+            if curCoverage == len(allCoverage):
+                count += 1
+            else:
+                count = 0
+
+            get_logger().info(f'Execution Number: {i + 1} '
+                              f'Time budget: 120 '
+                              f'Mode : {mode} '
+                              f'Time elapsed: {elapsed} '
+                              f'Coverage: {curCoverage} '
+                              f'All Coverage: {len(allCoverage)} '
+                              f'Steps: {sym_step} {feat_step} {ram_step} '
+                              f'Count: {count} '
+                              f'execCount : {execCount}')
+
+            curCoverage = len(allCoverage)
+
+            if (execCount % arguments.n_scores == 0 and execCount != 0) or count == 5:
+                # Every run of the mode is committed before switching
+                commit_runs(wait=True)
             
-        if execCount % arguments.n_scores == 0 and execCount != 0:
-            modeFirst = True
-            count = 0
+            if execCount % arguments.n_scores == 0 and execCount != 0:
+                modeFirst = True
+                count = 0
             
             
-            nextSeed, badQueries = returnSeeds.returnBestFilteredSeedBadDifferentQueries(mode, datastructure, symtuner.branchFrequency, usedBuffer,
-                                                                                         symtuner=symtuner)
-            if mode == "symtuner":
-                mode = "featmaker"
-                weight_idx = 0
-                execCount = 0
-                feat_step = 0
-                symtuner.featmakerdata = []
-                print("=" * 70)
-
-            elif mode == "featmaker":
-                mode = "ram"
-                execCount = 0
-
-                feat_iter += 1
-                featCov = allCoverage.copy()
-
-                os.mkdir(f"{top_dir}/result/iteration-{feat_iter}")
-                os.mkdir(f"{top_dir}/weight/iteration-{feat_iter}")
-                print(f"Generate features in iteration: {feat_iter - 1}")
-                fg.n_scores = len(symtuner.featmakerdata)
-                fg.collect(feat_iter, symtuner.featmakerdata)
-                fg.extract_feature()
-                print(f"Generate weights in iteration: {feat_iter - 1}")
-                wg.n_weights = len(symtuner.featmakerdata)
-                wg.generate_weight(feat_iter)
-                ke.feat_len = len(wg.data["features"])
-                print("=" * 70)
-
-                goodorbad = True
-
-            elif mode == "ram":
-                mode = "symtuner"
-                execCount = 0
-                goodorbad = False
-
-        elif count == 5:
-            count = 0
-            modeFirst = True
-
-            nextSeed, badQueries = returnSeeds.returnBestFilteredSeedBadDifferentQueries(mode, datastructure, symtuner.branchFrequency, usedBuffer,
-                                                                                        symtuner=symtuner)
-            if mode == "symtuner":
-                mode = "featmaker"
-                weight_idx = 0
-                execCount = 0
-
-                symtuner.featmakerdata = []
-                print("=" * 70)
-
-            elif mode == "featmaker":
-                mode = "ram"
-                execCount = 0
-
-                feat_iter += 1
-
-                os.mkdir(f"{top_dir}/result/iteration-{feat_iter}")
-                os.mkdir(f"{top_dir}/weight/iteration-{feat_iter}")
-                print(f"Generate features in iteration: {feat_iter - 1}")
-                fg.n_scores = len(symtuner.featmakerdata)
-                fg.collect(feat_iter, symtuner.featmakerdata)
-                fg.extract_feature()
-                print(f"Generate weights in iteration: {feat_iter - 1}")
-                wg.n_weights = len(symtuner.featmakerdata)
-                wg.generate_weight(feat_iter)
-                ke.feat_len = len(wg.data["features"])     
-                print("=" * 70)
+                nextSeed, badQueries = returnSeeds.returnBestFilteredSeedBadDifferentQueries(mode, datastructure, symtuner.rarity, usedBuffer,
+                                                                                             symtuner=symtuner)
+                if mode == "symtuner":
+                    mode = "featmaker"
+                    weight_idx = 0
+                    execCount = 0
+                    feat_step = 0
+                    symtuner.featmakerdata = []
+                    print("=" * 70)
+
+                elif mode == "featmaker":
+                    mode = "ram"
+                    execCount = 0
+                    # Drop the runs of the sweep left after an early switch, and score only the
+                    # weight indices which finished
+                    scheduler.close()
+                    symtuner.featmakerdata = [data for data in symtuner.featmakerdata if data is not None]
+
+                    feat_iter += 1
+                    featCov = allCoverage.copy()
+
+                    os.mkdir(f"{top_dir}/result/iteration-{feat_iter}")
+                    os.mkdir(f"{top_dir}/weight/iteration-{feat_iter}")
+                    print(f"Generate features in iteration: {feat_iter - 1}")
+                    fg.n_scores = len(symtuner.featmakerdata)
+                    fg.collect(feat_iter, symtuner.featmakerdata)
+                    fg.extract_feature()
+                    print(f"Generate weights in iteration: {feat_iter - 1}")
+                    wg.n_weights = len(symtuner.featmakerdata)
+                    wg.generate_weight(feat_iter)
+                    ke.feat_len = len(wg.data["features"])
+                    print("=" * 70)
+
+                    goodorbad = True
+
+                elif mode == "ram":
+                    mode = "symtuner"
+                    execCount = 0
+                    goodorbad = False
+
+            elif count == 5:
+                count = 0
+                modeFirst = True
+
+                nextSeed, badQueries = returnSeeds.returnBestFilteredSeedBadDifferentQueries(mode, datastructure, symtuner.rarity, usedBuffer,
+                                                                                            symtuner=symtuner)
+                if mode == "symtuner":
+                    mode = "featmaker"
+                    weight_idx = 0
+                    execCount = 0
+
+                    symtuner.featmakerdata = []
+                    print("=" * 70)
+
+                elif mode == "featmaker":
+                    mode = "ram"
+                    execCount = 0
+                    # Drop the runs of the sweep left after an early switch, and score only the
+                    # weight indices which finished
+                    scheduler.close()
+                    symtuner.featmakerdata = [data for data in symtuner.featmakerdata if data is not None]
+
+                    feat_iter += 1
+
+                    os.mkdir(f"{top_dir}/result/iteration-{feat_iter}")
+                    os.mkdir(f"{top_dir}/weight/iteration-{feat_iter}")
+                    print(f"Generate features in iteration: {feat_iter - 1}")
+                    fg.n_scores = len(symtuner.featmakerdata)
+                    fg.collect(feat_iter, symtuner.featmakerdata)
+                    fg.extract_feature()
+                    print(f"Generate weights in iteration: {feat_iter - 1}")
+                    wg.n_weights = len(symtuner.featmakerdata)
+                    wg.generate_weight(feat_iter)
+                    ke.feat_len = len(wg.data["features"])     
+                    print("=" * 70)
             
-                goodorbad = True
+                    goodorbad = True
         
-            elif mode == "ram":
-                mode = "symtuner"
-                execCount = 0
-                goodorbad = False
-
-        with coverage_csv.open('a') as stream:
-            stream.write(f'{elapsed}, {len(allCoverage)}\n')
-        with found_bugs_txt.open('w') as stream:
-            stream.writelines((f'Testcase: {Path(symtuner.get_testcase_causing_bug(bug)).absolute()} '
-                               f'Bug: {bug}\n' for bug in bugs))
-
-        execution_num += 1
-        symtuner.mode = mode
-
+                elif mode == "ram":
+                    mode = "symtuner"
+                    execCount = 0
+                    goodorbad = False
+
+            with coverage_csv.open('a') as stream:
+                stream.write(f'{elapsed}, {len(allCoverage)}\n')
+            with found_bugs_txt.open('a') as stream:
+                stream.writelines((f'Testcase: {Path(symtuner.get_testcase_causing_bug(bug)).absolute()} '
+                                   f'Bug: {bug}\n' for bug in symtuner.pop_unreported_bugs()))
+
+            execution_num += 1
+            symtuner.mode = mode
+    finally:
+        # Do not leave KLEE runs behind on errors or interrupts
+        scheduler.close()
+    commit_runs(wait=True)
+    pipeline.close()
     os.chdir(root_dir)
+    querystructure.close()
             
     coverage, bugs = symtuner.get_coverage_and_bugs()
     get_logger().info(f'SymChestra-based integration of SymTuner+FeatMaker+RAM achieved {len(coverage)} coverage.')
\ No newline at end of file
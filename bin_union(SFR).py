@@ -17,8 +17,10 @@ from featmaker_subscript import weight_generator
 from symchestra_subscript import returnSeeds
 from symchestra_subscript import filterSeeds
 
+from branch_coverage import Coverage
 from klee import KLEE
 from klee import KLEESymTuner
+from launcher import copy_tree
 from logger import get_logger
 from symtuner import TimeBudgetHandler
 
@@ -36,6 +38,8 @@ if __name__=="__main__":
     argparser.add_argument('output_dir')
     argparser.add_argument('--total_budget', default=86400)
     argparser.add_argument('--n_scores', default=20, type=int)
+    argparser.add_argument('--binary-weights', action='store_true',
+                        help='Write the weights of an iteration into one binary file (needs a KLEE supporting --weight-index)')
     argparser.add_argument('--main_option', default='featmaker')
     argparser.add_argument('--eta_num', default=10)
 
@@ -62,6 +66,12 @@ if __name__=="__main__":
                         help='Log the debug messages')
     argparser.add_argument('--gcov-depth', default=1, type=int,
                         help='Depth to search for gcda and gcov files from gcov_obj to calculate code coverage (default=1)')
+    argparser.add_argument('--replay-workers', default=1, type=int, metavar='INT',
+                        help='The number of workers replaying testcases concurrently (default=1)')
+    argparser.add_argument('--replay-timeout', default=0.1, type=float, metavar='FLOAT',
+                        help='Timeout of replaying each testcase in seconds (default=0.1)')
+    argparser.add_argument('--stream-ktests', action='store_true',
+                        help='Replay each testcase as soon as KLEE writes it, while KLEE is still running')
 
     symtuner_args = argparser.parse_args()
 
@@ -114,21 +124,26 @@ if __name__=="__main__":
             get_logger().info('Example space configuration json is generated: example-space.json')
         sys.exit(0)
 
-    symtuner = KLEESymTuner('/root/symchestra/klee_featmaker/build/bin/klee-replay', 'gcov', 10, symtuner_args.search_space, symtuner_args.exploit_portion)
+    symtuner = KLEESymTuner('/root/symchestra/klee_featmaker/build/bin/klee-replay', 'gcov', 10, symtuner_args.search_space, symtuner_args.exploit_portion,
+                            replay_workers=symtuner_args.replay_workers,
+                            replay_timeout=symtuner_args.replay_timeout)
     evaluation_argument = {'folder_depth': symtuner_args.gcov_depth}
 
     pconfig = load_pgm_config(f"configs/{pgm}.json")
     pconfig["gcov_path"] = os.getcwd() + "/" + pconfig["gcov_path"]+ pconfig["exec_dir"]
     llvm_dir = os.getcwd() + "/" + pconfig["pgm_dir"]
-    os.system(f"cp -r {llvm_dir} {top_dir}/")
+    copy_tree(llvm_dir, top_dir)
 
     fg = feature_generator.feature_generator(data, top_dir, symtuner_args)
 
     if symtuner_args.main_option == "featmaker":
-        wg = weight_generator.learning_weight_generator(data, top_dir, symtuner_args.n_scores)
+        wg = weight_generator.learning_weight_generator(data, top_dir, symtuner_args.n_scores,
+                                                        weight_format="binary" if symtuner_args.binary_weights else "text")
     else:
         wg = weight_generator.random_weight_generator(data, top_dir, symtuner_args.n_scores)
     ke = klee_executor.klee_executor(pconfig, top_dir, symtuner_args, symtuner, wg)
+    if symtuner_args.stream_ktests:
+        ke.on_testcase = lambda ktest: symtuner.prefetch(pconfig, ktest)
 
     data = {}
     start_time = time.time()
@@ -147,8 +162,8 @@ if __name__=="__main__":
     feat_iter = 0
     weight_idx = 0
 
-    allCoverage = set()
-    curCoverage = set()
+    allCoverage = Coverage()
+    curCoverage = 0
     beforeCoverage = set()
     
     count = 0
@@ -250,20 +265,21 @@ if __name__=="__main__":
         
         elapsed = time_budget_handler.elapsed
         coverage, bugs = symtuner.get_coverage_and_bugs()
-        allCoverage = coverage | symtuner.tempfeatmakerCoverage
+        # FeatMaker coverage is already accumulated in `coverage`
+        allCoverage = coverage
         execCount += 1
         
         get_logger().info(f'Execution Number: {i + 1} '
                           f'Time budget: 120 '
                           f'Mode : {mode} '
                           f'Time elapsed: {elapsed} '
-                          f'Coverage: {len(curCoverage)} '
+                          f'Coverage: {curCoverage} '
                           f'All Coverage: {len(allCoverage)} '
                           f'Steps: {step} '
                           f'Count: {count} '
                           f'execCount : {execCount}')
 
-        curCoverage = allCoverage.copy()
+        curCoverage = len(allCoverage)
             
         if execCount % symtuner_args.n_scores == 0 and execCount != 0:
             feat_iter += 1
@@ -285,9 +301,9 @@ if __name__=="__main__":
 
         with coverage_csv.open('a') as stream:
             stream.write(f'{elapsed}, {len(allCoverage)}\n')
-        with found_bugs_txt.open('w') as stream:
+        with found_bugs_txt.open('a') as stream:
             stream.writelines((f'Testcase: {Path(symtuner.get_testcase_causing_bug(bug)).absolute()} '
-                               f'Bug: {bug}\n' for bug in bugs))
+                               f'Bug: {bug}\n' for bug in symtuner.pop_unreported_bugs()))
 
         execution_num += 1
 
@@ -0,0 +1,301 @@
+'''Coverage bookkeeping for SymTuner
+
+This module contains the compact coverage representation shared by SymTuner, FeatMaker and seed
+selection, and the coverage accumulator that keeps the total coverage and bugs found so far.
+
+Branches (e.g. `'file.c 42 0'`, see `branch_id`) are interned into dense integer IDs once, and a set of covered
+branches is kept as a bitset over those IDs. Unions, differences and popcounts then run on
+machine words instead of hashing strings. The accumulator is updated incrementally whenever a
+testcase is evaluated, so the totals and the testcase causing each bug never have to be rebuilt
+from the whole history.
+'''
+
+import numpy as np
+
+
+_INTERNER = None
+
+
+def _popcount_fallback(bits):
+    return bin(bits).count('1')
+
+
+# Number of set bits of an int. int.bit_count is available from Python 3.10
+popcount = getattr(int, 'bit_count', _popcount_fallback)
+
+
+def branch_id(file_name, line_num, idx):
+    '''Format a branch ID
+
+    Format the ID of a branch. Every component collecting covered branches must use this, so
+    that a branch is interned once whichever way it is collected.
+
+    Args:
+        file_name: A source file of the branch, as recorded by gcov.
+        line_num: A line number of the branch.
+        idx: An index of the branch among the branches of the line.
+
+    Returns:
+        A branch ID formed as `'{file_name} {line_num} {idx}'`.
+    '''
+
+    return f'{file_name} {line_num} {idx}'
+
+
+class BranchInterner:
+    '''Branch ID interner
+
+    Branch ID interner class. Each branch is given a dense integer ID in the order it is seen
+    first.
+    '''
+
+    def __init__(self):
+        '''Create an empty interner
+
+        Create an interner without any branches.
+        '''
+
+        self.ids = {}
+        self.names = []
+
+    def intern(self, branch):
+        '''Get the ID of a branch
+
+        Get the ID of a branch. A new ID is assigned if the branch is seen first.
+
+        Args:
+            branch: A branch.
+
+        Returns:
+            An integer ID of the branch.
+        '''
+
+        bid = self.ids.get(branch)
+        if bid is None:
+            bid = len(self.names)
+            self.ids[branch] = bid
+            self.names.append(branch)
+        return bid
+
+    def __len__(self):
+        return len(self.names)
+
+
+def get_interner():
+    '''Get the branch interner.
+
+    Get a singleton `BranchInterner`. If `BranchInterner` not defined make one and return. If
+    `get_interner` called previously, returns a `BranchInterner` object created previously.
+
+    Returns:
+        A `BranchInterner` object.
+    '''
+
+    global _INTERNER
+    if _INTERNER is None:
+        _INTERNER = BranchInterner()
+    return _INTERNER
+
+
+class Coverage:
+    '''Bitset of covered branches
+
+    Bitset of covered branches. This behaves like a set of branches (`|`, `-`, `&`, `len`, `in`
+    and iteration over branch names), but stores the set as a Python `int` whose n-th bit is set
+    if the branch with ID n is covered. Note that coverages are mutable and thus not hashable; use
+    `Coverage.bits` as a key.
+    '''
+
+    __slots__ = ('bits', 'interner')
+
+    def __init__(self, branches=(), interner=None, bits=0):
+        '''Create a coverage
+
+        Create a coverage from branches.
+
+        Args:
+            branches: An iterable of branches covered.
+            interner: A `BranchInterner` to use. If not specified, the shared interner is used.
+            bits: Bits of already interned branches.
+        '''
+
+        self.interner = get_interner() if interner is None else interner
+        for branch in branches:
+            bits |= 1 << self.interner.intern(branch)
+        self.bits = bits
+
+    @classmethod
+    def from_ids(cls, ids, interner=None):
+        '''Create a coverage from branch IDs
+
+        Args:
+            ids: An iterable of branch IDs.
+            interner: A `BranchInterner` the IDs are from. If not specified, the shared interner is
+                used.
+
+        Returns:
+            A coverage of the given branch IDs.
+        '''
+
+        ids = np.asarray(list(ids) if not isinstance(ids, np.ndarray) else ids, dtype=np.int64)
+        if ids.size == 0:
+            return cls(interner=interner)
+        flags = np.zeros(ids.max() + 1, dtype=np.uint8)
+        flags[ids] = 1
+        bits = int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little')
+        return cls(interner=interner, bits=bits)
+
+    def _other_bits(self, other):
+        if isinstance(other, Coverage):
+            if other.interner is not self.interner:
+                raise ValueError('Coverages with different interners cannot be combined')
+            return other.bits
+        return Coverage(other, self.interner).bits
+
+    def add(self, branch):
+        '''Add a branch
+
+        Args:
+            branch: A branch covered.
+        '''
+
+        self.bits |= 1 << self.interner.intern(branch)
+
+    def copy(self):
+        return Coverage(interner=self.interner, bits=self.bits)
+
+    def ids(self):
+        '''Get IDs of covered branches
+
+        Returns:
+            A sorted NumPy array of covered branch IDs.
+        '''
+
+        if self.bits == 0:
+            return np.zeros(0, dtype=np.int64)
+        n_bytes = (self.bits.bit_length() + 7) // 8
+        raw = np.frombuffer(self.bits.to_bytes(n_bytes, 'little'), dtype=np.uint8)
+        return np.flatnonzero(np.unpackbits(raw, bitorder='little'))
+
+    def __or__(self, other):
+        return Coverage(interner=self.interner, bits=self.bits | self._other_bits(other))
+
+    __ror__ = __or__
+
+    def __ior__(self, other):
+        self.bits |= self._other_bits(other)
+        return self
+
+    def __and__(self, other):
+        return Coverage(interner=self.interner, bits=self.bits & self._other_bits(other))
+
+    __rand__ = __and__
+
+    def __sub__(self, other):
+        return Coverage(interner=self.interner, bits=self.bits & ~self._other_bits(other))
+
+    def __isub__(self, other):
+        self.bits &= ~self._other_bits(other)
+        return self
+
+    def __len__(self):
+        return popcount(self.bits)
+
+    def __bool__(self):
+        return self.bits != 0
+
+    def __contains__(self, branch):
+        bid = self.interner.ids.get(branch)
+        return bid is not None and (self.bits >> bid) & 1 == 1
+
+    def __iter__(self):
+        names = self.interner.names
+        return (names[bid] for bid in self.ids())
+
+    def __eq__(self, other):
+        if isinstance(other, Coverage):
+            return self.interner is other.interner and self.bits == other.bits
+        return NotImplemented
+
+    __hash__ = None
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        # The interner is shared, not copied
+        return self.copy()
+
+    def __repr__(self):
+        return f'Coverage({len(self)} branches)'
+
+
+class CoverageAccumulator:
+    '''Incremental coverage and bug accumulator
+
+    Incremental coverage and bug accumulator class. Besides the totals, this keeps the coverage and
+    bugs that are newly found in the latest run (i.e. since `CoverageAccumulator.begin_run`).
+    '''
+
+    def __init__(self):
+        '''Create an empty accumulator
+
+        Create an accumulator without any coverage and bugs.
+        '''
+
+        self.coverage = Coverage()
+        self.bugs = set()
+        self.new_coverage = Coverage()
+        self.new_bugs = set()
+        self.bug_testcases = {}
+        self.unreported_bugs = []
+
+    def begin_run(self):
+        '''Start a new run
+
+        Reset the coverage and bugs newly found in the latest run.
+        '''
+
+        self.new_coverage = Coverage()
+        self.new_bugs = set()
+
+    def update(self, coverage, bugs, testcase=None):
+        '''Accumulate coverage and bugs of a testcase
+
+        Accumulate coverage and bugs of a testcase. The testcase is recorded as the latest one
+        causing each of the bugs.
+
+        Args:
+            coverage: A `Coverage` of the testcase.
+            bugs: A set of bugs found by the testcase.
+            testcase: The testcase evaluated.
+
+        Returns:
+            A `Coverage` of branches that were not covered before.
+        '''
+
+        new_coverage = coverage - self.coverage
+        if new_coverage:
+            self.coverage |= new_coverage
+            self.new_coverage |= new_coverage
+        new_bugs = bugs - self.bugs
+        if new_bugs:
+            self.bugs |= new_bugs
+            self.new_bugs |= new_bugs
+            self.unreported_bugs.extend(sorted(new_bugs))
+        for bug in bugs:
+            self.bug_testcases[bug] = testcase
+        return new_coverage
+
+    def pop_unreported_bugs(self):
+        '''Get bugs not reported yet
+
+        Get bugs found since the last call, in the order they were found.
+
+        Returns:
+            A list of bugs not reported yet.
+        '''
+
+        bugs = self.unreported_bugs
+        self.unreported_bugs = []
+        return bugs
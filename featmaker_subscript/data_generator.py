@@ -1,29 +1,21 @@
 from multiprocessing import Process, Manager, Queue
+from pathlib import Path
 import subprocess
+import glob
 import os
 import time
 import pickle
 
-def branch_handler(ktest_gcov):
-    with open(ktest_gcov, 'r', errors='ignore') as f:
-        lines = f.read().split('        -:    0:Source')[1:]
-    covered_branch = set()
-    for s in lines:
-        s = s.split('\n')
-        src_name = s[0].split('/')[-1]
-        line_number = 0
-        code_line_start = 1
-        while "0:" in s[code_line_start]: code_line_start += 1
-       
-        for l in s[code_line_start:]:
-            if ":" in l:
-                line_number += 1
-                continue                 
-            if 'taken' in l:
-                tmp = l.split()
-                if tmp[3] != '0%':
-                    covered_branch.add(f"{src_name}_{line_number}_{tmp[1]}")
-    # os.system(f"rm {ktest_gcov}")
+from branch_coverage import Coverage
+from branch_coverage import branch_id
+from gcov import GCovBackend
+from launcher import remove_files
+from launcher import spawn_command
+
+def branch_handler(branches):
+    covered_branch = Coverage()
+    for src_name, line_number, idx in branches:
+        covered_branch.add(branch_id(src_name, line_number, idx))
     return covered_branch
 
 class data_generator:
@@ -32,21 +24,22 @@ class data_generator:
         self.pgm = pconfig["pgm_name"]
         self.top_dir = top_dir
         self.n_weights = options.n_scores
-        self.gcda_list = os.popen(f'find {os.path.abspath(self.pconfig["gcov_path"])} -name "*.gcno"').read().replace('\n',' ').replace("gcno", "gcda")
+        self.gcda_list = [str(gcno.with_suffix('.gcda')) for gcno in Path(os.path.abspath(self.pconfig["gcov_path"])).rglob('*.gcno')]
         self.gcov_dir = f"/root/symchestra/symtuner/{self.pconfig['gcov_path']}/{self.pconfig['exec_dir']}"
         self.bin_dir = os.path.abspath('klee_featmaker/build/bin')
         self.gcda_file = self.pconfig["gcda_file"]
         self.gcov_file = self.pconfig["gcov_file"]
+        self.gcov = GCovBackend()
 
         self.potential_errors_list = []
     
     def run_replay(self, iteration, widx, potential_errors, flag=False):
-        ktest_lst = os.popen(f"ls {self.top_dir}/result/iteration-{iteration}/{widx}/*.ktest 2>/dev/null").read().split()
+        ktest_lst = sorted(glob.glob(f"{self.top_dir}/result/iteration-{iteration}/{widx}/*.ktest"))
         os.chdir(self.gcov_dir)
         covered_branches = {}
-        coverage = set()
+        coverage = Coverage()
         for ktest in ktest_lst:
-            process = subprocess.Popen(f"{self.bin_dir}/klee-replay ./{self.pgm} {ktest}", stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+            process = spawn_command([f"{self.bin_dir}/klee-replay", f"./{self.pgm}", ktest], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             try:
                 _, stderr = process.communicate(timeout=0.1)
                 if "CRASHED" in stderr.decode(errors='ignore'):
@@ -55,10 +48,9 @@ class data_generator:
                 pass
                 process.kill()
         
-            os.system(f"gcov -b {self.gcda_list} 1>/dev/null 2>/dev/null; cat *.gcov>{ktest}_gcov 2>/dev/null; rm -f {self.gcda_list} *.gcov 2>/dev/null")
-            covered_branches[ktest] = branch_handler(f"{ktest}_gcov")
-            rm_rf_cmd = " ".join(["rm", "-rf", f"{ktest}_gcov"])
-            os.system(rm_rmf_cmd)
+            gcdas = [gcda for gcda in self.gcda_list if os.path.exists(gcda)]
+            covered_branches[ktest] = branch_handler(self.gcov.iter_branches(gcdas, self.gcov_dir))
+            remove_files(self.gcda_list + ["*.gcov"])
             coverage |= covered_branches[ktest]
             process.kill()
         os.chdir(self.top_dir)
@@ -93,8 +85,7 @@ class data_generator:
 
     def potential_error_logging(self, iteration):
         for widx in range(self.n_weights):
-            rm_cmd = " ".join(["rm", "-rf", f"{self.top_dir}/errors/{iteration}_potential_errors{widx}.pkl"])
-            os.system(rm_cmd)
+            remove_files([f"{self.top_dir}/errors/{iteration}_potential_errors{widx}.pkl"])
 
         with open(f"{self.top_dir}/errors/{iteration}_potential_errors.pkl", 'wb') as f:
             pickle.dump(self.potential_errors_list, f)
@@ -1,39 +1,46 @@
-import os
 import copy
+import functools
 import numpy as np
 import pickle
 import re
 
-largeValRe = None
+from branch_coverage import Coverage
+from kquery import get_kquery_cache
+from setcover import sparse_cover
+
 lv_hp = 8
+largeValRe = re.compile("\\d{"+str(lv_hp)+",}")
+# Abstract feature of the recently seen raw PC lines
+@functools.lru_cache(maxsize=1 << 16)
+def abstract_line(line):
+    return largeValRe.sub("LargeValue", line)
 
 def abstract_condition(lines):
-    result = set()
-    largeValRe = re.compile("\\d{"+str(lv_hp)+",}")
-    for line in lines:
-        result.add(re.sub(largeValRe, "LargeValue", line))        
-    return result
+    return {abstract_line(line) for line in lines}
 
 def get_pc_naive(ktest_list):
     local_query_set = set()
     for ktest in ktest_list:
         kquery = ktest.split('.')[0] + '.kquery'
-        if not os.path.exists(kquery):
-            continue
-        with open(kquery, 'r', errors='ignore') as f:
-            lines = f.read().split('(query [\n') 
-        lines = lines[1].split('\n')[:-2]
-        local_query_set |= set(lines)
+        local_query_set.update(get_kquery_cache().lines(kquery))
     return local_query_set
 
 def get_pc(ktest):
     kquery = ktest.split('.')[0] + '.kquery'
-    if not os.path.exists(kquery):
-        return []
-    with open(kquery, 'r', errors='ignore') as f:
-        lines = f.read().split('(query [\n')
-    lines = lines[1].split('\n')[:-2]
-    return lines
+    return list(get_kquery_cache().lines(kquery))
+
+def intern(values, index, key, value):
+    idx = index.get(key)
+    if idx is None:
+        idx = index[key] = len(values)
+        values.append(value)
+    return idx
+
+def intern_id(index, key):
+    idx = index.get(key)
+    if idx is None:
+        idx = index[key] = len(index)
+    return idx
 
 class feature_generator:
     def __init__(self, data, top_dir, options):
@@ -41,24 +48,30 @@ class feature_generator:
         self.top_dir = top_dir
         self.n_scores = options.n_scores
         self.main_option = options.main_option
+        # Indices into data["unique branchset"] and data["unique pc"], keyed by bits and lines
+        self.bs_index = {}
+        self.pc_index = {}
+
+    def abstract_pc(self, pc):
+        feature_ids = self.data["feature ids"]
+        return frozenset(intern_id(feature_ids, abstract_line(line)) for line in pc)
 
     def collect_naive(self, iteration, featmakerdata):
         if iteration <= 1:
             self.data["bsidx_clusters"] = {}
             self.data["unique branchset"] = []
-            self.data["branches"] = set()
+            self.data["branches"] = Coverage()
             self.data["plot data"] = []
+            self.bs_index = {}
         
         self.data["coverage"] = []
 
         for widx in range(self.n_scores):
-            tmp_covered_set = set()
+            tmp_covered_set = Coverage()
             for ktest, bs in featmakerdata[widx].items():
-                if bs not in self.data["unique branchset"]:
-                    self.data["unique branchset"].append(bs)
-
-                    self.data["bsidx_clusters"][len(self.data["unique branchset"]) - 1] = []
-                bsidx = self.data["unique branchset"].index(bs)
+                bsidx = intern(self.data["unique branchset"], self.bs_index, bs.bits, bs)
+                if bsidx not in self.data["bsidx_clusters"]:
+                    self.data["bsidx_clusters"][bsidx] = []
                 self.data["bsidx_clusters"][bsidx].append(ktest)
                 tmp_covered_set |= bs
             self.data["coverage"].append(tmp_covered_set)
@@ -72,15 +85,19 @@ class feature_generator:
             self.data["bsidx_clusters"] = {}
             self.data["unique branchset"] = []
             self.data["unique pc"] = []
-            self.data["branches"] = set()
+            self.data["branches"] = Coverage()
             self.data["plot data"] = []
-            self.data["pre_covered"] = set()
+            self.data["pre_covered"] = Coverage()
+            self.data["feature ids"] = {}
+            self.data["pc features"] = []
+            self.bs_index = {}
+            self.pc_index = {}
 
         self.data["widx_info"] = np.zeros((self.n_scores,2))
         self.data["widx_pcidxes"] = {}
-        tmp_covered_set = set()
+        tmp_covered_set = Coverage()
         for widx in range(self.n_scores):
-            trial_branches = set()
+            trial_branches = Coverage()
             self.data["widx_pcidxes"][widx] = set()
             
             for ktest, bs in featmakerdata[widx].items():
@@ -89,16 +106,13 @@ class feature_generator:
                 if len(tmp_pc) == 0:
                     continue
                 
-                if bs not in self.data["unique branchset"]:
-                    self.data["unique branchset"].append(bs)
-                    self.data["bsidx_clusters"][len(self.data["unique branchset"]) - 1] = set()
-                
-                if tmp_pc not in self.data["unique pc"]:
-                    self.data["unique pc"].append(tmp_pc)
+                bsidx = intern(self.data["unique branchset"], self.bs_index, bs.bits, bs)
+                if bsidx not in self.data["bsidx_clusters"]:
+                    self.data["bsidx_clusters"][bsidx] = set()
 
-                bsidx = self.data["unique branchset"].index(bs)
-                
-                pcidx = self.data["unique pc"].index(tmp_pc)
+                pcidx = intern(self.data["unique pc"], self.pc_index, tuple(tmp_pc), tmp_pc)
+                if pcidx == len(self.data["pc features"]):
+                    self.data["pc features"].append(self.abstract_pc(tmp_pc))
                 self.data["widx_pcidxes"][widx].add(pcidx)
 
                 self.data["bsidx_clusters"][bsidx].add(pcidx)
@@ -109,8 +123,7 @@ class feature_generator:
             tmp_covered_set |= trial_branches
         
         self.data["branches"] |= tmp_covered_set
-        self.data["pre_covered"] = set()
-        self.data["pre_covered"] |= tmp_covered_set
+        self.data["pre_covered"] = tmp_covered_set.copy()
         self.data["plot data"].append(len(self.data["branches"]))
         
         # with open(f"{self.top_dir}/data/{iteration}.pkl", 'wb') as f:
@@ -125,26 +138,7 @@ class feature_generator:
         print(f"\tBranch Coverage in iteration-{iteration-1} : {self.data['plot data'][-1]}")
 
     def cluster_setcover(self):
-        bs_br_matrix = np.full((len(self.data["unique branchset"]), len(self.data["branches"])), False)
-        coverage_list = np.array([len(x) for x in self.data["unique branchset"]])
-        br_dict = {}
-        for br in self.data["branches"]:
-            br_dict[br] = len(br_dict)
-        for bsidx, bs in enumerate(self.data["unique branchset"]):
-            for br in bs:
-                bs_br_matrix[bsidx, br_dict[br]] = True
-        local_bs = np.full(len(self.data["branches"]), False)
-        
-        tmp_minset = []
-        while local_bs.sum() < len(self.data["branches"]):
-            tmp_sum = bs_br_matrix.sum(axis=1)
-            max_value = tmp_sum.max()
-            tmp_bsidxes = np.where(tmp_sum == max_value)[0]
-            new_bsidx = tmp_bsidxes[coverage_list[tmp_bsidxes].argmax()]
-            tmp_minset.append(new_bsidx)
-            local_bs += bs_br_matrix[new_bsidx]
-            bs_br_matrix[:, np.where(local_bs)[0]] = False
-        return tmp_minset
+        return sparse_cover(self.data["unique branchset"])
 
     def cluster_naive(self):
         return list(self.data["bsidx_clusters"].keys())
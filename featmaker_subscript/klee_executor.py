@@ -1,11 +1,20 @@
 import os
+import re
 import time
 import random
+import shlex
+import signal
 import glob
 import numpy as np
 import subprocess as sp
+import tempfile
 from pathlib import Path
 
+from kquery import get_kquery_cache
+from launcher import format_command
+from launcher import run_command
+from launcher import spawn_command
+
 configs = {
 	'root_dir': os.path.abspath(os.getcwd()),
     'klee_build_dir': '/root/symchestra/klee_featmaker/build/',
@@ -36,22 +45,30 @@ class klee_executor:
 
         self.symtuner = symtuner
         self.exploration_steps = options.exploration_steps
+        # Weights are written in one binary file per iteration (see weight_generator.write_weights)
+        self.binary_weights = options.binary_weights
         self.wg = wg
         self.log = log
 
         self.mode = mode
         self.coreNum = str(coreNum)
+        # Called with each testcase as soon as KLEE wrote it (see ktest_watcher)
+        self.on_testcase = None
+        # Called with the output directory of each run killed before it finished
+        self.on_discard = None
+        self.poll_interval = 0.5
 
     def stgy_handler(self, top_dir, iteration, weight_idx, flag2=None):
         if iteration <= 0 or weight_idx is None:
             return "random-path --search=nurs:covnew"
+        if self.binary_weights:
+            weights = f"{top_dir}/weight/iteration-{iteration}/weights.wbin"
+            return f"auto --feature={top_dir}/features/{iteration}.fbin --weight={weights} --weight-index={weight_idx}"
         return f"auto --feature={top_dir}/features/{iteration}.f --weight={top_dir}/weight/iteration-{iteration}/{weight_idx}.w"
 
-    def execute_klee(self, iteration=None, parameters=None, weight_idx=None, get_logger=None, 
+    def klee_command(self, iteration=None, parameters=None, weight_idx=None, 
                      homiinfo=None, flag=None, data=None, mode=None, flag2=None, ram=None, 
-                     seed=None, badQueries=None, separate=None):
-        os.chdir(self.llvm_dir)
-
+                     seed=None, badQueries=None, separate=None, max_memory=None):
         target = self.llvm_dir + "/" + self.pgm + ".bc"
         output_dir = parameters['-output-dir']
         max_time = parameters['-max-time']
@@ -60,44 +77,44 @@ class klee_executor:
         if self.pgm in ["find", "sqlite3"]:
             search_key = "branching"
 
+        memory_options = [] if max_memory is None else [f"--max-memory={max_memory}"]
+
         print(flag, mode, separate, weight_idx)
         if flag == "featmaker" or flag == "basefeatmaker" or (mode == "featmaker" and separate):
             search_stgy = self.stgy_handler(self.top_dir, iteration, weight_idx, flag2=flag2)
-            symbolic_args = self.pconfig['sym_options']
+            symbolic_args = shlex.split(self.pconfig['sym_options'])
             
             if ram:
-                klee_cmd = self.bin_ram_dir + "/klee -use-sym-addr -merge-objects"
+                klee_cmd = [self.bin_ram_dir + "/klee", "-use-sym-addr", "-merge-objects"]
                 if homiinfo is not None:
-                    klee_cmd = self.bin_homiram_dir + "/klee -use-sym-addr -merge-objects"
+                    klee_cmd = [self.bin_homiram_dir + "/klee", "-use-sym-addr", "-merge-objects"]
             else:
-                klee_cmd = self.bin_dir + "/klee"
+                klee_cmd = [self.bin_dir + "/klee"]
                 if homiinfo is not None:
-                    klee_cmd = self.bin_homi_dir + "/klee"
+                    klee_cmd = [self.bin_homi_dir + "/klee"]
 
-            cmd = " ".join([klee_cmd, 
-                                "-only-output-states-covering-new", "--simplify-sym-indices", "--output-module=false",
-                                "--output-source=false", "--output-stats=false", "--disable-inlining", "--write-kqueries", 
-                                "--use-forked-solver", "--use-cex-cache", "--libc=uclibc", "--ignore-solver-failures",
-                                "--posix-runtime", f"-env-file={configs['klee_build_dir']}/../test.env",
-                                "--max-sym-array-size=4096", "--max-memory-inhibit=false",
-                                "--switch-type=internal", search_options[search_key], 
-                                f"--watchdog -max-time={max_time} --search={search_stgy} --output-dir={output_dir}"])
+            cmd = [*klee_cmd, *memory_options,
+                   "-only-output-states-covering-new", "--simplify-sym-indices", "--output-module=false",
+                   "--output-source=false", "--output-stats=false", "--disable-inlining", "--write-kqueries", 
+                   "--use-forked-solver", "--use-cex-cache", "--libc=uclibc", "--ignore-solver-failures",
+                   "--posix-runtime", f"-env-file={configs['klee_build_dir']}/../test.env",
+                   "--max-sym-array-size=4096", "--max-memory-inhibit=false",
+                   "--switch-type=internal", *search_options[search_key].split(), 
+                   "--watchdog", f"-max-time={max_time}", *f"--search={search_stgy}".split(), f"--output-dir={output_dir}"]
 
 
             if homiinfo is not None:
-                cmd = " ".join([cmd, f"-dirname=" + configs['e_dir'] + "/result_All", "-symmode=mode", f"-parallel={self.coreNum} -trial={homiinfo} --iterIndex={homiinfo}"])
+                cmd += [f"-dirname=" + configs['e_dir'] + "/result_All", "-symmode=mode", f"-parallel={self.coreNum}", f"-trial={homiinfo}", f"--iterIndex={homiinfo}"]
 
             if seed is not None:
                 for eachseed in seed:
-                    cmd = " ".join([cmd, f"--seed-file={eachseed}"])
+                    cmd.append(f"--seed-file={eachseed}")
                 
                 if badQueries is not None:
                     for each_kquery in badQueries:
-                        cmd = " ".join([cmd, f"--kquery-file={each_kquery}"])
+                        cmd.append(f"--kquery-file={each_kquery}")
                     
-                cmd = " ".join([cmd, target, symbolic_args])
-            else:
-                cmd = " ".join([cmd, target, symbolic_args])
+            cmd += [target, *symbolic_args]
         else:
             klee_options = []
             sym_arg_options = []
@@ -113,26 +130,32 @@ class klee_executor:
                 if not isinstance(values, list):
                     values = [values]
                 for value in values:
+                    if stripped_key == 'max-memory' and max_memory is not None and value is not None:
+                        # Cap the sampled limit rather than passing the option twice
+                        memory_options = [f"--max-memory={min(max_memory, int(value))}"]
+                        continue
                     if value is None:
-                        param = key
+                        param = [key]
                     elif stripped_key in space_seperate_keys:
-                        param = f'{key} {value}'
+                        # Keys may carry their first argument (e.g. '-sym-files 1'), and values
+                        # several arguments (e.g. '0 2 4' of -sym-args)
+                        param = [*key.split(), *str(value).split()]
                     elif stripped_key == 'sym-stdout':
                         if value == 'off':
                             continue
-                        param = key
+                        param = [key]
                     else:
-                        param = f'{key}={value}'
+                        param = [f'{key}={value}']
                     if stripped_key in sym_arg_keys:
-                        sym_arg_options.append(param)
+                        sym_arg_options.extend(param)
                     elif stripped_key == 'sym-files':
-                        sym_files_options.append(param)
+                        sym_files_options.extend(param)
                     elif stripped_key == 'sym-stdin':
-                        sym_stdin_options.append(param)
+                        sym_stdin_options.extend(param)
                     elif stripped_key == 'sym-stdout':
-                        sym_stdout_options.append(param)
+                        sym_stdout_options.extend(param)
                     else:
-                        klee_options.append(param)
+                        klee_options.extend(param)
 
             if flag == "symtuner":
                 search_stgy = self.stgy_handler(self.top_dir, iteration, weight_idx, flag2=flag2)
@@ -140,49 +163,193 @@ class klee_executor:
                 search_stgy = self.stgy_handler(self.top_dir, iteration, weight_idx, flag2=flag2)
 
             if ram:
-                klee_cmd = self.bin_ram_dir + "/klee -use-sym-addr -merge-objects"
+                klee_cmd = [self.bin_ram_dir + "/klee", "-use-sym-addr", "-merge-objects"]
             else:
-                klee_cmd = self.bin_dir + "/klee"
+                klee_cmd = [self.bin_dir + "/klee"]
 
-            cmd = ' '.join([klee_cmd, f"--search={search_stgy}", *klee_options])
+            cmd = [*klee_cmd, *memory_options, *f"--search={search_stgy}".split(), *klee_options]
 
             if seed is not None:
                 for eachseed in seed:
-                    cmd = " ".join([cmd, f"--seed-file={eachseed}"])
+                    cmd.append(f"--seed-file={eachseed}")
                 
                 if badQueries is not None:
                     for each_kquery in badQueries:
-                        cmd = " ".join([cmd, f"--kquery-file={each_kquery}"])
+                        cmd.append(f"--kquery-file={each_kquery}")
 
-                cmd = ' '.join([cmd, str(target), *sym_arg_options, *sym_files_options, *sym_stdin_options, *sym_stdout_options])
-            else:
-                cmd = ' '.join([cmd, str(target), *sym_arg_options, *sym_files_options, *sym_stdin_options, *sym_stdout_options])
+            cmd += [str(target), *sym_arg_options, *sym_files_options, *sym_stdin_options, *sym_stdout_options]
             
+        return cmd, output_dir
+
+    def execute_klee(self, iteration=None, parameters=None, weight_idx=None, get_logger=None, 
+                     homiinfo=None, flag=None, data=None, mode=None, flag2=None, ram=None, 
+                     seed=None, badQueries=None, separate=None):
+        os.chdir(self.llvm_dir)
+
+        cmd, output_dir = self.klee_command(iteration=iteration, parameters=parameters, weight_idx=weight_idx,
+                                            homiinfo=homiinfo, flag=flag, data=data, mode=mode, flag2=flag2,
+                                            ram=ram, seed=seed, badQueries=badQueries, separate=separate)
+
         # Run KLEE
-        get_logger().info(f'klee command: {cmd}')
-        get_logger().debug(f'klee command: {cmd}')
+        get_logger().info(f'klee command: {format_command(cmd)}')
+        get_logger().debug(f'klee command: {format_command(cmd)}')
+        if self.on_testcase is None:
+            try:
+                _ = run_command(cmd, check=True)
+            except sp.CalledProcessError as e:
+                report_klee_failure(cmd, output_dir, e.returncode, e.stdout, e.stderr, get_logger)
+            return collect_testcases(output_dir)
+
+        watcher = ktest_watcher(output_dir, self.on_testcase)
+        with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+            process = spawn_command(cmd, stdout=stdout, stderr=stderr)
+            while process.poll() is None:
+                watcher.poll()
+                time.sleep(self.poll_interval)
+            watcher.poll(finished=True)
+            if process.returncode != 0:
+                stdout.seek(0)
+                stderr.seek(0)
+                report_klee_failure(cmd, output_dir, process.returncode, stdout.read(),
+                                    stderr.read(), get_logger)
+
+        return collect_testcases(output_dir)
+
+def collect_testcases(output_dir):
+    if not os.path.isdir(output_dir):
+        return []
+    return [output_dir + "/" + x for x in os.listdir(output_dir) if "ktest" in x]
+
+class ktest_watcher:
+    # Polls a KLEE output directory and hands each testcase to on_testcase once it is
+    # completely written. KLEE writes every file of a testcase (.ktest, .kquery, .err, ...)
+    # before it starts the next one, so a testcase is complete once a later one shows up
+    # or KLEE exited.
+    ktest_re = re.compile(r'^test(\d+)\.ktest$')
+
+    def __init__(self, output_dir, on_testcase):
+        self.output_dir = output_dir
+        self.on_testcase = on_testcase
+        self.seen = set()
+
+    def poll(self, finished=False):
         try:
-            _ = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE,
-                       shell=True, check=True)
-        except sp.CalledProcessError as e:
-            stderr = e.stderr.decode(errors='replace')
-            lastline = stderr.strip().splitlines()[-1]
-            if 'KLEE' in lastline and 'kill(9)' in lastline:
-                get_logger().warning(f'KLEE process kill(9)ed. Failed to terminate nicely.')
-            else:
-                log_file = Path(f"{output_dir}/symtuner.log")
-                get_logger().warning(f'Fail({e.returncode})ed to execute KLEE. '
-                                     f'See for more details: {log_file}')
-                with log_file.open('w', encoding='UTF-8') as f:
-                    f.write(f'command: {cmd}\n')
-                    f.write(f'return code: {e.returncode}\n')
-                    f.write('\n')
-                    f.write('-- stdout --\n')
-                    stdout = e.stdout.decode(errors='replace')
-                    f.write(f'{stdout}\n')
-                    f.write('-- stderr --\n')
-                    stderr = e.stderr.decode(errors='replace')
-                    f.write(f'{stderr}\n')
-
-        testcases = [output_dir + "/" + x for x in os.listdir(output_dir) if "ktest" in x]
-        return testcases
\ No newline at end of file
+            names = os.listdir(self.output_dir)
+        except OSError:
+            return
+        ktests = []
+        for name in names:
+            match = self.ktest_re.match(name)
+            if match is not None and name not in self.seen:
+                ktests.append((int(match.group(1)), name))
+        ktests.sort()
+        if not finished and ktests:
+            # The last one may still be being written
+            ktests.pop()
+        for _, name in ktests:
+            self.seen.add(name)
+            ktest = self.output_dir + "/" + name
+            # Parse the path condition ahead of the seed deduplication
+            get_kquery_cache().get(ktest[:-len("ktest")] + "kquery")
+            self.on_testcase(ktest)
+
+def report_klee_failure(cmd, output_dir, returncode, stdout, stderr, get_logger):
+    stderr = stderr.decode(errors='replace')
+    lines = stderr.strip().splitlines()
+    lastline = lines[-1] if lines else ''
+    if 'KLEE' in lastline and 'kill(9)' in lastline:
+        get_logger().warning(f'KLEE process kill(9)ed. Failed to terminate nicely.')
+    elif os.path.isdir(output_dir):
+        log_file = Path(f"{output_dir}/symtuner.log")
+        get_logger().warning(f'Fail({returncode})ed to execute KLEE. '
+                             f'See for more details: {log_file}')
+        with log_file.open('w', encoding='UTF-8') as f:
+            f.write(f'command: {format_command(cmd)}\n')
+            f.write(f'return code: {returncode}\n')
+            f.write('\n')
+            f.write('-- stdout --\n')
+            f.write(f'{stdout.decode(errors="replace")}\n')
+            f.write('-- stderr --\n')
+            f.write(f'{stderr}\n')
+    else:
+        get_logger().warning(f'Fail({returncode})ed to execute KLEE: {format_command(cmd)}\n{stderr}')
+
+class klee_scheduler:
+    # Keeps up to n_jobs KLEE runs in flight. Runs are submitted with the arguments of
+    # klee_executor.klee_command and handed back one by one as they finish.
+    def __init__(self, executor, get_logger, n_jobs=1, max_memory=None, poll_interval=0.5):
+        self.executor = executor
+        self.get_logger = get_logger
+        self.n_jobs = max(1, n_jobs)
+        # Total memory in MB shared by the running KLEE instances
+        self.max_memory = max_memory
+        self.poll_interval = poll_interval
+        self.pending = []
+        self.running = []
+        self.watchers = {}
+
+    def __len__(self):
+        return len(self.pending) + len(self.running)
+
+    def submit(self, key, **kwargs):
+        if self.max_memory is not None:
+            kwargs["max_memory"] = max(1, self.max_memory // self.n_jobs)
+        cmd, output_dir = self.executor.klee_command(**kwargs)
+        self.pending.append((key, cmd, output_dir))
+
+    def start(self):
+        while self.pending and len(self.running) < self.n_jobs:
+            key, cmd, output_dir = self.pending.pop(0)
+            self.get_logger().info(f'klee command: {format_command(cmd)}')
+            stdout = tempfile.TemporaryFile()
+            stderr = tempfile.TemporaryFile()
+            process = spawn_command(cmd, stdout=stdout, stderr=stderr,
+                                    cwd=self.executor.llvm_dir, start_new_session=True)
+            self.running.append((key, cmd, output_dir, process, stdout, stderr))
+            if self.executor.on_testcase is not None:
+                self.watchers[output_dir] = ktest_watcher(output_dir, self.executor.on_testcase)
+
+    def next_completed(self):
+        # Returns the key and the testcases of the next run to finish
+        self.start()
+        if not self.running:
+            raise RuntimeError('No KLEE run was submitted to the scheduler')
+        while True:
+            for run in self.running:
+                key, cmd, output_dir, process, stdout, stderr = run
+                watcher = self.watchers.get(output_dir)
+                if process.poll() is None:
+                    if watcher is not None:
+                        watcher.poll()
+                    continue
+                self.running.remove(run)
+                if watcher is not None:
+                    watcher.poll(finished=True)
+                    del self.watchers[output_dir]
+                if process.returncode != 0:
+                    stdout.seek(0)
+                    stderr.seek(0)
+                    report_klee_failure(cmd, output_dir, process.returncode, stdout.read(),
+                                        stderr.read(), self.get_logger)
+                stdout.close()
+                stderr.close()
+                self.start()
+                return key, collect_testcases(output_dir)
+            time.sleep(self.poll_interval)
+
+    def close(self):
+        self.pending = []
+        for _, _, output_dir, process, stdout, stderr in self.running:
+            # Kill KLEE together with its forked solvers
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.wait()
+            stdout.close()
+            stderr.close()
+            # Testcases streamed from the run will never be collected
+            if self.executor.on_discard is not None:
+                self.executor.on_discard(output_dir)
+        self.running = []
+        self.watchers = {}
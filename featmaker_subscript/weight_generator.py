@@ -1,8 +1,14 @@
 import numpy as np
-import re
 from sklearn.cluster import KMeans
 
-lv_hp = 8
+from weightfile import write_features, write_features_text, write_weights, write_weights_text
+
+def masked_mean_std(values, mask):
+    count = mask.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(mask, values, 0).sum(axis=1) / count
+        std = np.sqrt(np.where(mask, (values - mean[:, None]) ** 2, 0).sum(axis=1) / count)
+    return mean, std
 
 class random_weight_generator:
     def __init__(self, data, top_dir, n_weights, kvalue=None):
@@ -30,57 +36,43 @@ class random_weight_generator:
                     f.write(f"{w}\n")
 
 class learning_weight_generator:
-    def __init__(self, data, top_dir, n_scores, mode="featmaker", kvalue=3):
+    def __init__(self, data, top_dir, n_scores, mode="featmaker", kvalue=3, weight_format="text"):
         self.data = data
         self.top_dir = top_dir
         self.n_weights = n_scores
         self.mode = mode
+        self.weight_format = weight_format
         self.feature_idx = {}
         self.classifier = KMeans(kvalue,n_init='auto')
 
         self.distribution = []
 
-    def abstract_condition(self,lines):
-        result = set()
-        largeValRe = re.compile("\\d{"+str(lv_hp)+",}")
-        for line in lines:
-            result.add(re.sub(largeValRe, "LargeValue", line))        
-        return result
-
     def get_scores(self):
         scores = (self.data["widx_info"])/(self.data["widx_info"].max(axis=0)+ 1)
         scores = scores.sum(axis=1)
         return scores
                     
     def write_feature_file(self, iteration):
-        if self.mode == "featmaker":
-            with open(f"{self.top_dir}/features/{iteration}.f", 'w') as f:
-                feature_list = sorted(self.feature_idx.keys(), key=lambda x: self.feature_idx[x])
-                for feature in feature_list:
-                    f.write(feature+"\n")
+        feature_dir = "features" if self.mode == "featmaker" else "combi_features"
+        feature_list = sorted(self.feature_idx.keys(), key=lambda x: self.feature_idx[x])
+        if self.weight_format == "binary":
+            write_features(f"{self.top_dir}/{feature_dir}/{iteration}.fbin", feature_list)
         else:
-            with open(f"{self.top_dir}/combi_features/{iteration}.f", 'w') as f:
-                feature_list = sorted(self.feature_idx.keys(), key=lambda x: self.feature_idx[x])
-                for feature in feature_list:
-                    f.write(feature+"\n")
+            write_features_text(f"{self.top_dir}/{feature_dir}/{iteration}.f", feature_list)
 
     def write_weight_file(self, iteration):
-        if self.mode == "featmaker":
-            for widx in range(self.n_weights):
-                with open(f"{self.top_dir}/weight/iteration-{iteration}/{widx}.w", 'w') as f:
-                    for w in self.weights[:,widx-1]:
-                        f.write(f"{w}\n")
+        weight_dir = "weight" if self.mode == "featmaker" else "combi_weight"
+        # Weight index widx takes the weights of column widx-1
+        columns = self.weights[:, np.arange(self.n_weights) - 1].T
+        if self.weight_format == "binary":
+            write_weights(f"{self.top_dir}/{weight_dir}/iteration-{iteration}/weights.wbin", columns)
         else:
             for widx in range(self.n_weights):
-                with open(f"{self.top_dir}/combi_weight/iteration-{iteration}/{widx}.w", 'w') as f:
-                    for w in self.weights[:,widx-1]:
-                        f.write(f"{w}\n")
+                write_weights_text(f"{self.top_dir}/{weight_dir}/iteration-{iteration}/{widx}.w", columns[widx])
                         
     def gather_encountered_features(self, pcidxes):
-        tmp_encountered = set()
-        for pcidx in pcidxes:
-            tmp_encountered |= self.abstract_condition(self.data["unique pc"][pcidx])
-        return tmp_encountered
+        pc_features = self.data["pc features"]
+        return set().union(*[pc_features[pcidx] for pcidx in pcidxes])
         
     def generate_weight(self, iteration):
         if iteration == 1:
@@ -101,15 +93,17 @@ class learning_weight_generator:
             self.distribution = []
             if len(remaining_features) != 0:
                 feature_encountered_score = np.zeros(self.n_weights)
-                encountered_weights = np.zeros((len(remaining_features), self.n_weights))
+                remaining_ids = np.array([self.data["feature ids"][feat] for feat in remaining_features])
+                remaining_rows = np.full(len(self.data["feature ids"]), -1)
+                remaining_rows[remaining_ids] = np.arange(len(remaining_ids))
+                incidence = np.zeros((len(remaining_features), self.n_weights), dtype=bool)
                 for widx in range(self.n_weights):
                     encountered_features = self.gather_encountered_features(self.data["widx_pcidxes"][widx])
                     feature_encountered_score[widx] = len(encountered_features)
-                    for i, feat in enumerate(remaining_features):
-                        if feat in encountered_features:
-                            encountered_weights[i][widx] = 1
+                    rows = remaining_rows[np.fromiter(encountered_features, dtype=int, count=len(encountered_features))]
+                    incidence[rows[rows >= 0], widx] = True
 
-                encountered_weights *= self.weights[np.array([self.feature_idx[x] for x in remaining_features])]
+                encountered_weights = incidence * self.weights[np.array([self.feature_idx[x] for x in remaining_features])]
                 
                 self.feature_idx = {}
                 for feat in self.data["features"]:
@@ -120,43 +114,30 @@ class learning_weight_generator:
                 self.classifier.fit(scores.reshape(-1,1))
                 
                 labels = self.classifier.labels_
-                top_widx = np.zeros_like(scores)
-                bot_widx = np.zeros_like(scores)
-                top_widx[np.where(labels == labels[scores.argmax()])[0]] = 1
-                bot_widx[np.where(labels == labels[scores.argmin()])[0]] = 1
+                top_widx = labels == labels[scores.argmax()]
+                bot_widx = labels == labels[scores.argmin()]
                 
-                for i, pre_weights in enumerate(encountered_weights):
-                    tmp_top = top_widx * pre_weights
-                    tmp_bot = bot_widx * pre_weights
-                    tmp_top = tmp_top[np.nonzero(tmp_top)[0]]
-                    tmp_bot = tmp_bot[np.nonzero(tmp_bot)[0]]
-                    
-                    tm = np.nan
-                    ts = np.nan
-                    bm = np.nan
-                    bs = np.nan
+                tm, ts = masked_mean_std(encountered_weights, (encountered_weights != 0) & top_widx)
+                bm, bs = masked_mean_std(encountered_weights, (encountered_weights != 0) & bot_widx)
+                top_nan = np.isnan(tm)
+                bot_nan = np.isnan(bm)
+                with np.errstate(invalid='ignore'):
+                    separated = np.abs(tm - bm) + np.abs(ts - bs) >= 1
+                negative = top_nan & ~bot_nan
+                learned = ~top_nan & (bot_nan | separated)
 
-                    if tmp_top.size:
-                        tm = tmp_top.mean()
-                        ts = tmp_top.std()
-                    if tmp_bot.size:
-                        bm = tmp_bot.mean()
-                        bs = tmp_bot.std()
-                    
-                    if np.isnan(tm) and np.isnan(bm):
-                        self.distribution.append((-10, 10))
-                        continue
-                    elif np.isnan(tm) and not np.isnan(bm):
-                        self.distribution.append((remaining_features[i], None))
-                        self.weights[self.feature_idx[remaining_features[i]]] = -1 * np.abs(self.weights[self.feature_idx[remaining_features[i]], :self.n_weights])
+                rows = np.array([self.feature_idx[feat] for feat in remaining_features])
+                self.weights[rows[negative]] = -1 * np.abs(self.weights[rows[negative], :self.n_weights])
+                # Drawn at once, in the order the features would be visited one by one
+                self.weights[rows[learned]] = np.random.normal(tm[learned, None], ts[learned, None], (learned.sum(), self.n_weights))
 
-                    elif not np.isnan(tm) and np.isnan(bm):
-                        self.distribution.append((remaining_features[i], (tm, ts)))
-                        self.weights[self.feature_idx[remaining_features[i]]] = np.random.normal(tm, ts, self.n_weights)
-
-                    elif np.abs(tm-bm) + np.abs(ts - bs) >= 1:
-                        self.distribution.append((remaining_features[i], (tm, ts)))
-                        self.weights[self.feature_idx[remaining_features[i]]] = np.random.normal(tm, ts, self.n_weights)
+                for i, feat in enumerate(remaining_features):
+                    if top_nan[i] and bot_nan[i]:
+                        self.distribution.append((-10, 10))
+                    elif negative[i]:
+                        self.distribution.append((feat, None))
+                    elif learned[i]:
+                        self.distribution.append((feat, (tm[i], ts[i])))
 
                 self.weights[self.weights > 10] = 10
                 self.weights[self.weights < -10] = -10
@@ -0,0 +1,402 @@
+'''Native reader of gcov notes and data files
+
+This module reads the `.gcno` graph written by GCC at compile time and the `.gcda` arc counters
+written by instrumented binaries, without running gcov. A `.gcno` graph is parsed once and its flow
+graphs are solved symbolically, so that the count of every branch arc is a linear combination of
+the instrumented arc counters. Parsed graphs are cached, and reading the coverage of a testcase
+only takes reading the counter arrays of its `.gcda` files. Branches are identified exactly as
+gcov does (see `gcov.iter_json_branches`). Formats of GCC 5 and later are supported.
+'''
+
+from pathlib import Path
+import os
+import struct
+import threading
+
+import numpy as np
+
+
+GCNO_MAGIC = 0x67636e6f
+GCDA_MAGIC = 0x67636461
+
+TAG_FUNCTION = 0x01000000
+TAG_BLOCKS = 0x01410000
+TAG_ARCS = 0x01430000
+TAG_LINES = 0x01450000
+TAG_COUNTER_ARCS = 0x01a10000
+
+ARC_ON_TREE = 1
+ARC_FAKE = 2
+
+
+class GcovFormatError(Exception):
+    '''Raised if a notes or data file can not be read natively'''
+
+
+class _Reader:
+
+    def __init__(self, path, magic):
+        self.path = path
+        self.data = Path(path).read_bytes()
+        self.pos = 0
+        if len(self.data) < 12:
+            raise GcovFormatError(f'Truncated gcov file: {path}')
+        if struct.unpack_from('<I', self.data)[0] == magic:
+            self.endian = '<'
+        elif struct.unpack_from('>I', self.data)[0] == magic:
+            self.endian = '>'
+        else:
+            raise GcovFormatError(f'Not a gcov file: {path}')
+        self.pos = 4
+        self.version = self.unsigned()
+        self.major = self._major(self.version)
+        if self.major < 5:
+            raise GcovFormatError(f'Unsupported gcov version {self.version:#x}: {path}')
+        # Record lengths and strings are counted in bytes since GCC 12, in words before
+        self.unit = 1 if self.major >= 12 else 4
+
+    @staticmethod
+    def _major(version):
+        # e.g. 'A54*' for GCC 5.4 and 'B22*' for GCC 12.2
+        first, second = (version >> 24) & 0xff, (version >> 16) & 0xff
+        if not ord('0') <= second <= ord('9'):
+            return 0
+        if ord('A') <= first <= ord('Z'):
+            return (first - ord('A')) * 10 + second - ord('0')
+        return 0
+
+    def unsigned(self):
+        value = struct.unpack_from(self.endian + 'I', self.data, self.pos)[0]
+        self.pos += 4
+        return value
+
+    def string(self):
+        length = self.unsigned() * self.unit
+        value = self.data[self.pos:self.pos + length]
+        self.pos += length
+        return value.split(b'\0', 1)[0].decode(errors='replace')
+
+    def records(self):
+        while self.pos + 8 <= len(self.data):
+            tag = self.unsigned()
+            if tag == 0:
+                break
+            length = struct.unpack_from(self.endian + 'i', self.data, self.pos)[0]
+            self.pos += 4
+            # Negative lengths mark counters that are all zero (GCC 12 and later)
+            end = self.pos + max(length, 0) * self.unit
+            yield tag, length * self.unit, end
+            self.pos = end
+
+
+def canonicalize_name(name, base='.'):
+    '''Canonicalize a source name as gcov does
+
+    Elide `.` and `dir/..` components, unless the directory does not exist.
+
+    Args:
+        name: A source name recorded in a `.gcno` file.
+        base: A directory that relative names are resolved against.
+
+    Returns:
+        The canonical name.
+    '''
+
+    absolute = name.startswith('/')
+    parts = []
+    fixed = 0  # Components that can not be elided
+    for part in name.split('/'):
+        if part in ('', '.'):
+            continue
+        if part == '..' and len(parts) > fixed \
+                and os.path.exists(os.path.join(base, '/' * absolute + '/'.join(parts))):
+            parts.pop()
+            continue
+        parts.append(part)
+        if part == '..':
+            fixed = len(parts)
+    return '/' * absolute + '/'.join(parts)
+
+
+def _linear_sum(forms, signs):
+    total = {}
+    for form, sign in zip(forms, signs):
+        for counter, coeff in form.items():
+            coeff = total.get(counter, 0) + sign * coeff
+            if coeff:
+                total[counter] = coeff
+            else:
+                total.pop(counter, None)
+    return total
+
+
+def _solve_flow(n_blocks, arcs, first_counter):
+    # Instrumented arcs are counted in block order, and in file order in each block
+    succ = [[] for _ in range(n_blocks)]
+    pred = [[] for _ in range(n_blocks)]
+    for i, (src, dst, _) in enumerate(arcs):
+        succ[src].append(i)
+        pred[dst].append(i)
+
+    forms = [None] * len(arcs)
+    counter = first_counter
+    for block in range(n_blocks):
+        for i in succ[block]:
+            if not arcs[i][2] & ARC_ON_TREE:
+                forms[i] = {counter: 1}
+                counter += 1
+
+    # Propagate counts through the spanning tree. Counts of entry and exit blocks can not be
+    # deduced from their missing predecessors and successors.
+    block_forms = [None] * n_blocks
+    changed = True
+    while changed:
+        changed = False
+        for block in range(n_blocks):
+            outs, ins = succ[block], pred[block]
+            if block_forms[block] is None:
+                if outs and all(forms[i] is not None for i in outs):
+                    block_forms[block] = _linear_sum([forms[i] for i in outs], [1] * len(outs))
+                elif ins and all(forms[i] is not None for i in ins):
+                    block_forms[block] = _linear_sum([forms[i] for i in ins], [1] * len(ins))
+                else:
+                    continue
+                changed = True
+            for arc_ids in (outs, ins):
+                unknown = [i for i in arc_ids if forms[i] is None]
+                if len(unknown) != 1:
+                    continue
+                known = [forms[i] for i in arc_ids if forms[i] is not None]
+                forms[unknown[0]] = _linear_sum([block_forms[block]] + known,
+                                                [1] + [-1] * len(known))
+                changed = True
+    return forms, succ, counter - first_counter
+
+
+class NotesFile:
+    '''Parsed `.gcno` graph
+
+    Parsed `.gcno` graph class. This keeps, for every branch gcov would report, its location and
+    its count as a linear combination of the arc counters in the matching `.gcda` file.
+    '''
+
+    def __init__(self, path, base=None):
+        '''Parse a `.gcno` graph
+
+        Args:
+            path: Path to a `.gcno` file.
+            base: A directory that relative source paths are resolved against, i.e. the directory
+                gcov would run in. If not specified, the directory of `path` is used.
+
+        Raises:
+            GcovFormatError: If the file is not a supported `.gcno` file.
+        '''
+
+        reader = _Reader(path, GCNO_MAGIC)
+        self.path = path
+        self.stamp = reader.unsigned()
+        if reader.major >= 12:
+            reader.unsigned()  # checksum
+        if reader.major >= 9:
+            reader.string()  # working directory
+        if reader.major >= 8:
+            reader.unsigned()  # support of unexecuted blocks
+
+        functions = []
+        fn = None
+        for tag, length, _ in reader.records():
+            if tag == TAG_FUNCTION:
+                ident = reader.unsigned()
+                checksums = (reader.unsigned(), reader.unsigned())
+                fn = {'ident': ident, 'checksums': checksums, 'n_blocks': 0, 'arcs': [],
+                      'lines': {}}
+                functions.append(fn)
+            elif fn is None:
+                continue
+            elif tag == TAG_BLOCKS:
+                fn['n_blocks'] = reader.unsigned() if reader.major >= 8 else length // 4
+            elif tag == TAG_ARCS:
+                src = reader.unsigned()
+                for _ in range((length - 4) // 8):
+                    dst, flags = reader.unsigned(), reader.unsigned()
+                    fn['arcs'].append((src, dst, flags))
+            elif tag == TAG_LINES:
+                block = reader.unsigned()
+                locations = fn['lines'].setdefault(block, [])
+                while True:
+                    line_num = reader.unsigned()
+                    if line_num != 0:
+                        if locations:
+                            locations[-1][1].append(line_num)
+                        continue
+                    source = reader.string()
+                    if not source:
+                        break
+                    locations.append((source, []))
+
+        # Solve flow graphs in file order, as counters are laid out in that order
+        self.functions = {}
+        n_counters = 0
+        solved = []
+        for fn in functions:
+            if fn['n_blocks'] == 0 or any(max(src, dst) >= fn['n_blocks']
+                                          for src, dst, _ in fn['arcs']):
+                raise GcovFormatError(f'Malformed function graph in: {path}')
+            forms, succ, n = _solve_flow(fn['n_blocks'], fn['arcs'], n_counters)
+            self.functions[fn['ident']] = (fn['checksums'], n_counters, n)
+            n_counters += n
+            solved.append((fn, forms, succ))
+        self.n_counters = n_counters
+
+        # Gcov lists the branches of a line in the order of functions in the file, blocks, and
+        # arcs
+        base = os.path.dirname(path) if base is None else base
+        self.branches = []
+        forms_of_branches = []
+        indices = {}
+        for fn, forms, succ in solved:
+            n_blocks = fn['n_blocks']
+            location = None  # Propagated to blocks without lines before GCC 8
+            for block in range(n_blocks):
+                if reader.major >= 8:
+                    # Each source location of a block gets the branches at its greatest line
+                    locations = [(canonicalize_name(source, base), max(lines))
+                                 for source, lines in fn['lines'].get(block, []) if lines]
+                else:
+                    # The last line of a block gets the branches, as in classic gcov
+                    for source, lines in fn['lines'].get(block, []):
+                        if lines:
+                            location = (canonicalize_name(source, base), lines[-1])
+                    locations = [] if location is None else [location]
+                if block == 0 or block + 1 == n_blocks or len(locations) == 0:
+                    continue
+                # Gcov sorts successors by their destinations after reading counters
+                real = sorted((i for i in succ[block] if not fn['arcs'][i][2] & ARC_FAKE),
+                              key=lambda i: fn['arcs'][i][1])
+                if len(real) < 2:
+                    continue
+                for location in locations:
+                    for i in real:
+                        idx = indices.get(location, 0)
+                        indices[location] = idx + 1
+                        self.branches.append((location[0], location[1], idx))
+                        forms_of_branches.append(forms[i] if forms[i] is not None else {})
+
+        # Branch counts as a sparse matrix over counters (CSR without empty rows)
+        self._rows = np.array([i for i, form in enumerate(forms_of_branches) if form],
+                              dtype=np.int64)
+        nonempty = [forms_of_branches[i] for i in self._rows]
+        self._indptr = np.cumsum([0] + [len(form) for form in nonempty])[:-1]
+        self._indices = np.array([c for form in nonempty for c in form], dtype=np.int64)
+        self._coeffs = np.array([v for form in nonempty for v in form.values()], dtype=np.int64)
+
+    def read_counters(self, path):
+        '''Read arc counters
+
+        Args:
+            path: Path to a `.gcda` file of this graph.
+
+        Returns:
+            An array of arc counters.
+
+        Raises:
+            GcovFormatError: If the file is not a supported `.gcda` file of this graph.
+        '''
+
+        reader = _Reader(path, GCDA_MAGIC)
+        if reader.unsigned() != self.stamp:
+            raise GcovFormatError(f'Stamp mismatch with its graph: {path}')
+        if reader.major >= 12:
+            reader.unsigned()  # checksum
+
+        counters = np.zeros(self.n_counters, dtype=np.int64)
+        fn = None
+        for tag, length, end in reader.records():
+            if tag == TAG_FUNCTION:
+                fn = None
+                if length >= 12:
+                    ident = reader.unsigned()
+                    checksums = (reader.unsigned(), reader.unsigned())
+                    fn = self.functions.get(ident)
+                    if fn is None or fn[0] != checksums:
+                        raise GcovFormatError(f'Function mismatch with its graph: {path}')
+            elif tag == TAG_COUNTER_ARCS and fn is not None:
+                _, offset, n = fn
+                if abs(length) != n * 8:
+                    raise GcovFormatError(f'Counter mismatch with its graph: {path}')
+                if length > 0:
+                    words = np.frombuffer(reader.data, dtype=reader.endian + 'u4', count=2 * n,
+                                          offset=reader.pos).reshape(-1, 2).astype(np.int64)
+                    counters[offset:offset + n] += words[:, 0] + (words[:, 1] << 32)
+        return counters
+
+    def covered(self, gcda):
+        '''Collect covered branches
+
+        Args:
+            gcda: Path to a `.gcda` file of this graph.
+
+        Returns:
+            A list of tuples of the source file, the line number, and the index of each covered
+            branch.
+        '''
+
+        if len(self._rows) == 0:
+            return []
+        counters = self.read_counters(gcda)
+        counts = np.add.reduceat(self._coeffs * counters[self._indices], self._indptr)
+        return [self.branches[i] for i in self._rows[counts > 0]]
+
+
+_notes = {}
+_notes_lock = threading.Lock()
+
+
+def load_notes(path):
+    '''Load a `.gcno` graph
+
+    Load a `.gcno` graph, parsing it only if it is not cached or changed since it is cached.
+
+    Args:
+        path: Path to a `.gcno` file.
+
+    Returns:
+        A `NotesFile` of the graph.
+    '''
+
+    path = os.path.realpath(str(path))
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise GcovFormatError(f'Failed to find gcno: {path}') from e
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _notes_lock:
+        notes = _notes.get(key)
+    if notes is None:
+        notes = NotesFile(path)
+        with _notes_lock:
+            _notes[key] = notes
+    return notes
+
+
+def read_branches(gcda):
+    '''Collect covered branches of a `.gcda` file
+
+    Collect covered branches of a `.gcda` file with the `.gcno` graph next to it.
+
+    Args:
+        gcda: Path to a `.gcda` file.
+
+    Returns:
+        A list of tuples of the source file, the line number, and the index of each covered
+        branch.
+
+    Raises:
+        GcovFormatError: If the files can not be read natively.
+    '''
+
+    gcno = os.path.splitext(str(gcda))[0] + '.gcno'
+    try:
+        return load_notes(gcno).covered(gcda)
+    except (OSError, struct.error, IndexError) as e:
+        raise GcovFormatError(f'Failed to read {gcda}: {e}') from e
@@ -0,0 +1,253 @@
+'''GCov backends for SymTuner
+
+This module contains the backends collecting covered branches with gcov. Depending on the gcov
+version, covered branches are read from the JSON format streamed on gcov's standard output
+(`--json-format --stdout`, GCC 9 and later), from the intermediate format (`-i`, GCC 5 to 8), or
+from the human-readable `.gcov` files as a fallback. By default, `.gcda` files are first read
+natively (see `gcda`) without running gcov at all. Every backend identifies a branch by its
+source file, its line number, and its index among the branches of the line, so the branch IDs do
+not depend on the backend in use.
+'''
+
+from functools import lru_cache
+from pathlib import Path
+import glob
+import json
+import os
+import subprocess as sp
+import tempfile
+
+# from symtuner.gcda import GcovFormatError, read_branches
+# from symtuner.logger import get_logger
+from branch_coverage import branch_id
+from gcda import GcovFormatError, read_branches
+from logger import get_logger
+
+
+@lru_cache(maxsize=None)
+def detect_format(bin='gcov'):
+    '''Detect the output format to use
+
+    Detect the richest output format supported by the given gcov executable.
+
+    Args:
+        bin: Path to GCov.
+
+    Returns:
+        One of `'json'`, `'intermediate'`, and `'text'`.
+    '''
+
+    try:
+        usage = sp.run([bin, '--help'], stdout=sp.PIPE, stderr=sp.STDOUT,
+                       check=False).stdout.decode(errors='replace')
+    except OSError:
+        usage = ''
+    if '--json-format' in usage and '--stdout' in usage:
+        fmt = 'json'
+    elif '--intermediate-format' in usage and '--json-format' not in usage:
+        fmt = 'intermediate'
+    else:
+        fmt = 'text'
+    get_logger().debug(f'gcov output format: {fmt}')
+    return fmt
+
+
+def expand_gcdas(patterns, cwd='.'):
+    '''Expand gcda patterns
+
+    Expand shell patterns of `.gcda` files (e.g. `pconfig['gcda_file']`) relative to the given
+    directory. Missing files are skipped as they contribute no covered branch.
+
+    Args:
+        patterns: A string of space-separated patterns, or a list of patterns or paths.
+        cwd: A directory that relative patterns are relative to.
+
+    Returns:
+        A list of absolute paths of existing `.gcda` files.
+    '''
+
+    if isinstance(patterns, str):
+        patterns = patterns.split()
+    base = os.path.abspath(str(cwd))
+    gcdas = []
+    for pattern in patterns:
+        gcdas.extend(sorted(glob.glob(os.path.join(base, str(pattern)))))
+    return gcdas
+
+
+def iter_json_branches(lines):
+    '''Iterate covered branches in the JSON format
+
+    Args:
+        lines: An iterable of lines of gcov's JSON output. Each line holds a whole JSON document,
+            but documents split across lines are also accepted.
+
+    Yields:
+        A tuple of the source file, the line number, and the index of each covered branch.
+    '''
+
+    buffer = ''
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode(errors='replace')
+        buffer += line
+        if not buffer.strip():
+            buffer = ''
+            continue
+        try:
+            document = json.loads(buffer)
+        except ValueError:
+            continue
+        buffer = ''
+        for source in document.get('files', []):
+            file_name = source['file']
+            indices = {}
+            for record in source.get('lines', []):
+                line_num = record['line_number']
+                idx = indices.get(line_num, 0)
+                for branch in record.get('branches', []):
+                    if branch['count'] > 0:
+                        yield file_name, line_num, idx
+                    idx += 1
+                indices[line_num] = idx
+
+
+def iter_intermediate_branches(lines):
+    '''Iterate covered branches in the intermediate format
+
+    Args:
+        lines: An iterable of lines of a `.gcov` file in the intermediate format.
+
+    Yields:
+        A tuple of the source file, the line number, and the index of each covered branch.
+    '''
+
+    file_name = None
+    indices = {}
+    for line in lines:
+        tag, _, value = line.strip().partition(':')
+        if tag == 'file':
+            file_name = value
+            indices = {}
+        elif tag == 'branch':
+            line_num, _, branch_type = value.partition(',')
+            line_num = int(line_num)
+            idx = indices.get(line_num, 0)
+            if branch_type == 'taken':
+                yield file_name, line_num, idx
+            indices[line_num] = idx + 1
+
+
+def iter_text_branches(lines):
+    '''Iterate covered branches in the human-readable format
+
+    Calls are skipped when indexing branches, so that the indices match the other formats.
+
+    Args:
+        lines: An iterable of lines of a `.gcov` file generated with `-b`.
+
+    Yields:
+        A tuple of the source file, the line number, and the index of each covered branch.
+    '''
+
+    file_name = None
+    line_num = 0
+    idx = 0
+    for line in lines:
+        fields = line.split(':', 2)
+        if len(fields) == 3:
+            num = fields[1].strip()
+            if num == '0':
+                if fields[2].startswith('Source:'):
+                    file_name = fields[2][len('Source:'):].strip()
+            elif num.isdigit():
+                line_num = int(num)
+                idx = 0
+            continue
+        if line.startswith('branch'):
+            if 'taken' in line and 'taken 0%' not in line:
+                yield file_name, line_num, idx
+            idx += 1
+
+
+class GCovBackend:
+    '''GCov backend
+
+    GCov backend class. This reads `.gcda` files natively, and runs gcov without a shell for the
+    files that can not be read natively, collecting covered branches in the output format detected
+    (or given) for the gcov executable.
+    '''
+
+    def __init__(self, bin='gcov', fmt=None, native=True):
+        '''Create a gcov backend
+
+        Args:
+            bin: Path to GCov.
+            fmt: One of `'json'`, `'intermediate'`, and `'text'`. If not specified, the format is
+                detected from the gcov executable.
+            native: Read `.gcda` files natively before falling back to gcov.
+        '''
+
+        self.bin = bin
+        self.format = detect_format(bin) if fmt is None else fmt
+        self.native = native
+
+    def iter_branches(self, gcdas, cwd='.'):
+        '''Iterate covered branches
+
+        Args:
+            gcdas: A list of `.gcda` files.
+            cwd: A directory to run gcov in. Relative source paths are resolved against it in the
+                text format, and the `.gcov` files are written to it.
+
+        Yields:
+            A tuple of the source file, the line number, and the index of each covered branch.
+        '''
+
+        gcdas = [os.path.abspath(str(gcda)) for gcda in gcdas]
+        if self.native:
+            fallbacks = []
+            for gcda in gcdas:
+                try:
+                    branches = read_branches(gcda)
+                except GcovFormatError as e:
+                    get_logger().debug(f'Falling back to gcov: {e}')
+                    fallbacks.append(gcda)
+                    continue
+                yield from branches
+            gcdas = fallbacks
+        if len(gcdas) == 0:
+            return
+
+        if self.format == 'json':
+            cmd = [self.bin, '-b', '--json-format', '--stdout', *gcdas]
+            with sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.DEVNULL, cwd=str(cwd)) as process:
+                yield from iter_json_branches(process.stdout)
+
+        elif self.format == 'intermediate':
+            # Keep the intermediate files away from the program directory
+            with tempfile.TemporaryDirectory(prefix='symtuner-gcov-') as out_dir:
+                sp.run([self.bin, '-b', '-i', *gcdas], stdout=sp.DEVNULL, stderr=sp.DEVNULL,
+                       cwd=out_dir)
+                for gcov in sorted(Path(out_dir).glob('*.gcov')):
+                    with gcov.open(encoding='UTF-8', errors='replace') as f:
+                        yield from iter_intermediate_branches(f)
+
+        else:
+            sp.run([self.bin, '-b', *gcdas], stdout=sp.DEVNULL, stderr=sp.DEVNULL, cwd=str(cwd))
+            for gcov in sorted(Path(str(cwd)).glob('*.gcov')):
+                with gcov.open(encoding='UTF-8', errors='replace') as f:
+                    yield from iter_text_branches(f)
+
+    def covered(self, gcdas, cwd='.'):
+        '''Collect covered branches
+
+        Args:
+            gcdas: A list of `.gcda` files.
+            cwd: A directory to run gcov in.
+
+        Returns:
+            A list of covered branch IDs (see `branch_coverage.branch_id`).
+        '''
+
+        return [branch_id(*branch) for branch in self.iter_branches(gcdas, cwd)]
@@ -9,13 +9,21 @@ from copy import deepcopy
 from pathlib import Path
 import os
 import random
+import shutil
 import subprocess as sp
 
 # from symtuner.logger import get_logger
 # from symtuner.symbolic_executor import SymbolicExecutor
 # from symtuner.symtuner import SymTuner
 
+from branch_coverage import Coverage
+from gcov import GCovBackend
+from launcher import format_command
+from launcher import remove_files
+from launcher import run_command
+from launcher import spawn_command
 from logger import get_logger
+from setcover import greedy_cover
 from symbolic_executor import SymbolicExecutor
 from symtuner import SymTuner
 
@@ -37,6 +45,7 @@ class GCov:
 
         self.bin = bin
         self.smoke_test()
+        self.backend = GCovBackend(self.bin)
         if self.bin != 'gcov':
             get_logger().info(f'Use gcov executable at: {self.bin}')
 
@@ -50,8 +59,7 @@ class GCov:
         '''
 
         try:
-            _ = sp.run(f'{self.bin} -version', stdout=sp.PIPE, stderr=sp.PIPE,
-                       shell=True, check=True)
+            _ = run_command([self.bin, '-version'], check=True)
         except sp.CalledProcessError as e:
             get_logger().fatal(f'Failed to find gcov: {self.bin}')
             raise e
@@ -65,53 +73,21 @@ class GCov:
         Args:
             target: Target binary that `gcdas` are collected from.
             gcdas: A List of `gcda` files.
-            folder_depth: Depth of folders to collect gcov files. For example, if `folder_depth`
-                is set to 2, gcov files are collected with the `../../**/*.gcov` pattern.
+            folder_depth: Not used. Covered branches are read from the output of gcov instead of
+                collecting gcov files. Kept for compatibility.
 
         Returns:
-            A set of covered branches.
+            A `Coverage` of covered branches.
         '''
 
-        # If no gcda, return empty set
+        # If no gcda, return empty coverage
         if len(gcdas) == 0:
-            return set()
+            return Coverage()
 
-        # Move to program directory.
-        original_path = Path().absolute()
+        # Run gcov in the program directory.
         target_dir = Path(target).parent
-        gcdas = [gcda.absolute() for gcda in gcdas]
-        os.chdir(str(target_dir))
-
-        # Run Gcov.
-        cmd = [str(self.bin), '-b', *list(map(str, gcdas))]
-        cmd = ' '.join(cmd)
-        get_logger().debug(f'gcov command: {cmd}')
-        _ = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, shell=True, check=True)
-
-        # Get gcov files.
-        base = Path()
-        for _ in range(folder_depth):
-            if "gawk" in str(target) or "sqlite" in str(target):
-                pass
-            else:
-                base = base / '..'
-        gcov_pattern = base / '**/*.gcov'
-        gcovs = list(Path().glob(str(gcov_pattern)))
-        get_logger().debug(f'found gcovs: {", ".join(map(str, gcovs))}')
-
-        # Get covered branches.
-        covered = set()
-        for gcov in gcovs:
-            with gcov.open(encoding='UTF-8', errors='replace') as f:
-                file_name = f.readline().strip().split(':')[-1]
-                for i, line in enumerate(f):
-                    if ('branch' in line) and ('never' not in line) and ('taken 0%' not in line):
-                        bid = f'{file_name} {i}'
-                        covered.add(bid)
-
-        # Restore original directory.
-        os.chdir(str(original_path))
-        return covered
+        get_logger().debug(f'gcov gcdas: {", ".join(map(str, gcdas))}')
+        return Coverage(self.backend.covered(gcdas, target_dir))
 
 
 class KLEE(SymbolicExecutor):
@@ -145,8 +121,7 @@ class KLEE(SymbolicExecutor):
 
         try:
             print(self.bin)
-            _ = sp.run(f'{self.bin} -version',  stdout=sp.PIPE, stderr=sp.PIPE,
-                       shell=True, check=True)
+            _ = run_command([self.bin, '-version'], check=True)
         except sp.CalledProcessError as e:
             get_logger().fatal(f'Failed to find klee: {self.bin}')
             raise e
@@ -201,34 +176,34 @@ class KLEE(SymbolicExecutor):
                 values = [values]
             for value in values:
                 if value is None:
-                    param = key
+                    param = [key]
                 elif stripped_key in space_seperate_keys:
-                    param = f'{key} {value}'
+                    # Keys may carry their first argument (e.g. '-sym-files 1'), and values
+                    # several arguments (e.g. '0 2 4' of -sym-args)
+                    param = [*key.split(), *str(value).split()]
                 elif stripped_key == 'sym-stdout':
                     if value == 'off':
                         continue
-                    param = key
+                    param = [key]
                 else:
-                    param = f'{key}={value}'
+                    param = [f'{key}={value}']
                 if stripped_key in sym_arg_keys:
-                    sym_arg_options.append(param)
+                    sym_arg_options.extend(param)
                 elif stripped_key == 'sym-files':
-                    sym_files_options.append(param)
+                    sym_files_options.extend(param)
                 elif stripped_key == 'sym-stdin':
-                    sym_stdin_options.append(param)
+                    sym_stdin_options.extend(param)
                 elif stripped_key == 'sym-stdout':
-                    sym_stdout_options.append(param)
+                    sym_stdout_options.extend(param)
                 else:
-                    klee_options.append(param)
+                    klee_options.extend(param)
         cmd = [str(self.bin), *klee_options, str(target),
                *sym_arg_options, *sym_files_options, *sym_stdin_options, *sym_stdout_options]
 
         # Run KLEE
-        cmd = ' '.join(cmd)
-        get_logger().debug(f'klee command: {cmd}')
+        get_logger().debug(f'klee command: {format_command(cmd)}')
         try:
-            _ = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE,
-                       shell=True, check=True)
+            _ = run_command(cmd, check=True)
         except sp.CalledProcessError as e:
             stderr = e.stderr.decode(errors='replace')
             lastline = stderr.strip().splitlines()[-1]
@@ -251,7 +226,7 @@ class KLEE(SymbolicExecutor):
                 get_logger().warning(f'Fail({e.returncode})ed to execute KLEE. '
                                      f'See for more details: {log_file}')
                 with log_file.open('w', encoding='UTF-8') as f:
-                    f.write(f'command: {cmd}\n')
+                    f.write(f'command: {format_command(cmd)}\n')
                     f.write(f'return code: {e.returncode}\n')
                     f.write('\n')
                     f.write('-- stdout --\n')
@@ -316,12 +291,9 @@ class KLEEReplay:
             CalledProcessError: If failed to find KLEE replay at the given `bin`.
         '''
 
-        try:
-            _ = sp.run(f'which {self.bin}',  stdout=sp.PIPE, stderr=sp.PIPE,
-                       shell=True, check=True)
-        except sp.CalledProcessError as e:
+        if shutil.which(self.bin) is None:
             get_logger().fatal(f'Failed to find klee-replay: {self.bin}')
-            raise e
+            raise sp.CalledProcessError(1, ['which', self.bin])
         get_logger().debug(f'klee-replay found: {self.bin}')
 
     def run(self, target, testcase, error_type=None, folder_depth=1):
@@ -358,9 +330,8 @@ class KLEEReplay:
 
         # Run KLEE-replay
         cmd = [str(self.bin), str(target), str(testcase)]
-        cmd = ' '.join(cmd)
-        get_logger().debug(f'klee-replay command: {cmd}')
-        process = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE, shell=True)
+        get_logger().debug(f'klee-replay command: {format_command(cmd)}')
+        process = spawn_command(cmd, stdout=sp.PIPE, stderr=sp.PIPE)
         errors = set()
         try:
             _, stderr = process.communicate(timeout=0.1)
@@ -542,32 +513,16 @@ class KLEESymTuner(SymTuner):
 
         # Find buggy testcases
         buggy_seeds = []
-        found_bugs = []
+        found_bugs = set()
         for _, bugs, tc, _ in self.data[::-1]:
             for bug in bugs:
                 if bug not in found_bugs:
-                    found_bugs.append(bug)
+                    found_bugs.add(bug)
                     buggy_seeds.append(tc)
 
         # Find top k testcases that covers most
-        accumulated_coverage = set()
-        copied_data = deepcopy(self.data)
-        top_k_seeds = []
-
-        for _ in range(self.k_seeds):
-            if len(copied_data) == 0:
-                break
-            copied_data = sorted(copied_data,
-                                 key=lambda elem: len(elem[0]),
-                                 reverse=True)
-            top_cov, _, tc, _ = copied_data.pop(0)
-            if len(top_cov) > 0:
-                accumulated_coverage = accumulated_coverage | top_cov
-                copied_data = [(cov - accumulated_coverage, bug, tc, param)
-                               for cov, bug, tc, param in copied_data]
-                top_k_seeds.append(tc)
-            else:
-                break
+        picked = greedy_cover([cov for cov, _, _, _ in self.data], limit=self.k_seeds)
+        top_k_seeds = [self.data[idx][2] for idx in picked]
 
         # Update space for -seed-file
         key = '-seed-file' if '-seed-file' in self.space.keys() else '--seed-file'
@@ -600,11 +555,10 @@ class KLEESymTuner(SymTuner):
                 pass
             else:
                 base = base / '..'
-        cmd = ['rm', '-f', base + '/**/*.gcda', base + '/**/*.gcov']
-        cmd = ' '.join(cmd)
-        get_logger().debug(f'gcda gcov clean up command: {cmd}')
-        _ = sp.run(cmd, shell=True, check=True)
-        print("DD : ", cmd, os.listdir(os.getcwd()))
+        patterns = [f'{base}/**/*.gcda', f'{base}/**/*.gcov']
+        get_logger().debug(f'gcda gcov clean up patterns: {" ".join(patterns)}')
+        remove_files(patterns)
+        print("DD : ", patterns, os.listdir(os.getcwd()))
         errors, gcdas = self.klee_replay.run(target, testcase,
                                              folder_depth=folder_depth)
         branches = self.gcov.run(target, gcdas, folder_depth=folder_depth)
@@ -354,6 +354,7 @@ namespace klee {
   public:
     AutoFeatureSearcher(const std::string &weightFile,
                           const std::string &featureFile,
+                          unsigned weightIndex,
                           Executor &_executor);
     ~AutoFeatureSearcher();
 
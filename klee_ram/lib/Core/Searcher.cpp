@@ -486,23 +486,67 @@ void InterleavedSearcher::update(
 
 ///FeatMaker
 
+namespace {
+// Binary weight and feature files written by weightfile.py
+const char WeightMagic[4] = {'F', 'M', 'W', 'T'};
+const char FeatureMagic[4] = {'F', 'M', 'F', 'T'};
+const std::streamoff WeightHeaderSize = 16;
+
+bool readMagic(std::ifstream &in, const char *magic) {
+  char buf[4];
+  if (in.read(buf, sizeof(buf)) && std::equal(buf, buf + sizeof(buf), magic))
+    return true;
+  in.clear();
+  in.seekg(0);
+  return false;
+}
+
+uint32_t readUInt32(std::ifstream &in) {
+  unsigned char buf[4] = {0, 0, 0, 0};
+  in.read(reinterpret_cast<char *>(buf), sizeof(buf));
+  return buf[0] | (buf[1] << 8) | (buf[2] << 16) | ((uint32_t)buf[3] << 24);
+}
+} // namespace
+
 AutoFeatureSearcher::AutoFeatureSearcher(const std::string &weightFile,
                                               const std::string &featureFile,
+                                              unsigned weightIndex,
                                               Executor &_executor)
   :executor(_executor), updateFeatureMap(false){
-  std::ifstream fin(featureFile.c_str());
-  std::ifstream win(weightFile.c_str());
+  std::ifstream fin(featureFile.c_str(), std::ios::binary);
+  std::ifstream win(weightFile.c_str(), std::ios::binary);
   assert(fin && "no feature file");
   assert(win && "no weight file");
   std::string cond;
   featureCount = 0;
-  while (getline(fin, cond, '\n')){
-    feature_map[cond] = featureCount;
-    ++featureCount;
+  if (readMagic(fin, FeatureMagic)) {
+    readUInt32(fin); // version
+    uint32_t count = readUInt32(fin);
+    for (uint32_t i = 0; i < count && fin; ++i) {
+      cond.resize(readUInt32(fin));
+      fin.read(&cond[0], cond.size());
+      feature_map[cond] = featureCount;
+      ++featureCount;
+    }
+  } else {
+    while (getline(fin, cond, '\n')){
+      feature_map[cond] = featureCount;
+      ++featureCount;
+    }
   }
-  double weight;
-  while (win >> weight){
-    weights.push_back(weight);
+  if (readMagic(win, WeightMagic)) {
+    readUInt32(win); // version
+    uint32_t rows = readUInt32(win);
+    uint32_t cols = readUInt32(win);
+    assert(weightIndex < cols && "weight index out of range");
+    weights.resize(rows);
+    win.seekg(WeightHeaderSize + (std::streamoff)weightIndex * rows * sizeof(double));
+    win.read(reinterpret_cast<char *>(weights.data()), rows * sizeof(double));
+  } else {
+    double weight;
+    while (win >> weight){
+      weights.push_back(weight);
+    }
   }
   largeValueRe = std::regex("\\d{8,}");
   constArrRe = std::regex("const_arr\\d+");
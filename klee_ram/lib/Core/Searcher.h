@@ -318,6 +318,7 @@ namespace klee {
   public:
     AutoFeatureSearcher(const std::string &weightFile,
                           const std::string &featureFile,
+                          unsigned weightIndex,
                           Executor &_executor);
     ~AutoFeatureSearcher();
 
@@ -99,6 +99,12 @@ cl::opt<std::string> Weight(
 		"weight",
 		cl::desc("Weight file for AutoFeature searcher"),
 		cl::cat(SearchCat));
+
+cl::opt<unsigned> WeightIndex(
+		"weight-index",
+		cl::desc("Weight index to read from a binary weight file for AutoFeature searcher (default=0)"),
+		cl::init(0),
+		cl::cat(SearchCat));
 } // namespace
 
 void klee::initializeSearchOptions() {
@@ -137,7 +143,7 @@ Searcher *getNewSearcher(Searcher::CoreSearchType type, Executor &executor, cons
   case Searcher::NURS_ICnt: searcher = new WeightedRandomSearcher(WeightedRandomSearcher::InstCount); break;
   case Searcher::NURS_CPICnt: searcher = new WeightedRandomSearcher(WeightedRandomSearcher::CPInstCount); break;
   case Searcher::NURS_QC: searcher = new WeightedRandomSearcher(WeightedRandomSearcher::QueryCost); break;
-  case Searcher::AutoFeat: searcher = new AutoFeatureSearcher(weightFile, featureFile, executor); break;
+  case Searcher::AutoFeat: searcher = new AutoFeatureSearcher(weightFile, featureFile, WeightIndex, executor); break;
   }
 
   return searcher;
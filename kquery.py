@@ -0,0 +1,262 @@
+'''Path condition cache for KLEE testcases
+
+This module contains the cache of the path conditions KLEE dumps next to each testcase (`.kquery`
+files). Each `.kquery` file is read and parsed once into its constraint lines and a fingerprint,
+and every later lookup of the same (unchanged) file is served from memory. The cache is bounded in
+size and evicts the least recently used entries first.
+'''
+
+from collections import OrderedDict
+from collections import namedtuple
+import hashlib
+import os
+import threading
+
+
+_CACHE = None
+
+_QUERY_START = '(query ['
+_QUERY_END = '] false)'
+_LINES_START = '(query [\n'
+
+# Size of query fingerprints in bytes
+FINGERPRINT_SIZE = 16
+
+KQuery = namedtuple('KQuery', ['lines', 'query', 'digest'])
+KQuery.__doc__ = '''Parsed `.kquery` file
+
+Attributes:
+    lines: A list of the constraint lines of the query (i.e. the lines between `(query [` and the
+        closing `] false)`).
+    query: The query text from `(query [` to `] false)`, or `None` if the file has no query.
+    digest: The fingerprint of the query text (see `fingerprint`).
+'''
+
+
+def fingerprint(query):
+    '''Get the fingerprint of a query
+
+    Get a fixed-size digest of the canonicalized query text. Queries are canonicalized by collapsing
+    whitespace, so queries differing only in their layout have the same fingerprint.
+
+    Args:
+        query: A query text, or `None`.
+
+    Returns:
+        A digest of `FINGERPRINT_SIZE` bytes.
+    '''
+
+    canonical = ' '.join((query or '').split())
+    return hashlib.blake2b(canonical.encode(errors='surrogateescape'),
+                           digest_size=FINGERPRINT_SIZE).digest()
+
+
+_EMPTY = KQuery([], None, fingerprint(None))
+
+
+def parse_kquery(stream):
+    '''Parse a `.kquery` file
+
+    Parse a `.kquery` file line by line, without holding the whole content.
+
+    Args:
+        stream: An iterable of the lines of a `.kquery` file, with their line endings (e.g. a file
+            object).
+
+    Returns:
+        A `KQuery` object.
+    '''
+
+    lines = None
+    last = None
+    query = None
+    closed = False
+    for line in stream:
+        last = line
+        if lines is not None:
+            lines.append(line[:-1] if line.endswith('\n') else line)
+        elif line.endswith(_LINES_START):
+            lines = []
+
+        if closed:
+            continue
+        start = 0
+        if query is None:
+            start = line.find(_QUERY_START)
+            if start < 0:
+                continue
+            query = []
+        # The query closes at the first `] false)` after `(query [`
+        end = line.find(_QUERY_END, start + len(_QUERY_START) if len(query) == 0 else 0)
+        if end < 0:
+            query.append(line[start:])
+        else:
+            query.append(line[start:end + len(_QUERY_END)])
+            closed = True
+
+    if lines is None:
+        lines = []
+    else:
+        # Lines after `(query [` except the closing line, as in `split('\n')[:-2]`
+        if len(lines) == 0 or last.endswith('\n'):
+            lines.append('')
+        lines = lines[:-2]
+    query = ''.join(query) if closed else None
+    return KQuery(lines, query, fingerprint(query))
+
+
+class QueryFingerprintStore:
+    '''Set of query fingerprints
+
+    Set class of query fingerprints (see `fingerprint`). Optionally, fingerprints are appended to a
+    file as they are added, so that the set survives restarts.
+    '''
+
+    def __init__(self, path=None):
+        '''Create a fingerprint store
+
+        Args:
+            path: A path to the file keeping the fingerprints. If the file exists, fingerprints in
+                the file are loaded. If not specified, fingerprints are kept in memory only.
+        '''
+
+        self.path = path
+        self._fingerprints = set()
+        self._file = None
+        if path is not None:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                # Ignore a record truncated by a crash
+                n_records = len(data) // FINGERPRINT_SIZE
+                self._fingerprints.update(data[i * FINGERPRINT_SIZE:(i + 1) * FINGERPRINT_SIZE]
+                                          for i in range(n_records))
+                if len(data) != n_records * FINGERPRINT_SIZE:
+                    with open(path, 'r+b') as f:
+                        f.truncate(n_records * FINGERPRINT_SIZE)
+            self._file = open(path, 'ab')
+
+    def add(self, digest):
+        '''Add a fingerprint
+
+        Args:
+            digest: A fingerprint of `FINGERPRINT_SIZE` bytes.
+        '''
+
+        if digest in self._fingerprints:
+            return
+        self._fingerprints.add(digest)
+        if self._file is not None:
+            self._file.write(digest)
+            self._file.flush()
+
+    def close(self):
+        '''Close the file keeping the fingerprints if any'''
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __contains__(self, digest):
+        return digest in self._fingerprints
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+
+class KQueryCache:
+    '''Least recently used cache of parsed `.kquery` files
+
+    Cache class of parsed `.kquery` files. Entries are keyed by the real path of the file and
+    invalidated when the modification time or the size of the file changes. This class is
+    thread-safe.
+    '''
+
+    def __init__(self, maxsize=65536):
+        '''Create a cache
+
+        Args:
+            maxsize: Maximum number of entries kept in memory. By default, this will be set as
+                65536.
+        '''
+
+        self.maxsize = max(1, maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kquery):
+        '''Get a parsed `.kquery` file
+
+        Args:
+            kquery: A path to a `.kquery` file.
+
+        Returns:
+            A `KQuery` object, or `None` if the file does not exist.
+        '''
+
+        path = os.path.realpath(str(kquery))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == stamp:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return cached[1]
+
+        try:
+            with open(path, 'r', errors='ignore') as f:
+                entry = parse_kquery(f)
+        except OSError:
+            return None
+
+        with self._lock:
+            self.misses += 1
+            self._entries[path] = (stamp, entry)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def lines(self, kquery):
+        '''Get the constraint lines of a `.kquery` file
+
+        Args:
+            kquery: A path to a `.kquery` file.
+
+        Returns:
+            A list of the constraint lines, or an empty list if the file does not exist.
+        '''
+
+        return (self.get(kquery) or _EMPTY).lines
+
+    def clear(self):
+        '''Remove all entries from memory'''
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_kquery_cache():
+    '''Get the `.kquery` cache.
+
+    Get a singleton `KQueryCache`. If `KQueryCache` not defined make one and return. If
+    `get_kquery_cache` called previously, returns a `KQueryCache` object created previously.
+
+    Returns:
+        A `KQueryCache` object.
+    '''
+
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = KQueryCache()
+    return _CACHE
@@ -0,0 +1,145 @@
+'''Process launching for SymTuner
+
+This module contains the process-launch layer running KLEE, klee-replay, and gcov. Commands are
+run from argument vectors without `/bin/sh`, so that each launch forks the tool alone. File
+cleanups and copies are done in Python instead of launching `rm` and `cp`.
+'''
+
+import glob
+import os
+import shlex
+import shutil
+import subprocess as sp
+
+
+def split_command(cmd):
+    '''Get the argument vector of a command
+
+    Args:
+        cmd: A command line or a list of arguments. Command lines are split as the shell would,
+            without expanding variables or patterns.
+
+    Returns:
+        A list of arguments.
+    '''
+
+    if isinstance(cmd, str):
+        return shlex.split(cmd)
+    return [str(arg) for arg in cmd]
+
+
+def format_command(cmd):
+    '''Get the command line of a command
+
+    Args:
+        cmd: A command line or a list of arguments (see `split_command`).
+
+    Returns:
+        A command line, quoted so that the shell would split it into the same arguments. This is
+        meant for logs only.
+    '''
+
+    if isinstance(cmd, str):
+        return cmd
+    return ' '.join(shlex.quote(str(arg)) for arg in cmd)
+
+
+def run_command(cmd, cwd=None, env=None, stdout=sp.PIPE, stderr=sp.PIPE, check=False,
+                timeout=None):
+    '''Run a command
+
+    Run a command without a shell and wait until it exits. A command which failed to execute
+    exits with 127, as it would with the shell.
+
+    Args:
+        cmd: A command line or a list of arguments (see `split_command`).
+        cwd: A directory to run the command in.
+        env: An environment to run the command with.
+        stdout: Standard output of the command. By default, the output is captured.
+        stderr: Standard error of the command. By default, the output is captured.
+        check: Whether to raise if the command exits with non-zero.
+        timeout: Timeout of the command in seconds.
+
+    Returns:
+        A `subprocess.CompletedProcess` object.
+
+    Raises:
+        CalledProcessError: If `check` is set and the command exits with non-zero.
+    '''
+
+    argv = split_command(cmd)
+    try:
+        return sp.run(argv, stdout=stdout, stderr=stderr, cwd=cwd, env=env, check=check,
+                      timeout=timeout)
+    except OSError as e:
+        message = f'{argv[0] if argv else ""}: {e.strerror}\n'.encode()
+        if check:
+            raise sp.CalledProcessError(127, argv, b'', message) from e
+        return sp.CompletedProcess(argv, 127, b'', message)
+
+
+def spawn_command(cmd, cwd=None, env=None, stdin=None, stdout=None, stderr=None,
+                  start_new_session=False):
+    '''Start a command
+
+    Start a command without a shell.
+
+    Args:
+        cmd: A command line or a list of arguments (see `split_command`).
+        cwd: A directory to run the command in.
+        env: An environment to run the command with.
+        stdin: Standard input of the command.
+        stdout: Standard output of the command.
+        stderr: Standard error of the command.
+        start_new_session: Whether to run the command in a new session, so that the command and
+            its children can be killed together.
+
+    Returns:
+        A `subprocess.Popen` object.
+    '''
+
+    return sp.Popen(split_command(cmd), stdin=stdin, stdout=stdout, stderr=stderr, cwd=cwd,
+                    env=env, start_new_session=start_new_session)
+
+
+def remove_files(patterns, cwd=None):
+    '''Remove files
+
+    Remove the files matching the patterns, as `rm -f` would. Patterns are expanded as the shell
+    would (i.e. `**` matches a single directory).
+
+    Args:
+        patterns: A list of patterns, or a string of space-separated patterns. Relative patterns
+            are relative to `cwd`.
+        cwd: A directory the patterns are relative to. If not specified, the current directory.
+    '''
+
+    if isinstance(patterns, str):
+        patterns = patterns.split()
+    for pattern in patterns:
+        pattern = os.path.join(cwd, str(pattern)) if cwd is not None else str(pattern)
+        for path in glob.glob(pattern):
+            try:
+                os.unlink(path)
+            except (FileNotFoundError, IsADirectoryError, PermissionError):
+                pass
+
+
+def copy_tree(src, dst_dir):
+    '''Copy a directory into another
+
+    Copy a directory into another, as `cp -r src dst_dir/` would. Symbolic links are copied as
+    symbolic links. Regular files already in the copy are overwritten, but symbolic links already
+    in the copy are reported as errors.
+
+    Args:
+        src: A directory to copy.
+        dst_dir: A directory to copy `src` into.
+
+    Returns:
+        The path of the copy.
+    '''
+
+    dst = os.path.join(dst_dir, os.path.basename(os.path.normpath(src)))
+    shutil.copytree(src, dst, symlinks=True, dirs_exist_ok=True)
+    return dst
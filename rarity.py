@@ -0,0 +1,161 @@
+'''Branch rarity scores for SymChestra
+
+This module contains the rarity-score engine shared by the orchestrator and the seed selection.
+Each covered branch has a frequency, which grows by the per-branch score of the current mode every
+time a testcase covers the branch. The rarity score of a coverage is the sum of the inverse
+frequencies of its branches, so coverages of rarely covered branches score high. Frequencies and
+per-branch scores are kept in dense arrays indexed by interned branch ID (see `branch_coverage`),
+so that updates and scores are vectorized over whole coverages.
+'''
+
+import numpy as np
+
+# from symtuner.branch_coverage import Coverage
+# from symtuner.branch_coverage import get_interner
+from branch_coverage import Coverage
+from branch_coverage import get_interner
+
+
+class RarityScorer:
+    '''Branch rarity-score engine
+
+    Rarity-score engine class. This keeps the frequency of each branch, and for each mode, the
+    per-branch score added to the frequency when the mode covers a branch and the frequency added
+    by the mode alone. Per-branch scores start from 1.
+    '''
+
+    def __init__(self, modes=(), interner=None):
+        '''Create a rarity-score engine
+
+        Args:
+            modes: A list of modes to keep per-branch scores of. Unknown modes are added on their
+                first use.
+            interner: A `BranchInterner` the branch IDs are from. If not specified, the shared
+                interner is used.
+        '''
+
+        self.interner = get_interner() if interner is None else interner
+        self.size = 0
+        self.frequency = np.zeros(0)
+        self.per_score = {}
+        self.mode_frequency = {}
+        for mode in modes:
+            self._add_mode(mode)
+
+    def _add_mode(self, mode):
+        self.per_score[mode] = np.ones(self.size)
+        self.mode_frequency[mode] = np.zeros(self.size)
+
+    def _reserve(self, size):
+        if size <= self.size:
+            return
+        size = max(size, 2 * self.size, 1024)
+        grow = size - self.size
+        self.frequency = np.concatenate([self.frequency, np.zeros(grow)])
+        for mode in self.per_score:
+            self.per_score[mode] = np.concatenate([self.per_score[mode], np.ones(grow)])
+            self.mode_frequency[mode] = np.concatenate([self.mode_frequency[mode], np.zeros(grow)])
+        self.size = size
+
+    def ids(self, branches):
+        '''Get IDs of branches
+
+        Args:
+            branches: A `Coverage`, a NumPy array of branch IDs, or an iterable of branches.
+
+        Returns:
+            A NumPy array of the branch IDs.
+        '''
+
+        if isinstance(branches, np.ndarray):
+            ids = branches
+        else:
+            if not isinstance(branches, Coverage):
+                branches = Coverage(branches, self.interner)
+            ids = branches.ids()
+        self._reserve(len(self.interner))
+        return ids
+
+    def update(self, mode, coverages):
+        '''Update branch frequencies with coverages
+
+        Update the frequencies of the branches covered by each coverage with the per-branch scores
+        of the mode, at once. A branch covered by several coverages is updated once per coverage.
+
+        Args:
+            mode: A mode which covered the branches.
+            coverages: A list of `Coverage`s, NumPy arrays of branch IDs, or iterables of branches.
+        '''
+
+        if mode not in self.per_score:
+            self._add_mode(mode)
+        ids = [self.ids(coverage) for coverage in coverages]
+        if len(ids) == 0:
+            return
+        counts = np.bincount(np.concatenate(ids), minlength=self.size)
+        touched = np.flatnonzero(counts)
+        added = self.per_score[mode][touched] * counts[touched]
+        self.frequency[touched] += added
+        self.mode_frequency[mode][touched] += added
+
+    def scale(self, mode, branches, factor):
+        '''Scale per-branch scores
+
+        Args:
+            mode: A mode to scale the per-branch scores of.
+            branches: A `Coverage`, a NumPy array of branch IDs, or an iterable of branches.
+            factor: A factor to multiply the per-branch scores by.
+        '''
+
+        if mode not in self.per_score:
+            self._add_mode(mode)
+        self.per_score[mode][self.ids(branches)] *= factor
+
+    def score(self, branches):
+        '''Get the rarity score of branches
+
+        Args:
+            branches: A `Coverage`, a NumPy array of branch IDs, or an iterable of branches.
+
+        Returns:
+            The sum of the inverse frequencies of the branches.
+        '''
+
+        with np.errstate(divide='ignore'):
+            return float(np.sum(1 / self.frequency[self.ids(branches)]))
+
+    def scores(self, coverages):
+        '''Get the rarity scores of coverages
+
+        Args:
+            coverages: A list of `Coverage`s, NumPy arrays of branch IDs, or iterables of branches.
+
+        Returns:
+            A NumPy array of the rarity score of each coverage.
+        '''
+
+        ids = [self.ids(coverage) for coverage in coverages]
+        if len(ids) == 0:
+            return np.zeros(0)
+        with np.errstate(divide='ignore'):
+            inverse = np.concatenate([1 / self.frequency[each] for each in ids] + [np.zeros(1)])
+        starts = np.cumsum([0] + [len(each) for each in ids[:-1]])
+        scores = np.add.reduceat(inverse, starts)
+        # reduceat takes the element at the start for empty coverages
+        scores[np.array([len(each) for each in ids]) == 0] = 0.0
+        return scores
+
+    def changed(self, snapshot):
+        '''Find branches of which the frequency changed
+
+        Args:
+            snapshot: A copy of `RarityScorer.frequency` taken before.
+
+        Returns:
+            A NumPy array of IDs of the branches of which the frequency differs from the snapshot.
+        '''
+
+        current = self.frequency[:len(snapshot)]
+        changed = np.flatnonzero(current != snapshot)
+        grown = np.flatnonzero(self.frequency[len(snapshot):]) + len(snapshot)
+        return np.concatenate([changed, grown])
@@ -0,0 +1,441 @@
+'''Parallel replay engine for SymTuner
+
+This module contains the replay engine used by `SymTuner.add`. The engine replays KLEE testcases
+(`.ktest` files) with klee-replay and collects the covered branches with gcov. Testcases are
+replayed in batches (see `replay_batch`): a single klee-replay forks a run of the program per
+testcase, and the `.gcda` counters of each run are redirected into its own replay directory.
+Batches are evaluated across a pool of workers. Testcases can be prefetched while KLEE is still
+running, so that their results are ready when the run is evaluated. With a klee-replay which can
+not keep its replay directories, each testcase is replayed by its own klee-replay in an isolated
+workspace instead (see `workspace`).
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import functools
+import math
+import os
+import re
+import select
+import shutil
+import signal
+import subprocess as sp
+import threading
+import time
+
+# from symtuner.logger import get_logger
+from gcov import GCovBackend
+from gcov import expand_gcdas
+from launcher import spawn_command
+from logger import get_logger
+from workspace import WorkspaceManager
+from workspace import gcov_root
+from workspace import prefix_strip
+
+
+KLEE_REPLAY_BIN = '/root/symchestra/klee_featmaker/build/bin/klee-replay'
+
+# Directory (relative to each replay directory) the `.gcda` files of a batched run are written to
+GCDA_DIR = 'gcda'
+
+_TEST_FILE = b'NOTE: Test file: '
+_REPLAY_DIR = b'NOTE: Storing KLEE replay files in '
+_EXIT_STATUS = re.compile(rb'NOTE: EXIT STATUS: '
+                          rb'(CRASHED signal (\d+)|TIMED OUT|NORMAL|ABNORMAL -?\d+|NONE)')
+
+
+def find_errors(testcase, stderr, error_type=None):
+    '''Find bugs reported by klee-replay
+
+    Find bugs from the last line of klee-replay's stderr and the `.err` files KLEE generated
+    alongside the testcase.
+
+    Args:
+        testcase: A testcase (`.ktest` file) replayed.
+        stderr: Standard error of klee-replay in bytes.
+        error_type: A list of error types consider. If not specificed, 2 types of bugs will be
+            considered: `CRASHED signal 11` and `CRASHED signal 6`.
+
+    Returns:
+        A set of bugs. Each bug is formed as `'{file_name} {line_num}'`.
+    '''
+
+    if error_type is None:
+        error_type = ['CRASHED signal 11', 'CRASHED signal 6']
+
+    errors = set()
+    lines = stderr.splitlines()
+    if len(lines) == 0:
+        return errors
+    lastline = str(lines[-1])
+
+    for error in error_type:
+        if error in lastline:
+            errs = list(Path(testcase).parent.glob(Path(testcase).stem + '.*.err'))
+
+            for err in errs:
+                with err.open(encoding='UTF-8', errors='replace') as f:
+                    lines = f.readlines()
+                    file_name = lines[1].split()[1]
+                    line_num = lines[2].split()[1]
+                    err_type = f'{file_name} {line_num}'
+                    errors.add(err_type)
+    return errors
+
+
+@functools.lru_cache(maxsize=None)
+def supports_batch(klee_replay=KLEE_REPLAY_BIN):
+    '''Check whether klee-replay can replay testcases in batches
+
+    Check whether klee-replay can keep its replay directories (`--keep-replay-dir`), which
+    `replay_batch` collects the outputs of each testcase from.
+
+    Args:
+        klee_replay: Path to klee-replay.
+
+    Returns:
+        `True` if testcases can be replayed with `replay_batch`.
+    '''
+
+    try:
+        usage = sp.run([klee_replay, '--help'], stdout=sp.PIPE, stderr=sp.STDOUT,
+                       check=False).stdout
+    except OSError:
+        usage = b''
+    return b'--keep-replay-dir' in usage
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children', encoding='UTF-8') as f:
+            return [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return []
+
+
+def _signal_children(process, signum):
+    for child in _children(process.pid):
+        try:
+            os.kill(child, signum)
+        except OSError:
+            pass
+
+
+def replay_batch(program, testcases, cwd=None, env=None, klee_replay=KLEE_REPLAY_BIN,
+                 timeout=1.0):
+    '''Replay testcases in a batch
+
+    Replay testcases through a single klee-replay, which forks a monitored run of the program for
+    each testcase and streams back its exit status. Each run has its own timeout. klee-replay
+    times out in whole seconds only (`KLEE_REPLAY_TIMEOUT`), so a run exceeding `timeout` is
+    stopped by raising the alarm of its monitor, as klee-replay itself would. Each run is kept in
+    its own replay directory (`--keep-replay-dir`) until its result is consumed, so that its
+    outputs can be collected (e.g. `.gcda` files redirected with a relative `GCOV_PREFIX`). If
+    klee-replay gives up at a testcase (e.g. an invalid `.ktest` file), the remaining testcases are
+    replayed by a new klee-replay.
+
+    Args:
+        program: Path to the program to replay the testcases on.
+        testcases: A directory of testcases (`.ktest` files), or a list of testcases.
+        cwd: A directory to run klee-replay in.
+        env: An environment to run klee-replay with.
+        klee_replay: Path to klee-replay. It should support `--keep-replay-dir` (see
+            `supports_batch`).
+        timeout: Timeout of each testcase in seconds. By default, this will be set as 1.
+
+    Yields:
+        A tuple of a testcase, its exit status, its crash signal, and its replay directory, in the
+        order of the testcases. The exit status is one of `'NORMAL'`, `'ABNORMAL <code>'`,
+        `'CRASHED signal <signal>'`, `'TIMED OUT'`, and `'NONE'` (i.e. the testcase did not run).
+        The crash signal is `None` unless the testcase crashed, and the replay directory is `None`
+        if the testcase did not run. The replay directory is removed once the next result is
+        requested.
+    '''
+
+    if not isinstance(testcases, (list, tuple)):
+        testcases = sorted(Path(testcases).glob('*.ktest'))
+    testcases = [str(testcase) for testcase in testcases]
+    env = dict(os.environ if env is None else env)
+    env['KLEE_REPLAY_TIMEOUT'] = str(max(1, math.ceil(timeout)))
+    cmd = [klee_replay, '--keep-replay-dir', str(program)]
+
+    start = 0
+    while start < len(testcases):
+        start += yield from _replay_launch(cmd, testcases[start:], cwd, env, timeout)
+        if start < len(testcases):
+            get_logger().warning(f'klee-replay gave up at a testcase: {testcases[start]}')
+            yield testcases[start], 'NONE', None, None
+            start += 1
+
+
+def _replay_launch(cmd, testcases, cwd, env, timeout):
+    # Replay testcases until klee-replay exits, and return the number of testcases reported
+    process = spawn_command(cmd + testcases, cwd=cwd, env=env, stdin=sp.DEVNULL,
+                            stdout=sp.DEVNULL, stderr=sp.PIPE)
+    fd = process.stderr.fileno()
+    n_reported = 0
+    replay_dirs = []
+    current = None  # A list of the replay directory, the start time, and whether it timed out
+    pending = b''
+    try:
+        while True:
+            wait = None
+            if current is not None and current[1] is not None and not current[2]:
+                wait = max(0, current[1] + timeout - time.monotonic())
+            if not select.select([fd], [], [], wait)[0]:
+                # Raise the alarm of the monitor so that it reports and kills the run
+                _signal_children(process, signal.SIGALRM)
+                current[2] = True
+                continue
+            data = os.read(fd, 65536)
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop() if data else b''
+            for line in lines:
+                match = _EXIT_STATUS.search(line)
+                if _TEST_FILE in line:
+                    if current is not None:
+                        yield testcases[n_reported], 'NONE', None, None
+                        n_reported += 1
+                    current = [None, None, False]
+                elif _REPLAY_DIR in line and current is not None:
+                    current[0] = line.split(_REPLAY_DIR, 1)[1].decode(errors='replace')
+                    current[1] = time.monotonic()
+                    replay_dirs.append(current[0])
+                elif match is not None and current is not None:
+                    # Only the first status of a run counts (a timed out run is also killed)
+                    status = match.group(1).decode()
+                    crash = None if match.group(2) is None else int(match.group(2))
+                    yield testcases[n_reported], status, crash, current[0]
+                    if current[0] is not None:
+                        shutil.rmtree(current[0], ignore_errors=True)
+                    n_reported += 1
+                    current = None
+            if not data:
+                break
+        if current is not None:
+            yield testcases[n_reported], 'NONE', None, None
+            n_reported += 1
+    finally:
+        if process.poll() is None:
+            # Let the monitor kill the run before klee-replay itself
+            _signal_children(process, signal.SIGTERM)
+            process.kill()
+        process.wait()
+        process.stderr.close()
+        for replay_dir in replay_dirs:
+            shutil.rmtree(replay_dir, ignore_errors=True)
+    return n_reported
+
+
+class ReplayEngine:
+    '''Parallel replay-and-coverage engine
+
+    Replay-and-coverage engine class. Testcases are replayed in batches by a pool of workers and
+    their results are returned in the order of the given testcases.
+    '''
+
+    def __init__(self, pconfig, n_workers=1, workspace_dir=None, klee_replay=KLEE_REPLAY_BIN,
+                 replay_timeout=0.1, gcov='gcov'):
+        '''Create a replay engine
+
+        Create a replay engine. If klee-replay can not replay testcases in batches (see
+        `supports_batch`) and more than one worker is requested, the gcov build tree is cloned
+        once per worker under `workspace_dir` (see `WorkspaceManager`).
+
+        Args:
+            pconfig: A program configuration loaded from `configs/*.json`.
+            n_workers: Number of workers replaying testcases concurrently. By default, this will
+                be set as 1.
+            workspace_dir: A directory to keep the clones of the gcov build tree. If not
+                specified, a temporary directory is created and removed at exit.
+            klee_replay: Path to klee-replay.
+            replay_timeout: Timeout of each testcase in seconds. By default, this will be set as
+                0.1.
+            gcov: Path to GCov.
+        '''
+
+        self.pconfig = pconfig
+        self.n_workers = max(1, n_workers)
+        self.klee_replay = klee_replay
+        self.replay_timeout = replay_timeout
+        self.gcov = GCovBackend(gcov)
+        self.root = Path(os.path.realpath(str(gcov_root(pconfig))))
+        self.exec_dir = pconfig.get('exec_dir', '').strip('/')
+
+        # `.gcda` files are redirected into the replay directory of each testcase in batches
+        self.strip = None
+        if supports_batch(klee_replay):
+            self.strip = prefix_strip(self.root / self.exec_dir / pconfig['pgm_name'], self.root)
+        self.workspaces = None
+        if self.strip is None:
+            get_logger().warning('Testcases can not be replayed in batches. '
+                                 'Replaying each testcase with its own klee-replay.')
+            self.workspaces = WorkspaceManager(pconfig, self.n_workers, workspace_dir)
+        self._pool = ThreadPoolExecutor(max_workers=self.n_workers)
+        self._prefetched = {}
+        self._lock = threading.Lock()
+
+    def evaluate_one(self, workspace, testcase):
+        '''Evaluate a testcase in a workspace
+
+        Replay a testcase in the given workspace and collect covered branches with gcov.
+
+        Args:
+            workspace: A reset `Workspace` owned by the caller.
+            testcase: A testcase (`.ktest` file) to replay.
+
+        Returns:
+            A tuple of covered branches and found bugs. The first element of the tuple is a list
+            of covered branches and the second element is a set of found bugs.
+        '''
+
+        exec_dir = workspace.exec_dir
+        cmd = [self.klee_replay, "./" + self.pconfig["pgm_name"], str(testcase)]
+        process = spawn_command(cmd, stdout=sp.PIPE, stderr=sp.PIPE, cwd=str(exec_dir),
+                                env=workspace.env)
+        errors = set()
+        try:
+            _, stderr = process.communicate(timeout=self.replay_timeout)
+            errors = find_errors(testcase, stderr)
+        except sp.TimeoutExpired:
+            get_logger().warning(f'KLEE replay timeout: {testcase}')
+            # Let the monitor kill the run before klee-replay itself
+            _signal_children(process, signal.SIGTERM)
+        finally:
+            process.kill()
+
+        gcdas = expand_gcdas(self.pconfig['gcda_file'], exec_dir)
+        return self.gcov.covered(gcdas, exec_dir), errors
+
+    def evaluate_batch(self, testcases):
+        '''Evaluate testcases in a batch
+
+        Replay testcases through a single klee-replay (see `replay_batch`) and collect the covered
+        branches of each testcase with gcov from its replay directory.
+
+        Args:
+            testcases: A list of testcases (`.ktest` files) to replay.
+
+        Returns:
+            A list of the results of the testcases (see `ReplayEngine.evaluate_one`) in the order
+            of `testcases`.
+        '''
+
+        env = dict(os.environ, GCOV_PREFIX=GCDA_DIR, GCOV_PREFIX_STRIP=str(self.strip))
+        results = []
+        for testcase, status, _, replay_dir in replay_batch(
+                './' + self.pconfig['pgm_name'], testcases, cwd=self.pconfig['gcov_path'],
+                env=env, klee_replay=self.klee_replay, timeout=self.replay_timeout):
+            if status == 'TIMED OUT':
+                get_logger().warning(f'KLEE replay timeout: {testcase}')
+            covered = []
+            if replay_dir is not None:
+                covered = self._covered_in(Path(replay_dir) / GCDA_DIR)
+            results.append((covered, find_errors(testcase, f'EXIT STATUS: {status}'.encode())))
+        return results
+
+    def _covered_in(self, gcda_root):
+        # `gcda_root` mirrors the gcov build tree with the `.gcda` files of a testcase only
+        exec_dir = gcda_root / self.exec_dir
+        exec_dir.mkdir(parents=True, exist_ok=True)
+        gcdas = expand_gcdas(self.pconfig['gcda_file'], exec_dir)
+        for gcda in gcdas:
+            try:
+                gcno = self.root / Path(gcda).relative_to(gcda_root).with_suffix('.gcno')
+            except ValueError:
+                continue
+            if gcno.exists():
+                os.symlink(str(gcno), str(Path(gcda).with_suffix('.gcno')))
+        return self.gcov.covered(gcdas, exec_dir)
+
+    def _evaluate(self, testcase):
+        if self.workspaces is None:
+            return self.evaluate_batch([testcase])[0]
+        with self.workspaces.lease() as workspace:
+            return self.evaluate_one(workspace, testcase)
+
+    def prefetch(self, testcase):
+        '''Start evaluating a testcase
+
+        Start evaluating a testcase in the background, ahead of `ReplayEngine.evaluate`. The
+        testcase should be given as `ReplayEngine.evaluate` will be given it.
+
+        Args:
+            testcase: A testcase (`.ktest` file) to replay.
+        '''
+
+        testcase = str(testcase)
+        with self._lock:
+            if testcase not in self._prefetched:
+                self._prefetched[testcase] = self._pool.submit(self._evaluate, testcase)
+
+    def discard(self, output_dir):
+        '''Drop prefetched testcases
+
+        Cancel the prefetched evaluations of the testcases in a directory, whose results will never
+        be collected (e.g. a KLEE output directory of a killed run).
+
+        Args:
+            output_dir: A directory of testcases, given as its testcases were given to
+                `ReplayEngine.prefetch`.
+        '''
+
+        with self._lock:
+            self._discard_dirs({os.path.normpath(str(output_dir))})
+
+    def _discard_dirs(self, dirs):
+        for testcase in [tc for tc in self._prefetched if os.path.dirname(tc) in dirs]:
+            self._prefetched.pop(testcase).cancel()
+
+    def evaluate(self, testcases, rm_cmd=None):
+        '''Evaluate testcases
+
+        Evaluate testcases across the workers, each replaying a batch of the testcases (see
+        `ReplayEngine.evaluate_batch`). Results of prefetched testcases (see
+        `ReplayEngine.prefetch`) are reused.
+
+        Args:
+            testcases: A list of testcases (`.ktest` files) to replay.
+            rm_cmd: Unused. Each testcase writes its `.gcda` files into a fresh replay directory,
+                or stale `.gcov` and `.gcda` files are removed when a workspace is leased (see
+                `Workspace.reset`).
+
+        Returns:
+            A list of the results of the testcases (see `ReplayEngine.evaluate_one`) in the order
+            of `testcases`.
+        '''
+
+        with self._lock:
+            prefetched = [self._prefetched.pop(str(tc), None) for tc in testcases]
+            # Other testcases prefetched from these directories will never be collected
+            self._discard_dirs({os.path.dirname(str(tc)) for tc in testcases})
+        if self.workspaces is None:
+            pending = [str(tc) for tc, future in zip(testcases, prefetched) if future is None]
+            batches = [pending[i::self.n_workers] for i in range(min(self.n_workers, len(pending)))]
+            if self.n_workers == 1:
+                batch_results = [self.evaluate_batch(batch) for batch in batches]
+            else:
+                futures = [self._pool.submit(self.evaluate_batch, batch) for batch in batches]
+                batch_results = [future.result() for future in futures]
+            results = {}
+            for batch, result in zip(batches, batch_results):
+                results.update(zip(batch, result))
+            return [results[str(tc)] if future is None else future.result()
+                    for tc, future in zip(testcases, prefetched)]
+        if self.n_workers == 1:
+            return [self._evaluate(tc) if future is None else future.result()
+                    for tc, future in zip(testcases, prefetched)]
+        futures = [self._pool.submit(self._evaluate, tc) if future is None else future
+                   for tc, future in zip(testcases, prefetched)]
+        return [future.result() for future in futures]
+
+    def close(self):
+        '''Release the workers
+
+        Shut down the worker pool and remove the temporary workspaces if any.
+        '''
+
+        self._pool.shutdown(wait=True)
+        self._prefetched = {}
+        if self.workspaces is not None:
+            self.workspaces.close()
@@ -0,0 +1,135 @@
+'''Greedy set cover for SymTuner
+
+This module contains the greedy max-coverage engine used to find core parameters and top seeds.
+The engine is a lazy greedy algorithm over coverage bitsets: marginal gains only shrink as the
+accumulated coverage grows, so a stale gain in the priority queue is an upper bound and only the
+candidates that may still be the best are re-evaluated at each pick. FeatMaker's clustering uses
+a sparse engine instead, which keeps the coverages as a sparse incidence matrix and updates the
+marginal gains incrementally as branches get covered.
+'''
+
+import heapq
+
+import numpy as np
+
+from branch_coverage import popcount
+
+
+def _bits(coverage):
+    return coverage if isinstance(coverage, int) else coverage.bits
+
+
+def greedy_cover(coverages, limit=None):
+    '''Pick coverages greedily
+
+    Pick coverages one by one, each time the one covering the most branches that are not covered
+    by the previous picks, until nothing new is covered or `limit` coverages are picked.
+
+    Ties are broken exactly as repeatedly stable-sorting the remaining coverages by their marginal
+    gain would: by the marginal gains of the previous rounds (latest first), and then by the
+    original order.
+
+    Args:
+        coverages: A list of `Coverage` objects (or their bits).
+        limit: Maximum number of coverages to pick. If not specified, pick until nothing new is
+            covered.
+
+    Returns:
+        A list of indices of the picked coverages in the order they are picked.
+    '''
+
+    bits = [_bits(cov) for cov in coverages]
+    heap = [(-popcount(b), idx) for idx, b in enumerate(bits) if b]
+    heapq.heapify(heap)
+
+    # snapshots[j] is the accumulated coverage after j picks
+    snapshots = [0]
+    picked = []
+    while heap and (limit is None or len(picked) < limit):
+        accumulated = snapshots[-1]
+
+        # Re-evaluate every candidate whose stale gain may reach the best gain
+        evaluated = []
+        best_gain = 0
+        while heap and -heap[0][0] >= max(best_gain, 1):
+            _, idx = heapq.heappop(heap)
+            gain = popcount(bits[idx] & ~accumulated)
+            evaluated.append((idx, gain))
+            best_gain = max(best_gain, gain)
+        if best_gain == 0:
+            break
+
+        ties = [idx for idx, gain in evaluated if gain == best_gain]
+        for rnd in range(len(snapshots) - 2, -1, -1):
+            if len(ties) == 1:
+                break
+            gains = [popcount(bits[idx] & ~snapshots[rnd]) for idx in ties]
+            top = max(gains)
+            ties = [idx for idx, gain in zip(ties, gains) if gain == top]
+        chosen = min(ties)
+
+        picked.append(chosen)
+        snapshots.append(accumulated | bits[chosen])
+        for idx, gain in evaluated:
+            if idx != chosen and gain > 0:
+                heapq.heappush(heap, (-gain, idx))
+    return picked
+
+
+def _gather(indptr, indices, rows):
+    # Concatenate indices[indptr[r]:indptr[r + 1]] over the given rows
+    starts, ends = indptr[rows], indptr[rows + 1]
+    lengths = ends - starts
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=indices.dtype)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + np.arange(lengths.sum())]
+
+
+def sparse_cover(coverages):
+    '''Pick coverages greedily over a sparse incidence matrix
+
+    Pick coverages one by one, each time the one covering the most branches that are not covered
+    by the previous picks, until nothing new is covered. Ties are broken by the total number of
+    branches of the coverages, and then by the original order.
+
+    The coverages are kept as a sparse (CSR) incidence matrix together with its transpose, so the
+    memory scales with the number of covered branches summed over the coverages. When a coverage is
+    picked, only the marginal gains of the coverages sharing its newly covered branches are
+    decremented.
+
+    Args:
+        coverages: A list of `Coverage` objects.
+
+    Returns:
+        A list of indices of the picked coverages in the order they are picked.
+    '''
+
+    ids = [cov.ids() for cov in coverages]
+    sizes = np.array([len(row) for row in ids], dtype=np.int64)
+    if sizes.sum() == 0:
+        return []
+
+    # CSR over coverages, and its transpose (CSC) over branches renumbered from 0
+    indptr = np.concatenate([[0], np.cumsum(sizes)])
+    branches, indices = np.unique(np.concatenate(ids), return_inverse=True)
+    order = np.argsort(indices, kind='stable')
+    rows = np.repeat(np.arange(len(ids)), sizes)[order]
+    colptr = np.concatenate([[0], np.cumsum(np.bincount(indices, minlength=len(branches)))])
+
+    gains = sizes.copy()
+    covered = np.zeros(len(branches), dtype=bool)
+    picked = []
+    while True:
+        best = gains.max()
+        if best == 0:
+            break
+        ties = np.flatnonzero(gains == best)
+        chosen = int(ties[sizes[ties].argmax()])
+        picked.append(chosen)
+
+        new = _gather(indptr, indices, np.array([chosen]))
+        new = new[~covered[new]]
+        covered[new] = True
+        np.subtract.at(gains, _gather(colptr, rows, new), 1)
+    return picked
@@ -1,24 +1,17 @@
-import os
-import re
+from kquery import get_kquery_cache
 
 def returnQueryContents(query):  
-    pattern = r'\(query \[.*?\] false\)'
-    with open(query, "r") as file:
-        content = file.read()
-    match = re.search(pattern, content, re.DOTALL)
-    extracted_text = match.group(0)
-    
-    return extracted_text
+    return get_kquery_cache().get(query).query
 
 def checkAndUpdateQueries(tc, querystructure):
     query = tc.replace("ktest", "kquery")
 
-    if not os.path.exists(query):
+    entry = get_kquery_cache().get(query)
+    if entry is None:
         return False 
     
-    extracted_text = returnQueryContents(query)
-    if extracted_text not in querystructure:
-        querystructure.add(extracted_text)
+    if entry.digest not in querystructure:
+        querystructure.add(entry.digest)
         return True
     else:
-        return False
\ No newline at end of file
+        return False
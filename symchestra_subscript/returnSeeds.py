@@ -1,9 +1,11 @@
-from combi_subscript import filterSeeds
+from symchestra_subscript import filterSeeds
 from sklearn.cluster import KMeans
 from sklearn.cluster import MeanShift, estimate_bandwidth
+from collections import defaultdict
+from heapq import heappush, heappop, heapify
 import numpy as np
 import random
-import copy
+import itertools
 import os
 
 eta_num = 10
@@ -17,83 +19,180 @@ def set_alpha(num):
     global alpha
     alpha = num
 
-def returnBestFilteredSeedBadDifferentQueries(mode, datastructure, branchFrequency, usedBuffer,
+class SeedIndex:
+    # Rarity scores of the seeds of a mode, kept up to date with the branch frequencies they were
+    # computed with. datastructure[mode] only grows, so new seeds are picked up from its tail.
+    def __init__(self, seeds):
+        self.seeds = seeds
+        self.n_synced = 0
+        self.coverages = {}
+        self.order = {}
+        self.scores = {}
+        self.versions = {}
+        self.branch_tcs = defaultdict(set)
+        self.frequencies = np.zeros(0)
+        self.top = []
+        self.bottom = []
+
+    def __len__(self):
+        return len(self.scores)
+
+    def discard(self, tc):
+        if tc in self.scores:
+            del self.scores[tc]
+            for branch in self.coverages.pop(tc).tolist():
+                self.branch_tcs[branch].discard(tc)
+
+    def sync(self, rarity, usedBuffer):
+        dirty = set()
+        for tc, coverage in itertools.islice(self.seeds.items(), self.n_synced, None):
+            self.n_synced += 1
+            if tc in usedBuffer:
+                continue
+            self.coverages[tc] = rarity.ids(coverage)
+            self.order[tc] = self.n_synced
+            for branch in self.coverages[tc].tolist():
+                self.branch_tcs[branch].add(tc)
+            dirty.add(tc)
+        for tc in [tc for tc in self.scores if tc in usedBuffer]:
+            self.discard(tc)
+
+        for branch in rarity.changed(self.frequencies).tolist():
+            dirty |= self.branch_tcs.get(branch, set())
+        self.frequencies = rarity.frequency.copy()
+
+        dirty = sorted(dirty, key=self.order.get)
+        for tc, score in zip(dirty, rarity.scores([self.coverages[tc] for tc in dirty]).tolist()):
+            if self.scores.get(tc) != score:
+                self.scores[tc] = score
+                self.versions[tc] = self.versions.get(tc, 0) + 1
+                heappush(self.top, (-score, self.order[tc], tc, self.versions[tc]))
+                heappush(self.bottom, (score, self.order[tc], tc, self.versions[tc]))
+
+        # Drop stale entries once they outnumber the live ones
+        if len(self.top) > 2 * len(self.scores) + 64:
+            self.top = [entry for entry in self.top if self.valid(entry)]
+            self.bottom = [entry for entry in self.bottom if self.valid(entry)]
+            heapify(self.top)
+            heapify(self.bottom)
+
+    def valid(self, entry):
+        return entry[2] in self.scores and self.versions[entry[2]] == entry[3]
+
+    def pop(self, heap):
+        while heap:
+            entry = heappop(heap)
+            if self.valid(entry):
+                return entry
+        return None
+
+    def best(self, k):
+        best_tcs = []
+        while len(best_tcs) < k:
+            entry = self.pop(self.top)
+            if entry is None:
+                break
+            best_tcs.append(entry[2])
+        return best_tcs
+
+    def restore(self, entries):
+        for entry in entries:
+            heappush(self.bottom, entry)
+
+class QueryTrie:
+    # Trie over the constraint lines of the seeds. Each node is [index of the first seed through
+    # it, children keyed by the next line].
+    def __init__(self):
+        self.root = [0, dict()]
+        self.n_seeds = 0
+
+    def insert(self, lines):
+        node = self.root
+        for line in lines:
+            node = node[1].setdefault(line, [self.n_seeds, dict()])
+        self.n_seeds += 1
+
+    def growing_prefixes(self, lines):
+        # Longest prefix of lines shared with any of the first k seeds, for each k in seed order.
+        # The prefix never shrinks, and a single walk down the trie finds all of them.
+        firsts = []
+        node = self.root
+        for line in lines:
+            node = node[1].get(line)
+            if node is None:
+                break
+            firsts.append(node[0])
+        depth = 0
+        for seed in range(self.n_seeds):
+            while depth < len(firsts) and firsts[depth] <= seed:
+                depth += 1
+            yield depth
+
+seedIndexes = dict()
+
+def getSeedIndex(mode, datastructure):
+    index = seedIndexes.get(mode)
+    if index is None or index.seeds is not datastructure[mode]:
+        index = seedIndexes[mode] = SeedIndex(datastructure[mode])
+    return index
+
+def returnBestFilteredSeedBadDifferentQueries(mode, datastructure, rarity, usedBuffer,
                                               symtuner=None, log=None):
-    scoreStructure = dict()
-
-    copiedDS = copy.deepcopy(datastructure[mode])
-    for eachUsed in usedBuffer:
-        if eachUsed in copiedDS:
-            copiedDS.pop(eachUsed)
-
-    for tc, coverage in copiedDS.items():
-        
-        score = 0.0
-        for eachB in coverage:
-            score += 1 / branchFrequency[eachB]
-        
-        scoreStructure[tc] = score
+    seedIndex = getSeedIndex(mode, datastructure)
+    seedIndex.sync(rarity, usedBuffer)
 
-    if len(scoreStructure) == 0:
+    if len(seedIndex) == 0:
         return None, None
 
-    best_tcs = [name for name, _ in sorted(scoreStructure.items(), key=lambda x: -x[1])[:eta_num]]
+    num_to_return = min(eta_num, max(1, len(seedIndex) // 2))
+    best_tcs = seedIndex.best(eta_num)
 
-    sorted_testcases = sorted(scoreStructure.items(), key=lambda x: x[1])
-    num_to_return = min(eta_num, max(1, len(sorted_testcases) // 2))
-    index = 0
     badQueriesDict = dict()
 
-    seedQueryContents = list()
+    seedQueryTrie = QueryTrie()
     for eachtc in best_tcs:
         seedQueryContent = filterSeeds.returnQueryContents(eachtc.replace("ktest", "kquery")).split("\n")
         del seedQueryContent[0]
         del seedQueryContent[-1]
-        seedQueryContents.append(seedQueryContent)
+        seedQueryTrie.insert(seedQueryContent)
     
-    while True:
-        if len(badQueriesDict) == num_to_return or len(badQueriesDict) == len(sorted_testcases):
+    # Seeds from the lowest score, put back once the bad queries are found
+    popped = []
+    while len(badQueriesDict) < num_to_return:
+        entry = seedIndex.pop(seedIndex.bottom)
+        if entry is None:
             break
+        popped.append(entry)
         
-        curBadTc = sorted_testcases[index][0]
+        curBadTc = entry[2]
         curBadQuery = "/".join(["/".join(curBadTc.split("/")[:-1]), curBadTc.split("/")[-1].replace("ktest", "kquery")])
 
         if not os.path.exists(curBadQuery):
-            index += 1
             continue
         
         curBadQueryContent = filterSeeds.returnQueryContents(curBadQuery).split("\n")
         del curBadQueryContent[0]
         del curBadQueryContent[-1]
 
-        index_Seed = 0
-        index_Bad = 0
-
-        for seedQueryContent in seedQueryContents:
-            while index_Seed < len(seedQueryContent) and index_Bad < len(curBadQueryContent):
-                if seedQueryContent[index_Seed] == curBadQueryContent[index_Bad]:
-                    index_Seed += 1
-                    index_Bad += 1
-                else:
-                    break
-            
-            removedBadQueryContent = "\n".join(curBadQueryContent[index_Bad:])
+        # Strip the prefix shared with the best seeds, or a longer one if the rest is taken
+        for index_Bad in seedQueryTrie.growing_prefixes(curBadQueryContent):
+            removedBadQueryContent = tuple(curBadQueryContent[index_Bad:])
 
             if removedBadQueryContent not in badQueriesDict:
                 badQueriesDict[removedBadQueryContent] = curBadQuery
                 break
-
-        index += 1            
     
+    seedIndex.restore(popped)
     badQueries = list(badQueriesDict.values())
 
     for each_tc in best_tcs:
-        usedBuffer.append(each_tc)
+        usedBuffer.add(each_tc)
+        seedIndex.discard(each_tc)
 
-        for branch in copiedDS[each_tc]:
-            symtuner.branchPerScore[mode][branch] = symtuner.branchPerScore[mode].get(branch) * alpha
+        rarity.scale(mode, datastructure[mode][each_tc], alpha)
         
     for eachQuery in badQueries:
-        usedBuffer.append(eachQuery.replace("kquery", "ktest"))
+        usedBuffer.add(eachQuery.replace("kquery", "ktest"))
+        seedIndex.discard(eachQuery.replace("kquery", "ktest"))
 
-    return best_tcs, badQueries
\ No newline at end of file
+    return best_tcs, badQueries
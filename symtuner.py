@@ -7,8 +7,11 @@ and SymTuner interface (with implementation of common algorithm).
 from abc import ABC
 from abc import abstractclassmethod
 from abc import abstractmethod
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from collections import defaultdict
+from collections import deque
 from datetime import datetime
 from pathlib import Path
 import json
@@ -16,9 +19,15 @@ import os
 import numpy as np
 import random
 import subprocess as sp
+import threading
 
 # from symtuner.logger import get_logger
+from branch_coverage import Coverage
+from branch_coverage import CoverageAccumulator
 from logger import get_logger
+from rarity import RarityScorer
+from replay import ReplayEngine
+from setcover import greedy_cover
 
 
 class TimeBudgetHandler:
@@ -115,6 +124,200 @@ class TimeBudgetHandler:
         return int((datetime.now() - self.start_time).total_seconds())
 
 
+class ParameterSampler:
+    '''Parameter sampler class
+
+    Parameter sampler class. This keeps the counts of used parameters as arrays aligned with the
+    tuning space, caches the sampling distributions of both policies until the counts (or the core
+    parameters) change, and draws all parameters at once.
+    '''
+
+    def __init__(self, space, cnts, len_cnts):
+        '''Create a parameter sampler
+
+        Create a parameter sampler. The given dictionaries are shared with SymTuner and remain the
+        source of truth: the arrays of a parameter are rebuilt from them whenever its space is
+        replaced (e.g. when new seed files are added).
+
+        Args:
+            space: A tuning space.
+            cnts: A dictionary of how many times each value of each parameter is used.
+            len_cnts: A dictionary of how many times each number of values of each parameter is
+                used.
+        '''
+
+        self.space = space
+        self.cnts = cnts
+        self.len_cnts = len_cnts
+
+        self.values = {}
+        self.indices = {}
+        self.val_cnts = {}
+        self.n_cnts = {}
+
+        self._explore = None
+        self._exploit = None
+        self._core_parameters = None
+        self._core_cnts = None
+        self._cumulative = (None, None)
+
+    def _sync(self):
+        for param, (space, n_sample) in self.space.items():
+            # Spaces are compared by value, as they may also be edited in place
+            space = list(space)
+            if self.values.get(param) == space and len(self.n_cnts[param]) == n_sample:
+                continue
+            self.values[param] = space
+            self.indices[param] = defaultdict(list)
+            for i, val in enumerate(space):
+                self.indices[param][val].append(i)
+            self.val_cnts[param] = np.array([self.cnts[param].get(val, 0) for val in space],
+                                            dtype=float)
+            self.n_cnts[param] = np.array([self.len_cnts[param].get(n, 0)
+                                           for n in range(1, n_sample + 1)], dtype=float)
+            self._explore = None
+            self._exploit = None
+            self._core_parameters = None
+
+    def _count_into(self, param, values, val_cnts, n_cnts):
+        if 0 < len(values) <= len(n_cnts):
+            n_cnts[len(values) - 1] += 1
+        for value in values:
+            for i in self.indices[param].get(value, ()):
+                val_cnts[i] += 1
+
+    def count(self, param, values):
+        '''Count a used parameter
+
+        Count the values used for a parameter. Must be called after `cnts` and `len_cnts` are
+        updated.
+
+        Args:
+            param: A name of parameter.
+            values: A list of used values.
+        '''
+
+        if param not in self.val_cnts:
+            return
+        self._count_into(param, values, self.val_cnts[param], self.n_cnts[param])
+        self._explore = None
+        self._exploit = None
+
+    @staticmethod
+    def round2(prob):
+        # Python's round, which rounds the decimal value (e.g. 0.005 to 0.01) unlike np.round
+        return np.array([round(p, 2) for p in prob.tolist()], dtype=float)
+
+    @staticmethod
+    def normalize(prob):
+        if np.sum(prob) == 0:
+            prob = np.ones(len(prob))
+        return prob / np.sum(prob)
+
+    def explore(self):
+        '''Return the probability of explore policy
+
+        Returns:
+            A dictionary of the probability of each parameter space. See `SymTuner.explore`.
+        '''
+
+        self._sync()
+        if self._explore is None:
+            self._explore = {}
+            for param in self.space.keys():
+                cnt = self.val_cnts[param]
+                n_cnt = self.n_cnts[param]
+                prob = np.where(cnt > 0, self.round2(1. / np.maximum(cnt, 1)), 10)
+                n_prob = np.where(n_cnt > 0, self.round2(1. / np.maximum(n_cnt, 1)), 10)
+                self._explore[param] = (self.normalize(prob), self.normalize(n_prob))
+        return self._explore
+
+    def exploit(self, core_parameters):
+        '''Return the probability of exploit policy
+
+        Args:
+            core_parameters: A list of core parameters. Core counts are recounted only if a
+                different list is given.
+
+        Returns:
+            A dictionary of the probability of each parameter space. See `SymTuner.exploit`.
+        '''
+
+        self._sync()
+        if self._core_parameters is not core_parameters:
+            self._core_cnts = {}
+            for param in self.space.keys():
+                self._core_cnts[param] = (np.zeros(len(self.val_cnts[param])),
+                                          np.zeros(len(self.n_cnts[param])))
+            for parameter in core_parameters:
+                for param, values in parameter.items():
+                    if param not in self.space.keys():
+                        continue
+                    self._count_into(param, values, *self._core_cnts[param])
+            self._core_parameters = core_parameters
+            self._exploit = None
+
+        if self._exploit is None:
+            self._exploit = {}
+            for param in self.space.keys():
+                cnt = self.val_cnts[param]
+                n_cnt = self.n_cnts[param]
+                core_cnt, core_n_cnt = self._core_cnts[param]
+                prob = np.where(cnt > 0, self.round2(core_cnt / np.maximum(cnt, 1)), 10)
+                n_prob = np.where(n_cnt > 0, self.round2(core_n_cnt / np.maximum(n_cnt, 1)), 0)
+                self._exploit[param] = (self.normalize(prob), self.normalize(n_prob))
+        return self._exploit
+
+    def draw(self, prob_dict):
+        '''Draw parameters
+
+        Draw the number of values of every parameter, and then all values, each in a single
+        vectorized pass over the concatenated cumulative distributions.
+
+        Args:
+            prob_dict: A dictionary of the probability of each parameter space.
+
+        Returns:
+            A dictionary of sampled parameters.
+        '''
+
+        self._sync()
+        params = [param for param, (space, _) in self.space.items() if len(space) > 0]
+        if len(params) == 0:
+            return {}
+
+        cached_dict, cumulative = self._cumulative
+        if cached_dict is not prob_dict:
+            n_lens = np.array([len(prob_dict[param][1]) for param in params])
+            val_lens = np.array([len(prob_dict[param][0]) for param in params])
+            cumulative = (np.concatenate([np.cumsum(prob_dict[param][1]) + i
+                                          for i, param in enumerate(params)]),
+                          np.concatenate([[0], np.cumsum(n_lens)[:-1]]), n_lens,
+                          np.concatenate([np.cumsum(prob_dict[param][0]) + i
+                                          for i, param in enumerate(params)]),
+                          np.concatenate([[0], np.cumsum(val_lens)[:-1]]), val_lens)
+            self._cumulative = (prob_dict, cumulative)
+        n_cum, n_starts, n_lens, val_cum, val_starts, val_lens = cumulative
+
+        # Number of values to sample for each parameter
+        owners = np.arange(len(params))
+        picked = np.searchsorted(n_cum, np.random.random(len(params)) + owners, side='right')
+        n_samples = np.minimum(picked - n_starts, n_lens - 1) + 1
+
+        # Values of all parameters
+        owners = np.repeat(owners, n_samples)
+        picked = np.searchsorted(val_cum, np.random.random(len(owners)) + owners, side='right')
+        picked = np.minimum(picked - val_starts[owners], val_lens[owners] - 1)
+
+        sampled = {}
+        offset = 0
+        for param, n_sample in zip(params, n_samples):
+            space = self.values[param]
+            sampled[param] = [space[i] for i in picked[offset:offset + n_sample]]
+            offset += n_sample
+        return sampled
+
+
 class SymTuner(ABC):
     '''SymTuner interface with common algorithm implemented
 
@@ -123,7 +326,8 @@ class SymTuner(ABC):
     `SymTuner.get_default_space`.
     '''
 
-    def __init__(self, parameter_space=None, exploit_portion=0.7):
+    def __init__(self, parameter_space=None, exploit_portion=0.7, replay_workers=1,
+                 replay_timeout=0.1):
         '''Create SymTuner
 
         Create SymTuner.
@@ -135,6 +339,10 @@ class SymTuner(ABC):
                 following methods: `SymTuner.get_default_space` and
                 `SymTuner.get_default_default_parameters`.
             exploit_portion: A portion of exploit. By default, this will be set as 0.7.
+            replay_workers: Number of workers replaying testcases in `SymTuner.add`. By default,
+                this will be set as 1.
+            replay_timeout: Timeout of replaying each testcase in seconds. By default, this will be
+                set as 0.1.
         '''
 
         if parameter_space is None:
@@ -162,10 +370,17 @@ class SymTuner(ABC):
             self.len_cnts[param] = {}
             for i in range(1, n_sample + 1):
                 self.len_cnts[param][i] = 0
+        self.sampler = ParameterSampler(self.space, self.cnts, self.len_cnts)
 
         self.exploit_portion = exploit_portion
 
+        self.replay_workers = replay_workers
+        self.replay_timeout = replay_timeout
+        self.replay_engine = None
+        self._replay_engine_lock = threading.Lock()
+
         self.data = []
+        self._core_parameters_cache = (None, 0, [])
         self.alldata = []
         self.featmakerdata = []
         self.combifeatmakerdata = None
@@ -176,21 +391,20 @@ class SymTuner(ABC):
         self.tempramdata = []
         self.tempcombifeatmakerdata = dict()
 
-        self.tempsymCoverage = set()
-        self.tempfeatmakerCoverage = set()
-        self.tempcombinationCoverage = set()
+        self.tempsymCoverage = Coverage()
+        self.tempfeatmakerCoverage = Coverage()
+        self.tempcombinationCoverage = Coverage()
 
         self.parallelsymtuner = []
         self.parallelfeatmaker = []
         self.parallelhomi = []
-        self.parallelram = set()
+        self.parallelram = Coverage()
 
-        self.allCoverage = set()
+        self.allCoverage = Coverage()
+        self.accumulator = CoverageAccumulator()
 
-        self.branchFrequency = defaultdict(int)
         self.branchVisitData = defaultdict(int)
-        self.branchPerScore = {"symtuner" : defaultdict(float), "featmaker" : defaultdict(float), "homi" : defaultdict(float), "ram" : defaultdict(float)}
-        self.tempbranchFrequency = {"symtuner" : defaultdict(float), "featmaker" : defaultdict(float), "homi" : defaultdict(float), "ram" : defaultdict(float)}
+        self.rarity = RarityScorer(["symtuner", "featmaker", "homi", "ram"])
 
         self.paramBranches = {}
         self.paramValBranches = {}
@@ -201,11 +415,11 @@ class SymTuner(ABC):
         for param, (space, n_sample) in self.space.items():
             self.paramBranches[param] = {}
             for i in range(1, n_sample + 1):
-                self.paramBranches[param][i] = set()
+                self.paramBranches[param][i] = Coverage()
 
             self.paramValBranches[param] = {}
             for val in space:
-                self.paramValBranches[param][val] = set()
+                self.paramValBranches[param][val] = Coverage()
 
     def count_used_parameters(self, parameters):
         '''Update count of used parameters
@@ -223,6 +437,7 @@ class SymTuner(ABC):
             self.len_cnts[param][len(values)] += 1
             for value in values:
                 self.cnts[param][value] += 1
+            self.sampler.count(param, values)
 
     def sample(self, policy=None):
         '''Sample a set of parameters to use
@@ -243,14 +458,7 @@ class SymTuner(ABC):
         policy_fn = getattr(self, policy)
         parameters = self.defaults.copy()
         prob_dict = policy_fn(self.data)
-        sampled = {}
-        for param, (space, n_sample) in self.space.items():
-            if len(space) == 0:
-                continue
-            prob, n_prob = prob_dict[param]
-            n_sample = list(range(1, n_sample + 1))
-            n_sample = random.choices(n_sample, n_prob)[0]
-            sampled[param] = random.choices(space, prob, k=n_sample)
+        sampled = self.sampler.draw(prob_dict)
         parameters.update(sampled)
         return parameters
 
@@ -289,31 +497,7 @@ class SymTuner(ABC):
             probability about how many times to sample.
         '''
 
-        prob_dict = {}
-        for param in self.space.keys():
-
-            prob = []
-            for value in self.space[param][0]:
-                if value in self.cnts[param].keys() and self.cnts[param][value] > 0:
-                    p = 1.0 / self.cnts[param][value]
-                    p = round(p, 2)
-                else:
-                    p = 10
-                prob.append(p)
-
-            n_prob = []
-            for n in range(1, self.space[param][1] + 1):
-                if self.len_cnts[param][n] > 0:
-                    p = 1.0 / self.len_cnts[param][n]
-                    p = round(p, 2)
-                else:
-                    p = 10
-                n_prob.append(p)
-
-            prob = self.normalize(prob)
-            n_prob = self.normalize(n_prob)
-            prob_dict[param] = (prob, n_prob)
-        return prob_dict
+        return self.sampler.explore()
 
     def exploit(self, data):
         '''Return the probability of exploit policy
@@ -331,55 +515,7 @@ class SymTuner(ABC):
 
         # Extract core parameters used
         core_parameters = self.extract_core_parameters(data)
-
-        core_cnts = {}
-        core_len_cnts = {}
-        for param, (_, n_sample) in self.space.items():
-            core_cnts[param] = {}
-            # Not using space because some space can be updated
-            cnt_keys = self.cnts[param].keys()
-            for val in cnt_keys:
-                core_cnts[param][val] = 0
-            core_len_cnts[param] = {}
-            for i in range(1, n_sample + 1):
-                core_len_cnts[param][i] = 0
-
-        for parameter in core_parameters:
-            for param, values in parameter.items():
-                if param not in self.space.keys():
-                    continue
-                core_len_cnts[param][len(values)] += 1
-                for value in values:
-                    core_cnts[param][value] += 1
-
-        prob_dict = {}
-        for param in self.space.keys():
-
-            prob = []
-            for value in self.space[param][0]:
-                if value in core_cnts[param].keys() \
-                        and value in self.cnts[param].keys() and self.cnts[param][value] > 0:
-                    p = core_cnts[param][value] / self.cnts[param][value]
-                    p = round(p, 2)
-                elif value not in self.cnts[param].keys() or self.cnts[param][value] == 0:
-                    p = 10
-                else:
-                    p = 0
-                prob.append(p)
-
-            n_prob = []
-            for n in range(1, self.space[param][1] + 1):
-                if self.len_cnts[param][n] > 0:
-                    p = core_len_cnts[param][n] / self.len_cnts[param][n]
-                    p = round(p, 2)
-                else:
-                    p = 0
-                n_prob.append(p)
-
-            prob = self.normalize(prob)
-            n_prob = self.normalize(n_prob)
-            prob_dict[param] = (prob, n_prob)
-        return prob_dict
+        return self.sampler.exploit(core_parameters)
 
     def extract_core_parameters(self, data):
         '''Extract core results in data
@@ -391,123 +527,125 @@ class SymTuner(ABC):
             data: A list of quadruples of coverage, found bugs, a testcase, and used parameters.
 
         Returns:
-            A list of core parameters that covers all coverages and bugs.
+            A list of core parameters that covers all coverages and bugs. The list is cached until
+            new data arrives, so it must not be modified.
         '''
 
-        # Return variable
-        core_paramters = []
-        core_parameters_branches = dict()
+        # Core parameters only change when new data arrives
+        cached_data, cached_len, core_parameters = self._core_parameters_cache
+        if cached_data is not data or cached_len != len(data):
+            core_parameters = self._find_core_parameters(data)
+            self._core_parameters_cache = (data, len(data), core_parameters)
+        return core_parameters
 
-        # Get total coverage
-        total_coverage = set()
-        for cov, _, _, param in data:
-            total_coverage = total_coverage | cov
+    def extract_core_parameters_v2(self, data):
+        '''Extract core results in data
 
-        # Find good testcases
-        accumulated_coverage = set()
-        copied_data = deepcopy(data)
+        Find out the smallest set of parameters that covers all the covered coverage and all found
+        bugs.
+
+        Args:
+            data: A list of quadruples of coverage, found bugs, a testcase, and used parameters.
+
+        Returns:
+            A list of core parameters that covers all coverages and bugs.
+        '''
 
-        # Data Form : List with the element formed as 
+        return self._find_core_parameters(data)
+
+    def _find_core_parameters(self, data):
+        # Data Form : List with the element formed as
         #             (coveraeg, errors, testcase, parameters)
 
-        while True:
-            if len(copied_data) == 0:
-                break
-            copied_data = sorted(copied_data,
-                                 key=lambda elem: len(elem[0]),
-                                 reverse=True)
-            top_cov, _, _, param = copied_data.pop(0)
-            if len(top_cov) > 0:
-                accumulated_coverage = accumulated_coverage | top_cov
-                copied_data = [(cov - accumulated_coverage, bug, tc, param)
-                               for cov, bug, tc, param in copied_data]
-                core_paramters.append(param)
-            else:
-                break
+        # Find good testcases
+        picked = greedy_cover([cov for cov, _, _, _ in data])
+        core_paramters = [data[idx][3] for idx in picked]
 
         # Find bug finding testcases
-        found_bugs = []
-        for _, bugs, _, param in data[::-1]: 
+        found_bugs = set()
+        for _, bugs, _, param in data[::-1]:
             for bug in bugs:
                 if bug not in found_bugs:
-                    found_bugs.append(bug)
+                    found_bugs.add(bug)
                     core_paramters.append(param)
 
         return core_paramters
 
-    def extract_core_parameters_v2(self, data):
-        '''Extract core results in data
+    def update_branch_frequency(self, covered):
+        '''Update branch frequencies with covered branches
 
-        Find out the smallest set of parameters that covers all the covered coverage and all found
-        bugs.
+        Update the frequency of the branches covered by each testcase with the per-branch scores
+        of the current mode (see `RarityScorer.update`).
 
         Args:
-            data: A list of quadruples of coverage, found bugs, a testcase, and used parameters.
+            covered: A list of lists of branches covered by each testcase.
 
         Returns:
-            A list of core parameters that covers all coverages and bugs.
+            A list of `Coverage`s of the branches covered by each testcase.
         '''
 
-        # Return variable
-        core_paramters = []
+        coverages = [Coverage(each) for each in covered]
+        self.rarity.update(self.mode, coverages)
+        return coverages
 
-        # Get total coverage
-        total_coverage = set()
-        for cov, _, _, param in data:
-            total_coverage = total_coverage | cov
+    def _get_replay_engine(self, pconfig):
+        # Testcases are prefetched from the main thread while the pipeline thread replays, so
+        # the engine is created under a lock
+        with self._replay_engine_lock:
+            if self.replay_engine is None:
+                self.replay_engine = ReplayEngine(pconfig, n_workers=self.replay_workers,
+                                                  replay_timeout=self.replay_timeout)
+            return self.replay_engine
 
-        # Find good testcases
-        accumulated_coverage = set()
-        copied_data = deepcopy(data)
+    def prefetch(self, pconfig, testcase):
+        '''Start replaying a testcase
 
-        # Data Form : List with the element formed as 
-        #             (coveraeg, errors, testcase, parameters)
+        Start replaying a testcase in the background as soon as it is generated, so that its
+        result is ready when the run is evaluated (see `ReplayEngine.prefetch`).
 
-        while True:
-            if len(copied_data) == 0:
-                break
-            copied_data = sorted(copied_data,
-                                 key=lambda elem: len(elem[0]),
-                                 reverse=True)
-            top_cov, _, _, param = copied_data.pop(0)
-            if len(top_cov) > 0:
-                accumulated_coverage = accumulated_coverage | top_cov
-                copied_data = [(cov - accumulated_coverage, bug, tc, param)
-                               for cov, bug, tc, param in copied_data]
-                core_paramters.append(param)
-            else:
-                break
+        Args:
+            pconfig: A program configuration loaded from `configs/*.json`.
+            testcase: A testcase to replay.
+        '''
 
-        # Find bug finding testcases
-        found_bugs = []
-        for _, bugs, _, param in data[::-1]: 
-            for bug in bugs:
-                if bug not in found_bugs:
-                    found_bugs.append(bug)
-                    core_paramters.append(param)
+        self._get_replay_engine(pconfig).prefetch(str(Path(testcase).absolute()))
 
-        return core_paramters
+    def discard_prefetched(self, output_dir):
+        '''Drop prefetched testcases
+
+        Drop the testcases of a KLEE output directory prefetched with `SymTuner.prefetch`, when
+        the run will never be evaluated (see `ReplayEngine.discard`).
+
+        Args:
+            output_dir: A KLEE output directory.
+        '''
+
+        if self.replay_engine is not None:
+            self.replay_engine.discard(str(Path(output_dir).absolute()))
+
+    def replay(self, pconfig, testcases, rm_cmd=None):
+        '''Replay testcases
+
+        Replay testcases and collect the covered branches and the found bugs of each, without
+        updating any data. This may run in a background thread (see `ReplayPipeline`).
+
+        Args:
+            pconfig: A program configuration loaded from `configs/*.json`.
+            testcases: Testcases to replay.
+            rm_cmd: Unused (see `ReplayEngine.evaluate`).
 
-    def gcovBranch(self, path):
-        gcov_files = [x for x in os.listdir(path) if "gcov" in x]
-        covered = set()
+        Returns:
+            A tuple of the absolute paths of the testcases, in the order they were generated, and
+            the results of `ReplayEngine.evaluate_one` for each of them.
+        '''
 
-        for gcov in gcov_files:
-            with open(os.getcwd() + "/" + gcov, encoding='UTF-8', errors='replace') as f:
-                file_name = f.readline().strip().split(':')[-1]
-                for i, line in enumerate(f):
-                    if ('branch' in line) and ('never' not in line) and ('taken 0%' not in line) and (":" not in line):
-                        bid = f'{file_name} {i}'
-                        covered.add(bid)
-                        
-                        self.branchPerScore[self.mode][bid] = self.branchPerScore[self.mode].get(bid, 1)
-                        self.branchFrequency[bid] += self.branchPerScore[self.mode][bid]
-                        self.tempbranchFrequency[self.mode][bid] += self.branchPerScore[self.mode][bid]
+        Path_Testcases = [str(Path(each).absolute()) for each in testcases]
+        Path_Testcases.sort(key=lambda x:float(x.split("ktest")[0].split("test")[-1].split(".")[0]))
 
-        return covered
+        return Path_Testcases, self._get_replay_engine(pconfig).evaluate(Path_Testcases, rm_cmd)
 
     def add(self, pconfig, testcases, parameters=None, evaluation_kwargs=None, 
-            early_testcases=None, rm_cmd=None, flag=None):
+            early_testcases=None, rm_cmd=None, flag=None, replayed=None):
         '''Evaluate and update data
 
         Evaluate and update data.
@@ -517,6 +655,7 @@ class SymTuner(ABC):
             paramters: A set of parameters used to generated testcases.
             testcases: Testcases genereted with parameters.
             evaluation_kwargs: A dictionary of keyword arguments pass to evaluate method.
+            replayed: The result of `SymTuner.replay` for the testcases, if already replayed.
 
         Returns:
             Self object for chaining. All updates is recorded in the object.
@@ -529,63 +668,25 @@ class SymTuner(ABC):
         else:
             self.count_used_parameters(parameters)
 
-        cur_dir = os.getcwd()
-
-        error_type = ['CRASHED signal 11', 'CRASHED signal 6']
         errorNum = 0
-        
-        Path_Testcases = [str(Path(each).absolute()) for each in testcases]
-        Path_Testcases.sort(key=lambda x:float(x.split("ktest")[0].split("test")[-1].split(".")[0]))
+
+        if replayed is None:
+            replayed = self.replay(pconfig, testcases, rm_cmd)
+        Path_Testcases, results = replayed
 
         self.tempsymdata = []
         self.temphomidata = dict()
         self.tempfeatmakerdata = dict()
         self.tempramdata = []
 
-        self.allCoverage = set()
-        for testcase in Path_Testcases:
-            os.chdir(pconfig['gcov_path'])
-
-            os.system(rm_cmd)
-            cmd = ' '.join(["/root/symchestra/klee_featmaker/build/bin/klee-replay", "./" + pconfig["pgm_name"], str(testcase)])
-            process = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE, shell=True)
-            errors = set()
-            try:
-                _, stderr = process.communicate(timeout=0.1)
-                lastline = str(stderr.splitlines()[-1])
-
-                # Find error types
-
-                for error in error_type:
-                    if error in lastline:
-                        errs = list(Path(testcase).parent.glob(Path(testcase).stem + '.*.err'))
-
-                        for err in errs:
-                            with err.open(encoding='UTF-8', errors='replace') as f:
-                                lines = f.readlines()
-                                file_name = lines[1].split()[1]
-                                line_num = lines[2].split()[1]
-                                err_type = f'{file_name} {line_num}'
-                                errors.add(err_type)
-            except sp.TimeoutExpired:
-                get_logger().warning(f'KLEE replay timeout: {testcase}')
-            finally:
-                process.kill()
-            
-            if os.path.exists(os.getcwd() + "/cov_result"):
-                rm_covresult = ' '.join(['rm', '-rf', os.getcwd() + "/cov_result"])
-                os.system(rm_covresult)
-            gcov_file = "cov_result"
-            gcov_cmd = " ".join(["gcov", "-b", pconfig['gcda_file'], "1> " + gcov_file, "2>/dev/null"])
-
-            os.system(gcov_cmd)
-
+        self.allCoverage = Coverage()
+        self.accumulator.begin_run()
+        coverages = self.update_branch_frequency([covered for covered, _ in results])
+        for testcase, coverage, (_, errors) in zip(Path_Testcases, coverages, results):
             for each in errors:
                 self.errorSet.add(each)
                 errorNum += 1
 
-            coverage = self.gcovBranch(os.getcwd())
-
             if parameters is not None:
                 for param, values in parameters.items():
                     if param not in self.space.keys() or "seed" in param:
@@ -616,6 +717,7 @@ class SymTuner(ABC):
 
             self.allCoverage |= coverage
             self.alldata.append((coverage, errors, testcase, parameters))
+            self.accumulator.update(coverage, errors, testcase)
 
         if flag == "basesymtuner":
             self.parallelsymtuner.append([parameters, self.allCoverage, errorNum])
@@ -626,8 +728,6 @@ class SymTuner(ABC):
         elif flag == "baseram":
             self.parallelram |= self.allCoverage
 
-        os.chdir(cur_dir)
-
         return self
 
     def get_space_json(self):
@@ -648,20 +748,27 @@ class SymTuner(ABC):
     def get_coverage_and_bugs(self):
         '''Get total coverage and bugs
 
-        Get total coverage and bugs collected.
+        Get total coverage and bugs collected. The totals are accumulated in `SymTuner.add`, so
+        this does not scan the collected data. Note that the returned sets are shared with the
+        accumulator and should not be modified.
 
         Returns:
             A tuple of coverage and bugs found in total. The first element of the tuple is a set
             of coverage and the second element is a set of bugs.
         '''
 
-        coverage = set()
-        bugs = set()
-        for cov, bug, _, _ in self.alldata:
-        # for cov, bug, _, _ in self.data:
-            coverage = coverage | cov
-            bugs = bugs | bug
-        return coverage, bugs, 
+        return self.accumulator.coverage, self.accumulator.bugs
+
+    def get_new_coverage(self):
+        '''Get coverage newly found in the latest run
+
+        Get coverage newly found by the testcases evaluated in the latest `SymTuner.add` call.
+
+        Returns:
+            A set of branches that were not covered before the latest run.
+        '''
+
+        return self.accumulator.new_coverage
 
     def get_testcase_causing_bug(self, bug):
         '''Get testcase causing the given bug
@@ -675,11 +782,19 @@ class SymTuner(ABC):
             A latest testcase causes the given bug. Returns None if no testcase is found.
         '''
 
-        for _, bugs, tc, _ in self.alldata[::-1]:
-        # for _, bugs, tc, _ in self.data[::-1]:
-            if bug in bugs:
-                return tc
-        return None
+        return self.accumulator.bug_testcases.get(bug)
+
+    def pop_unreported_bugs(self):
+        '''Get bugs not reported yet
+
+        Get bugs found since the last call. Drivers use this to append only new bugs to
+        `found_bugs.txt`.
+
+        Returns:
+            A list of bugs not reported yet.
+        '''
+
+        return self.accumulator.pop_unreported_bugs()
 
     @abstractmethod
     def evaluate(self, target, testcase, **kwargs):
@@ -737,3 +852,95 @@ class SymTuner(ABC):
             'defaults': cls.get_default_default_parameters(),
         }
         return json_dict
+
+
+class ReplayPipeline:
+    '''Background replay stage for SymTuner
+
+    Pipeline class overlapping the replay of KLEE runs with the next runs. Testcases of a finished
+    run are replayed in a background stage (see `SymTuner.replay`) while the caller launches the
+    next run. Replayed runs are committed (see `SymTuner.add`) by the caller, in the order they
+    were submitted, so that SymTuner is only updated from the caller's thread.
+    '''
+
+    def __init__(self, symtuner, pconfig, evaluation_kwargs=None, rm_cmd=None, background=True):
+        '''Create a replay pipeline
+
+        Args:
+            symtuner: A `SymTuner` to commit the replayed runs to.
+            pconfig: A program configuration loaded from `configs/*.json`.
+            evaluation_kwargs: A dictionary of keyword arguments pass to `SymTuner.add`.
+            rm_cmd: A command passed to `SymTuner.add`.
+            background: Whether to replay in the background. If `False`, runs are replayed on
+                submission, as `SymTuner.add` does. By default, this will be set as `True`.
+        '''
+
+        self.symtuner = symtuner
+        self.pconfig = pconfig
+        self.evaluation_kwargs = evaluation_kwargs
+        self.rm_cmd = rm_cmd
+        self._stage = ThreadPoolExecutor(max_workers=1) if background else None
+        self._runs = deque()
+
+    def submit(self, key, testcases, parameters=None, flag=None):
+        '''Submit a finished run
+
+        Args:
+            key: A key handed back when the run is committed.
+            testcases: Testcases generated by the run.
+            parameters: A set of parameters used to generate the testcases.
+            flag: A flag passed to `SymTuner.add`.
+        '''
+
+        # Resolve the testcases now, as the working directory may change meanwhile
+        testcases = [str(Path(each).absolute()) for each in testcases]
+        if self._stage is None:
+            replayed = Future()
+            replayed.set_result(self.symtuner.replay(self.pconfig, testcases, self.rm_cmd))
+        else:
+            replayed = self._stage.submit(self.symtuner.replay, self.pconfig, testcases,
+                                          self.rm_cmd)
+        # Branch frequencies are updated with the scores of the mode the run was launched in
+        mode = getattr(self.symtuner, 'mode', None)
+        self._runs.append((key, replayed, parameters, flag, mode))
+
+    def commit(self, wait=False):
+        '''Commit replayed runs
+
+        Commit the replayed runs in the order they were submitted. Each run is committed with
+        `SymTuner.add` before its key is yielded, so that the `temp*` data of SymTuner are those of
+        the run.
+
+        Args:
+            wait: Whether to wait until every submitted run is replayed. If `False`, runs are
+                committed up to the first run still being replayed.
+
+        Yields:
+            The key of each committed run.
+        '''
+
+        while len(self._runs) > 0:
+            key, replayed, parameters, flag, mode = self._runs[0]
+            if not wait and not replayed.done():
+                return
+            self._runs.popleft()
+            current = getattr(self.symtuner, 'mode', None)
+            if mode is not None:
+                self.symtuner.mode = mode
+            try:
+                self.symtuner.add(self.pconfig, None, parameters=parameters,
+                                  evaluation_kwargs=self.evaluation_kwargs, rm_cmd=self.rm_cmd,
+                                  flag=flag, replayed=replayed.result())
+            finally:
+                if mode is not None:
+                    self.symtuner.mode = current
+            yield key
+
+    def close(self):
+        '''Wait for the background stage to finish'''
+
+        if self._stage is not None:
+            self._stage.shutdown(wait=True)
+
+    def __len__(self):
+        return len(self._runs)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules are run from the repository root (see README.md)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
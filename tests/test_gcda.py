@@ -0,0 +1,71 @@
+import shutil
+import subprocess as sp
+
+import pytest
+
+from gcda import read_branches
+from gcov import detect_format
+from gcov import iter_json_branches
+
+
+SOURCE = r'''
+#include <stdio.h>
+#include <stdlib.h>
+
+static int classify(int x) {
+    switch (x % 4) {
+    case 0: return x > 10 ? 1 : 2;
+    case 1: return 3;
+    case 2:
+        if (x < 0 || x > 100)
+            return 4;
+        /* fall through */
+    default: return 5;
+    }
+}
+
+static int never_called(int x) {
+    return x && x > 1 ? 6 : 7;
+}
+
+int main(int argc, char **argv) {
+    int sum = 0;
+    for (int i = 1; i < argc; i++) {
+        int x = atoi(argv[i]);
+        while (x > 1000)
+            x /= 2;
+        sum += classify(x);
+    }
+    if (argc > 100)
+        sum += never_called(argc);
+    printf("%d\n", sum);
+    return sum == 0;
+}
+'''
+
+
+pytestmark = pytest.mark.skipif(shutil.which('gcc') is None or shutil.which('gcov') is None
+                                 or detect_format('gcov') != 'json',
+                                 reason='gcc and gcov with --json-format are required')
+
+
+def json_branches(gcda, cwd):
+    stdout = sp.run(['gcov', '-b', '--json-format', '--stdout', str(gcda)], stdout=sp.PIPE,
+                    stderr=sp.DEVNULL, cwd=str(cwd), check=True).stdout
+    return sorted(iter_json_branches(stdout.splitlines(keepends=True)))
+
+
+@pytest.mark.parametrize('runs', [[['4']], [['4', '13', '5']],
+                                  [['4', '13', '5'], ['2', '102', '-2', '7', '5000']]])
+def test_read_branches_matches_gcov(tmp_path, runs):
+    (tmp_path / 'prog.c').write_text(SOURCE)
+    sp.run(['gcc', '--coverage', '-O0', '-c', 'prog.c', '-o', 'prog.o'], cwd=str(tmp_path),
+           check=True)
+    sp.run(['gcc', '--coverage', 'prog.o', '-o', 'prog'], cwd=str(tmp_path), check=True)
+    for args in runs:
+        sp.run([str(tmp_path / 'prog'), *args], stdout=sp.DEVNULL, cwd=str(tmp_path))
+
+    gcda = tmp_path / 'prog.gcda'
+    native = sorted(read_branches(str(gcda)))
+    assert native == json_branches(gcda, tmp_path)
+    assert len(native) > 0
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+
+from featmaker_subscript import klee_executor
+
+
+PCONFIG = {'pgm_name': 'grep', 'exec_dir': 'src', 'sym_options': '-sym-arg 3'}
+
+
+def sweep_commands(max_memory, parameters, **kwargs):
+    options = SimpleNamespace(n_scores=4, main_option='featmaker', total_budget=100,
+                              exploration_steps=1, binary_weights=False)
+    executor = klee_executor.klee_executor(PCONFIG, '/top', options)
+    scheduler = klee_executor.klee_scheduler(executor, None, n_jobs=options.n_scores,
+                                             max_memory=max_memory)
+    for j in range(options.n_scores):
+        run_parameters = dict(parameters)
+        run_parameters['-output-dir'] = f'/top/result/iteration-1/{j}'
+        scheduler.submit((j, run_parameters), iteration=1, parameters=run_parameters,
+                         weight_idx=j, flag2='parallel', **kwargs)
+    return [cmd for _, cmd, _ in scheduler.pending]
+
+
+def memory_options(cmd):
+    return [arg for arg in cmd if arg.lstrip('-').startswith('max-memory=')]
+
+
+@pytest.mark.parametrize('flag', ['featmaker', 'symtuner'])
+@pytest.mark.parametrize('sampled, expected', [(None, ['--max-memory=1000']),
+                                               (500, ['--max-memory=500']),
+                                               (3000, ['--max-memory=1000'])])
+def test_sweep_passes_a_single_max_memory(flag, sampled, expected):
+    parameters = {'-max-time': 120}
+    if sampled is not None:
+        parameters['-max-memory'] = sampled
+    for cmd in sweep_commands(4000, parameters, flag=flag):
+        if flag == 'featmaker':
+            # Sampled parameters are not passed to the FeatMaker runs
+            assert memory_options(cmd) == ['--max-memory=1000']
+        else:
+            assert memory_options(cmd) == expected
+
+
+def test_sweep_keeps_the_sampled_max_memory_without_a_cap():
+    parameters = {'-max-time': 120, '-max-memory': 500}
+    for cmd in sweep_commands(None, parameters, flag='symtuner'):
+        assert memory_options(cmd) == ['-max-memory=500']
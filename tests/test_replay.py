@@ -0,0 +1,115 @@
+import os
+import shutil
+import struct
+import subprocess as sp
+import time
+
+import pytest
+
+import replay
+from replay import ReplayEngine
+from replay import replay_batch
+
+
+# klee-replay is not built in the repository, so a binary is looked up in the environment
+KLEE_REPLAY = os.environ.get('KLEE_REPLAY', replay.KLEE_REPLAY_BIN)
+
+SOURCE = r'''
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+int main(int argc, char **argv) {
+    if (argc < 2)
+        return 0;
+    if (!strcmp(argv[1], "loop"))
+        for (;;)
+            ;
+    if (!strcmp(argv[1], "segv"))
+        raise(SIGSEGV);
+    if (!strcmp(argv[1], "abort"))
+        abort();
+    if (!strcmp(argv[1], "fail"))
+        return 3;
+    if (argv[1][0] == 'x')
+        puts("x");
+    else
+        puts("y");
+    return 0;
+}
+'''
+
+# Arguments of each testcase, or `None` for an invalid `.ktest` file
+TESTCASES = [['x'], ['loop'], ['segv'], ['abort'], ['fail'], ['y'], None, ['x']]
+
+STATUSES = ['NORMAL', 'TIMED OUT', 'CRASHED signal 11', 'CRASHED signal 6', 'ABNORMAL 3',
+            'NORMAL', 'NONE', 'NORMAL']
+
+
+pytestmark = pytest.mark.skipif(shutil.which('gcc') is None or shutil.which('gcov') is None
+                                 or not replay.supports_batch(KLEE_REPLAY),
+                                 reason='gcc, gcov, and klee-replay (KLEE_REPLAY) are required')
+
+
+def write_ktest(path, args):
+    data = b'KTEST' + struct.pack('>II', 3, len(args))
+    for arg in args:
+        data += struct.pack('>I', len(arg)) + arg.encode()
+    # No symbolic arguments and no objects
+    data += struct.pack('>III', 0, 0, 0)
+    path.write_bytes(data)
+
+
+@pytest.fixture
+def program(tmp_path):
+    src = tmp_path / 'tree' / 'src'
+    src.mkdir(parents=True)
+    (src / 'prog.c').write_text(SOURCE)
+    sp.run(['gcc', '--coverage', '-O0', '-o', 'prog', 'prog.c'], cwd=str(src), check=True)
+    ktests = tmp_path / 'klee-out-0'
+    ktests.mkdir()
+    for i, args in enumerate(TESTCASES, 1):
+        ktest = ktests / f'test{i:06d}.ktest'
+        if args is None:
+            ktest.write_bytes(b'invalid')
+        else:
+            write_ktest(ktest, ['prog'] + args)
+    return {'pgm_name': 'prog', 'gcov_path': str(src), 'exec_dir': 'src',
+            'gcda_file': '*.gcda'}, ktests
+
+
+def test_replay_batch(program):
+    pconfig, ktests = program
+    start = time.monotonic()
+    results = list(replay_batch('./prog', ktests, cwd=pconfig['gcov_path'],
+                                klee_replay=KLEE_REPLAY, timeout=0.3))
+    # The looping testcase is stopped before klee-replay's own timeout of a whole second
+    assert time.monotonic() - start < 1
+    assert [testcase for testcase, _, _, _ in results] == sorted(map(str, ktests.iterdir()))
+    assert [status for _, status, _, _ in results] == STATUSES
+    assert [crash for _, _, crash, _ in results] == [None, None, 11, 6, None, None, None, None]
+    assert all(not os.path.exists(replay_dir) for _, _, _, replay_dir in results
+               if replay_dir is not None)
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_batches_match_single_replays(program, monkeypatch, n_workers):
+    pconfig, ktests = program
+    testcases = sorted(map(str, ktests.iterdir()))
+    engine = ReplayEngine(pconfig, n_workers=n_workers, klee_replay=KLEE_REPLAY,
+                          replay_timeout=0.3)
+    engine.prefetch(testcases[0])
+    batched = engine.evaluate(testcases)
+    engine.close()
+    # `.gcda` files are only written into the replay directories
+    assert not list((ktests.parent / 'tree').rglob('*.gcda'))
+
+    monkeypatch.setattr(replay, 'supports_batch', lambda klee_replay: False)
+    engine = ReplayEngine(pconfig, klee_replay=KLEE_REPLAY, replay_timeout=0.3)
+    assert engine.workspaces is not None
+    single = engine.evaluate(testcases)
+    engine.close()
+
+    assert [sorted(covered) for covered, _ in batched] == [sorted(c) for c, _ in single]
+    assert len(batched[0][0]) > 0
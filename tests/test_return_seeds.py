@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+pytest.importorskip('sklearn')
+
+from symchestra_subscript.returnSeeds import QueryTrie
+
+
+def naive_growing_prefixes(seeds, lines):
+    depth = 0
+    for seed in seeds:
+        common = 0
+        while common < min(len(seed), len(lines)) and seed[common] == lines[common]:
+            common += 1
+        depth = max(depth, common)
+        yield depth
+
+
+def build_trie(seeds):
+    trie = QueryTrie()
+    for seed in seeds:
+        trie.insert(seed)
+    return trie
+
+
+def test_growing_prefixes():
+    seeds = [['a', 'b', 'c'], ['a', 'x'], ['a', 'b', 'c', 'd', 'e'], ['y']]
+    trie = build_trie(seeds)
+    assert list(trie.growing_prefixes(['a', 'b', 'c', 'd', 'z'])) == [3, 3, 4, 4]
+    assert list(trie.growing_prefixes(['a', 'x', 'q'])) == [1, 2, 2, 2]
+    assert list(trie.growing_prefixes(['z'])) == [0, 0, 0, 0]
+    assert list(trie.growing_prefixes([])) == [0, 0, 0, 0]
+    assert list(QueryTrie().growing_prefixes(['a'])) == []
+
+
+def test_growing_prefixes_match_naive():
+    rng = random.Random(0)
+
+    def lines():
+        return [rng.choice('abc') for _ in range(rng.randint(0, 8))]
+
+    for _ in range(2000):
+        seeds = [lines() for _ in range(rng.randint(0, 8))]
+        trie = build_trie(seeds)
+        for _ in range(5):
+            bad = lines()
+            assert list(trie.growing_prefixes(bad)) == list(naive_growing_prefixes(seeds, bad))
@@ -0,0 +1,79 @@
+import random
+
+import numpy as np
+import pytest
+
+from branch_coverage import BranchInterner
+from branch_coverage import Coverage
+from setcover import greedy_cover
+from setcover import sparse_cover
+
+
+def naive_greedy_cover(sets, limit=None):
+    # SymTuner.extract_core_parameters and KLEESymTuner top seeds: stable-sort the remaining
+    # coverages by size, pick the first and subtract it from the others
+    remaining = [(set(branches), idx) for idx, branches in enumerate(sets)]
+    accumulated = set()
+    picked = []
+    while remaining and (limit is None or len(picked) < limit):
+        remaining = sorted(remaining, key=lambda elem: len(elem[0]), reverse=True)
+        top, idx = remaining.pop(0)
+        if len(top) == 0:
+            break
+        accumulated |= top
+        picked.append(idx)
+        remaining = [(branches - accumulated, i) for branches, i in remaining]
+    return picked
+
+
+def naive_sparse_cover(sets):
+    # FeatureGenerator.cluster_setcover over a dense incidence matrix
+    branches = sorted(set().union(*sets)) if sets else []
+    matrix = np.zeros((len(sets), len(branches)), dtype=bool)
+    column = {br: i for i, br in enumerate(branches)}
+    for row, each in enumerate(sets):
+        for br in each:
+            matrix[row, column[br]] = True
+    sizes = matrix.sum(axis=1)
+    covered = np.zeros(len(branches), dtype=bool)
+    picked = []
+    while covered.sum() < len(branches):
+        gains = matrix.sum(axis=1)
+        ties = np.where(gains == gains.max())[0]
+        chosen = int(ties[sizes[ties].argmax()])
+        picked.append(chosen)
+        covered |= matrix[chosen]
+        matrix[:, covered] = False
+    return picked
+
+
+def random_sets(rng):
+    n_branches = rng.randint(1, 12)
+    return [set(rng.sample(range(n_branches), rng.randint(0, n_branches)))
+            for _ in range(rng.randint(0, 10))]
+
+
+def as_coverages(sets):
+    interner = BranchInterner()
+    return [Coverage((f'f.c {br}' for br in sorted(each)), interner) for each in sets]
+
+
+@pytest.mark.parametrize('limit', [None, 1, 3, 10])
+def test_greedy_cover_matches_sort_loop(limit):
+    rng = random.Random(limit)
+    for _ in range(2000):
+        sets = random_sets(rng)
+        assert greedy_cover(as_coverages(sets), limit=limit) == naive_greedy_cover(sets, limit)
+
+
+def test_greedy_cover_breaks_ties_by_previous_gains():
+    # 1 and 2 tie on the second round; 2 gained more on the first one
+    sets = [{0, 1, 2}, {3}, {0, 4}]
+    assert greedy_cover(as_coverages(sets)) == naive_greedy_cover(sets) == [0, 2, 1]
+
+
+def test_sparse_cover_matches_dense_loop():
+    rng = random.Random(0)
+    for _ in range(2000):
+        sets = random_sets(rng)
+        assert sparse_cover(as_coverages(sets)) == naive_sparse_cover(sets)
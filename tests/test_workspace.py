@@ -0,0 +1,53 @@
+import os
+import shutil
+import subprocess as sp
+
+import pytest
+
+from workspace import WorkspaceManager
+from workspace import prefix_strip
+
+
+pytestmark = pytest.mark.skipif(shutil.which('gcc') is None, reason='gcc is required')
+
+
+@pytest.fixture
+def linked_tree(tmp_path):
+    # Build tree reached through a symbolic link at a different depth than the tree itself
+    tree = tmp_path / 'obj-gcov'
+    (tree / 'src').mkdir(parents=True)
+    link = tmp_path / 'a' / 'b' / 'obj-gcov'
+    link.parent.mkdir(parents=True)
+    link.symlink_to(tree)
+    (link / 'src' / 'prog.c').write_text('int main(int argc, char **argv) {\n'
+                                         '    return argc > 1 ? 1 : 0;\n}\n')
+    # Compile through the link (GCC takes the directory from PWD), so the link is compiled in
+    env = dict(os.environ, PWD=str(link / 'src'))
+    sp.run(['gcc', '--coverage', '-O0', '-c', 'prog.c', '-o', 'prog.o'], cwd=str(link / 'src'),
+           env=env, check=True)
+    sp.run(['gcc', '--coverage', 'prog.o', '-o', 'prog'], cwd=str(link / 'src'), env=env,
+           check=True)
+    assert str(link) in (tree / 'src' / 'prog').read_bytes().decode(errors='replace')
+    return tree, link
+
+
+def test_prefix_strip_follows_compiled_paths(linked_tree):
+    tree, link = linked_tree
+    assert prefix_strip(tree / 'src' / 'prog', tree) == len(link.parts) - 1
+    assert prefix_strip(tree / 'src' / 'prog.c', tree) is None
+
+
+def test_workspaces_collect_gcdas(linked_tree, tmp_path):
+    tree, link = linked_tree
+    pconfig = {'pgm_name': 'prog', 'exec_dir': '/src', 'gcov_path': str(link) + '/src',
+               'gcov_file': ''}
+    manager = WorkspaceManager(pconfig, n_workspaces=2, workspace_dir=str(tmp_path / 'ws'))
+    try:
+        for _ in range(2):
+            with manager.lease() as workspace:
+                sp.run(['./prog'], cwd=str(workspace.exec_dir), env=workspace.env)
+                assert [gcda.exists() for gcda in workspace.gcdas] == [True]
+    finally:
+        manager.close()
+    assert not os.path.exists(str(tree / 'src' / 'prog.gcda'))
+    assert not os.path.exists(str(link / 'src' / 'prog.gcda'))
@@ -0,0 +1,143 @@
+'''Weight and feature files for the FeatMaker search strategy
+
+This module contains the reader and writer of the files the FeatMaker search strategy of KLEE
+(`--search=auto`) reads its features and weights from. Besides the text format with one feature or
+weight per line, a binary format is supported. A binary weight file holds the weights of every
+weight index of an iteration, so that it is written once per iteration and each KLEE launch only
+reads its own column (`--weight-index`).
+
+Binary weight files start with a 16 bytes header: the magic `FMWT`, the format version, the number
+of features and the number of weight indices, all little-endian 32 bits unsigned integers. The
+header is followed by the little-endian doubles of each weight index in turn. Binary feature files
+start with the magic `FMFT`, the format version and the number of features, followed by each
+feature as its length and its UTF-8 bytes.
+'''
+
+import struct
+
+import numpy as np
+
+
+WEIGHT_MAGIC = b'FMWT'
+FEATURE_MAGIC = b'FMFT'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sIII')
+_FEATURE_HEADER = struct.Struct('<4sII')
+_LENGTH = struct.Struct('<I')
+
+
+def _has_magic(path, magic):
+    with open(path, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+
+def write_weights(path, weights):
+    '''Write a binary weight file
+
+    Args:
+        path: A path to the weight file.
+        weights: A 2-dimensional array of weights. `weights[widx]` is the weights of the features
+            for the weight index `widx`.
+    '''
+
+    weights = np.ascontiguousarray(weights, dtype='<f8')
+    n_weights, n_features = weights.shape
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(WEIGHT_MAGIC, VERSION, n_features, n_weights))
+        f.write(weights.tobytes())
+
+
+def write_weights_text(path, weights):
+    '''Write a text weight file
+
+    Args:
+        path: A path to the weight file.
+        weights: A list of weights of the features.
+    '''
+
+    with open(path, 'w') as f:
+        for w in weights:
+            f.write(f"{w}\n")
+
+
+def read_weights(path, widx=None):
+    '''Read a weight file
+
+    Read a weight file either in the binary format or in the text format. Binary weight files are
+    memory-mapped.
+
+    Args:
+        path: A path to the weight file.
+        widx: A weight index to read. If not specified, the weights of all weight indices are read.
+            Ignored for text weight files, which hold a single weight index.
+
+    Returns:
+        An array of weights. If `widx` is not specified and the file is in the binary format, a
+        2-dimensional array of which `[widx]` is the weights of the weight index `widx`.
+    '''
+
+    if not _has_magic(path, WEIGHT_MAGIC):
+        return np.loadtxt(path, dtype=float, ndmin=1)
+    with open(path, 'rb') as f:
+        _, version, n_features, n_weights = _HEADER.unpack(f.read(_HEADER.size))
+    if version != VERSION:
+        raise ValueError(f'Unsupported weight file version: {version}')
+    weights = np.memmap(path, dtype='<f8', mode='r', offset=_HEADER.size,
+                        shape=(n_weights, n_features))
+    return weights if widx is None else weights[widx]
+
+
+def write_features(path, features):
+    '''Write a binary feature file
+
+    Args:
+        path: A path to the feature file.
+        features: A list of features in the order of the weights.
+    '''
+
+    with open(path, 'wb') as f:
+        f.write(_FEATURE_HEADER.pack(FEATURE_MAGIC, VERSION, len(features)))
+        for feature in features:
+            encoded = feature.encode()
+            f.write(_LENGTH.pack(len(encoded)))
+            f.write(encoded)
+
+
+def write_features_text(path, features):
+    '''Write a text feature file
+
+    Args:
+        path: A path to the feature file.
+        features: A list of features in the order of the weights.
+    '''
+
+    with open(path, 'w') as f:
+        for feature in features:
+            f.write(feature + "\n")
+
+
+def read_features(path):
+    '''Read a feature file
+
+    Read a feature file either in the binary format or in the text format.
+
+    Args:
+        path: A path to the feature file.
+
+    Returns:
+        A list of features in the order of the weights.
+    '''
+
+    if not _has_magic(path, FEATURE_MAGIC):
+        with open(path, 'r') as f:
+            return f.read().splitlines()
+    with open(path, 'rb') as f:
+        _, version, count = _FEATURE_HEADER.unpack(f.read(_FEATURE_HEADER.size))
+        if version != VERSION:
+            raise ValueError(f'Unsupported feature file version: {version}')
+        features = []
+        for _ in range(count):
+            length, = _LENGTH.unpack(f.read(_LENGTH.size))
+            features.append(f.read(length).decode())
+    return features
@@ -0,0 +1,260 @@
+'''Gcov build tree workspaces for SymTuner
+
+This module contains the workspace manager handing out isolated copies of the gcov build tree to
+replay workers. The copies are cloned once on startup with reflinks where the file system supports
+them, and with hard links (or plain copies) otherwise, so preparing a workspace costs little more
+than walking the tree. Since instrumented binaries write `.gcda` files to the absolute object
+directory they were built in, each workspace redirects them into its own copy with `GCOV_PREFIX`
+and `GCOV_PREFIX_STRIP`. The strip count is derived from the `.gcda` paths compiled into the
+binary, which need not match the location of the tree (e.g. when it is reached through a symbolic
+link).
+'''
+
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from queue import Queue
+import atexit
+import fcntl
+import os
+import re
+import shutil
+import tempfile
+
+# from symtuner.gcov import expand_gcdas
+# from symtuner.logger import get_logger
+from gcov import expand_gcdas
+from logger import get_logger
+
+
+# ioctl request cloning a file (_IOW(0x94, 9, int)), supported by Btrfs, XFS, and others
+FICLONE = 0x40049409
+
+# Absolute `.gcda` path stored as a C string in an instrumented binary
+_GCDA_PATH = re.compile(rb'(/[\x20-\x7e]*?\.gcda)\x00')
+
+
+def gcov_root(pconfig):
+    '''Get the root of the gcov build tree
+
+    Get the root of the gcov build tree. Drivers store the directory of the executable in
+    `pconfig['gcov_path']` (i.e. the root followed by `pconfig['exec_dir']`).
+
+    Args:
+        pconfig: A program configuration loaded from `configs/*.json`.
+
+    Returns:
+        A path to the root of the gcov build tree.
+    '''
+
+    gcov_path = pconfig['gcov_path']
+    exec_dir = pconfig.get('exec_dir', '')
+    if exec_dir and gcov_path.endswith(exec_dir):
+        gcov_path = gcov_path[:-len(exec_dir)]
+    return Path(gcov_path)
+
+
+def compiled_gcdas(binary):
+    '''Get the `.gcda` paths compiled into a binary
+
+    Args:
+        binary: An executable instrumented with `--coverage`.
+
+    Returns:
+        A list of the absolute `.gcda` paths the executable writes to, or an empty list if the
+        executable can not be read.
+    '''
+
+    try:
+        with open(str(binary), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    return [path.decode() for path in _GCDA_PATH.findall(data)]
+
+
+def prefix_strip(binary, root):
+    '''Get the `GCOV_PREFIX_STRIP` redirecting `.gcda` files into a tree
+
+    Find how many leading components of the `.gcda` paths compiled into a binary have to be
+    stripped, so that the rest of each path is the path of its `.gcno` file relative to the root
+    of the gcov build tree.
+
+    Args:
+        binary: An executable instrumented with `--coverage`.
+        root: The root of the gcov build tree.
+
+    Returns:
+        The number of components to strip, or `None` if no compiled-in path is found in the tree.
+    '''
+
+    root = Path(root)
+    relatives = {gcno.relative_to(root).with_suffix('.gcda').parts
+                 for gcno in root.rglob('*.gcno')}
+    strips = Counter()
+    for path in compiled_gcdas(binary):
+        parts = Path(path).parts[1:]
+        for n in range(len(parts)):
+            if parts[n:] in relatives:
+                strips[n] += 1
+                break
+    if not strips:
+        return None
+    return strips.most_common(1)[0][0]
+
+
+def clone_file(src, dst):
+    '''Clone a file
+
+    Clone a file with a reflink if possible, or with a hard link if not. Files are copied only if
+    neither is possible (e.g. across file systems).
+
+    Args:
+        src: A file to clone.
+        dst: A path of the clone.
+
+    Returns:
+        The path of the clone.
+    '''
+
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+        return dst
+    except OSError:
+        if os.path.lexists(dst):
+            os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return dst
+    except OSError:
+        return shutil.copy2(src, dst)
+
+
+class Workspace:
+    '''Gcov build tree workspace
+
+    Workspace class. A workspace is a gcov build tree replays run in, together with the
+    environment redirecting the `.gcda` files of the instrumented binary into the tree.
+    '''
+
+    def __init__(self, root, exec_dir, env=None, gcov_file=''):
+        '''Create a workspace
+
+        Args:
+            root: The root of the gcov build tree.
+            exec_dir: The directory of the executable in the tree.
+            env: An environment to run the executable with. If not specified, the executable
+                writes `.gcda` files where it was built.
+            gcov_file: A string of space-separated patterns of `.gcov` files, relative to
+                `exec_dir` (i.e. `pconfig['gcov_file']`).
+        '''
+
+        self.root = Path(root)
+        self.exec_dir = Path(exec_dir)
+        self.env = env
+        self.gcov_file = gcov_file
+        # Every `.gcda` file the executable may write sits next to its `.gcno` file
+        self.gcdas = [gcno.with_suffix('.gcda') for gcno in self.root.rglob('*.gcno')]
+
+    def reset(self):
+        '''Reset the coverage counters
+
+        Remove the `.gcda` files (and the `.gcov` files) of the tree, so that the next replay
+        starts from zero counters.
+        '''
+
+        for path in self.gcdas + expand_gcdas(self.gcov_file, self.exec_dir):
+            try:
+                os.unlink(str(path))
+            except FileNotFoundError:
+                pass
+
+
+class WorkspaceManager:
+    '''Gcov build tree workspace manager
+
+    Workspace manager class. This prepares workspaces on creation and leases them to workers, one
+    worker per workspace at a time.
+    '''
+
+    def __init__(self, pconfig, n_workspaces=1, workspace_dir=None):
+        '''Create a workspace manager
+
+        Create a workspace manager. If more than one workspace is requested, the gcov build tree is
+        cloned once per workspace under `workspace_dir`. The clones may share files with the
+        original tree through hard links, like a replay in the original tree would write to them.
+
+        Args:
+            pconfig: A program configuration loaded from `configs/*.json`.
+            n_workspaces: Number of workspaces. With a single workspace, the original gcov build
+                tree is used in place. By default, this will be set as 1.
+            workspace_dir: A directory to keep the clones of the gcov build tree. If not
+                specified, a temporary directory is created and removed at exit.
+        '''
+
+        self.n_workspaces = max(1, n_workspaces)
+        self._temp_dir = None
+        self.workspaces = []
+
+        gcov_file = pconfig.get('gcov_file', '')
+        root = Path(os.path.realpath(str(gcov_root(pconfig))))
+        exec_dir = pconfig.get('exec_dir', '').strip('/')
+        if self.n_workspaces == 1:
+            self.workspaces.append(Workspace(root, Path(pconfig['gcov_path']),
+                                             gcov_file=gcov_file))
+        else:
+            if workspace_dir is None:
+                self._temp_dir = tempfile.mkdtemp(prefix='symtuner-replay-')
+                atexit.register(self.close)
+                workspace_dir = self._temp_dir
+            strip = prefix_strip(root / exec_dir / pconfig['pgm_name'], root)
+            if strip is None:
+                strip = len(root.parts) - 1
+                get_logger().warning(f'No .gcda path of the gcov build tree found in '
+                                     f'{pconfig["pgm_name"]}. Assuming it was built at: {root}')
+            for i in range(self.n_workspaces):
+                worker_root = Path(workspace_dir).absolute() / f'worker-{i}'
+                if not worker_root.exists():
+                    shutil.copytree(str(root), str(worker_root), symlinks=True,
+                                    ignore=shutil.ignore_patterns('*.gcda', '*.gcov'),
+                                    copy_function=clone_file)
+
+                # Redirect `<root>/<obj>.gcda` to `<worker_root>/<obj>.gcda`
+                env = os.environ.copy()
+                env['GCOV_PREFIX'] = str(worker_root)
+                env['GCOV_PREFIX_STRIP'] = str(strip)
+                self.workspaces.append(Workspace(worker_root, worker_root / exec_dir, env,
+                                                 gcov_file))
+            get_logger().info(f'{self.n_workspaces} replay workspaces prepared at: '
+                              f'{workspace_dir}')
+
+        self._free = Queue()
+        for workspace in self.workspaces:
+            self._free.put(workspace)
+
+    @contextmanager
+    def lease(self):
+        '''Lease a workspace
+
+        Lease a workspace, waiting until one is free. The workspace is reset before it is handed
+        out, and returned to the manager on exit.
+
+        Yields:
+            A `Workspace` owned by the caller until exit.
+        '''
+
+        workspace = self._free.get()
+        try:
+            workspace.reset()
+            yield workspace
+        finally:
+            self._free.put(workspace)
+
+    def close(self):
+        '''Remove the temporary workspaces if any'''
+
+        if self._temp_dir is not None:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None